@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(src_path)
+
+BENCHMARK_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'benchmarks'
+)
+ENGINES = ['numpy', 'evidently']
+
+
+# The frame validate.run() gets from do_validate(): the snapshot columns without
+# the forecasts, here of synthetic orders
+def validation_data(rows, seed):
+    from ingest import extra_features, transform
+    from synthetic_data import generate_orders
+    from validate import remove_forecast_columns
+
+    data = extra_features(transform(generate_orders(rows, seed)))
+    return remove_forecast_columns(data)
+
+
+def drift_by_columns(result):
+    return result['metrics'][1]['result']['drift_by_columns']
+
+
+# Columns the engines disagree on, compared on the columns both tested
+def disagreements(results):
+    if not all(engine in results for engine in ENGINES):
+        return None
+    numpy_drift = drift_by_columns(results['numpy'])
+    evidently_drift = drift_by_columns(results['evidently'])
+    return sorted(
+        col
+        for col in numpy_drift
+        if col in evidently_drift
+        and numpy_drift[col]['drift_detected'] != evidently_drift[col]['drift_detected']
+    )
+
+
+def run_benchmark(rows, engines=ENGINES, repeat=3, seed=42):
+    import validate
+
+    data = validation_data(rows, seed)
+    timings = []
+    results = {}
+    for engine in engines:
+        timing = {'rows': rows, 'engine': engine}
+        try:
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                results[engine] = validate.run(data, engine=engine)
+                seconds.append(time.perf_counter() - start)
+            timing['best_seconds'] = min(seconds)
+            timing['rows_per_second'] = rows / timing['best_seconds']
+            print(f"{rows} rows, {engine}: {timing['best_seconds']:.2f}s")
+        except Exception as error:
+            timing['error'] = f"{type(error).__name__}: {error}"
+            print(f"{rows} rows, {engine}: failed, {timing['error']}")
+        timings.append(timing)
+
+    return timings, disagreements(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the numpy drift engine against the Evidently report"
+    )
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000])
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    os.environ.setdefault('METRICS_LOG', '0')
+    run = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'results': [],
+    }
+    for rows in args.rows:
+        timings, columns = run_benchmark(rows, args.engines, args.repeat, args.seed)
+        run['results'].extend(timings)
+        if columns is not None:
+            print(f"{rows} rows: the engines disagree on {len(columns)} columns")
+            run.setdefault('disagreements', {})[rows] = columns
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    output_path = args.output or os.path.join(
+        BENCHMARK_DIR, f"drift_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(output_path, 'w') as fp:
+        json.dump(run, fp, indent=4)
+    print(f"Results saved to {output_path}")
+    return run
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+
+import joblib
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(src_path)
+
+from column_generator import build_training_features, feature_matrix
+from compiled_model import CompiledEnsemble, parity_error
+from predict import HUB_IDS, TARGET_COLUMNS, compiled_model_path, model_path
+from snapshot import read_snapshot, snapshot_columns
+
+EFS_MOUNT_POINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SNAPSHOT_PATH = os.path.join(EFS_MOUNT_POINT, 'data', 'current_state.parquet')
+OUTPUT_PATH = os.path.join(EFS_MOUNT_POINT, 'data', 'benchmark_inference.json')
+
+# Rows scored per model, and times each measurement is repeated (best is kept)
+DEFAULT_ROWS = 10000
+REPEAT = 3
+
+
+def best_time(function, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
+
+
+# Load time, rows/sec and parity of the native and compiled form of a model
+def benchmark_model(target_column, hub_id, X):
+    load_native, model = best_time(
+        lambda: joblib.load(model_path(target_column, hub_id))
+    )
+    load_compiled, compiled = best_time(
+        lambda: CompiledEnsemble.load(compiled_model_path(target_column, hub_id))
+    )
+    predict_native, _ = best_time(lambda: model.predict(X))
+    predict_compiled, _ = best_time(lambda: compiled.predict(X))
+
+    return {
+        'model': f"{target_column}_{hub_id}",
+        'rows': X.shape[0],
+        'native_load_seconds': load_native,
+        'compiled_load_seconds': load_compiled,
+        'native_rows_per_second': X.shape[0] / predict_native,
+        'compiled_rows_per_second': X.shape[0] / predict_compiled,
+        'max_difference': parity_error(model, compiled, X),
+    }
+
+
+def main(rows=DEFAULT_ROWS):
+    features = build_training_features(snapshot_columns(SNAPSHOT_PATH))
+    data = read_snapshot(SNAPSHOT_PATH, columns=['hub_id'] + features, hub_ids=HUB_IDS)
+
+    results = []
+    for hub_id in HUB_IDS:
+        X = feature_matrix(data[data.hub_id == hub_id].iloc[:rows], features)
+        for target_column in TARGET_COLUMNS:
+            if not os.path.exists(compiled_model_path(target_column, hub_id)):
+                print(f"No compiled model for {target_column} of hub {hub_id}")
+                continue
+            result = benchmark_model(target_column, hub_id, X)
+            print(
+                "{model}: load {native_load_seconds:.3f}s -> "
+                "{compiled_load_seconds:.3f}s, {native_rows_per_second:.0f} -> "
+                "{compiled_rows_per_second:.0f} rows/s, "
+                "max difference {max_difference:.2g}".format(**result)
+            )
+            results.append(result)
+
+    with open(OUTPUT_PATH, 'w') as fp:
+        json.dump(results, fp, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS)
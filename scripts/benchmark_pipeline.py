@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import multiprocessing
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(src_path)
+
+BENCHMARK_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'benchmarks'
+)
+# The database the DB stages run against, created on the docker-compose server
+# (DB_ENDPOINT) so the data_warehouse table is left alone
+BENCHMARK_DB_NAME = os.getenv('BENCHMARK_DB_NAME', 'bags_benchmark')
+
+DEFAULT_ROWS = [10000, 100000]
+STAGES = [
+    'generate',
+    'upload',
+    'download',
+    'ingest',
+    'transform',
+    'train',
+    'hpo',
+    'predict',
+    'validate',
+]
+DB_STAGES = ['upload', 'download', 'predict']
+# Trials per HPO study, one study per hub for the bags target
+HPO_TRIALS = int(os.getenv('BENCHMARK_HPO_TRIALS', 3))
+
+
+def csv_path(workdir):
+    return os.path.join(workdir, 'orders.csv')
+
+
+def downloaded_csv_path(workdir):
+    return os.path.join(workdir, 'current_state.csv')
+
+
+def snapshot_path(workdir):
+    return os.path.join(workdir, 'current_state.parquet')
+
+
+# Stage functions run in a fresh process each, on the files the previous
+# stages left in workdir. They return the number of rows they processed.
+def stage_generate(workdir, rows, seed):
+    from synthetic_data import write_orders_csv
+
+    write_orders_csv(csv_path(workdir), rows, seed)
+    return rows
+
+
+def stage_upload(workdir, rows, seed):
+    from upload_csv import do_upload
+
+    return do_upload(csv_path(workdir))
+
+
+def stage_download(workdir, rows, seed):
+    from download import download_to_csv
+
+    download_to_csv(downloaded_csv_path(workdir), incremental=False)
+    # The table holds the rows stage_upload loaded
+    return rows
+
+
+def stage_ingest(workdir, rows, seed):
+    import pandas as pd
+    from download import STREAM_ITERSIZE
+    from ingest import ingest_chunks
+    from snapshot import write_snapshot
+
+    # The downloaded table when the DB stages ran, the generated CSV otherwise
+    source = downloaded_csv_path(workdir)
+    if not os.path.exists(source):
+        source = csv_path(workdir)
+    chunks = pd.read_csv(
+        source, chunksize=STREAM_ITERSIZE, float_precision='round_trip'
+    )
+    data = ingest_chunks(chunks)
+    write_snapshot(data, snapshot_path(workdir))
+    return data.shape[0]
+
+
+def stage_transform(workdir, rows, seed):
+    from snapshot import read_snapshot, write_snapshot
+    from transform import transform_data
+
+    data = transform_data(read_snapshot(snapshot_path(workdir)))
+    write_snapshot(data, snapshot_path(workdir))
+    return data.shape[0]
+
+
+def stage_train(workdir, rows, seed):
+    import train
+    from snapshot import read_snapshot
+
+    # Models are saved to workdir/models, where stage_predict loads them from
+    train.EFS_MOUNT_POINT = workdir
+    os.makedirs(os.path.join(workdir, 'models'), exist_ok=True)
+    data = read_snapshot(snapshot_path(workdir), hub_ids=train.HUB_IDS)
+    train.train_models(data)
+    return data.shape[0]
+
+
+def stage_hpo(workdir, rows, seed):
+    import hpo_xgboost
+    from hpo_dataset import StudyDataset
+    from parallel_hpo import run_studies
+    from snapshot import read_snapshot
+
+    data = read_snapshot(snapshot_path(workdir), hub_ids=hpo_xgboost.HUB_IDS)
+    studies = {}
+    for hub_id in hpo_xgboost.HUB_IDS:
+        df = hpo_xgboost.data_for_target(data, 'bags', hub_id)
+        studies[hub_id] = (
+            hpo_xgboost.space,
+            HPO_TRIALS,
+            StudyDataset(df, 'bags_used', hub_id),
+        )
+    run_studies(hpo_xgboost.objective, studies, seed=seed)
+    return data.shape[0]
+
+
+def stage_predict(workdir, rows, seed):
+    import predict
+    from column_generator import build_training_features
+
+    predict.EFS_MOUNT_POINT = workdir
+    data = predict.load_data()
+    features = build_training_features(data.columns)
+    for hub_id in data['hub_id'].unique():
+        data = predict.make_predictions(data, hub_id, features)
+    predict.update_postgresql(data)
+    return data.shape[0]
+
+
+def stage_validate(workdir, rows, seed):
+    import validate
+    from snapshot import read_snapshot, snapshot_columns
+
+    path = snapshot_path(workdir)
+    columns = [col for col in snapshot_columns(path) if not col.endswith('_forecast')]
+    data = read_snapshot(path, columns=columns, start=validate.REFERENCE_START_DATE)
+    validate.run(data)
+    return data.shape[0]
+
+
+STAGE_FUNCTIONS = {stage: globals()[f'stage_{stage}'] for stage in STAGES}
+
+
+# Body of the stage process: wall and CPU time (of the process and the workers
+# it started), peak RSS, and throughput of the stage, or the error it raised
+def run_stage(stage, workdir, rows, seed, queue):
+    start_wall = time.perf_counter()
+    try:
+        rows_processed = STAGE_FUNCTIONS[stage](workdir, rows, seed)
+    except Exception as error:
+        queue.put({'error': f"{type(error).__name__}: {error}"})
+        return
+    wall_seconds = time.perf_counter() - start_wall
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    queue.put(
+        {
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': usage.ru_utime
+            + usage.ru_stime
+            + children.ru_utime
+            + children.ru_stime,
+            # ru_maxrss is in KB on Linux
+            'peak_rss_mb': max(usage.ru_maxrss, children.ru_maxrss) / 1024,
+            'rows_processed': rows_processed,
+            'rows_per_second': rows_processed / max(wall_seconds, 1e-9),
+        }
+    )
+
+
+# Run a stage in a spawned process, so that its peak RSS and import costs are
+# its own and not those of the stages before it
+def measure(stage, workdir, rows, seed):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(
+        target=run_stage, args=(stage, workdir, rows, seed, queue)
+    )
+    process.start()
+    process.join()
+    if queue.empty():
+        return {'error': f"process exited with code {process.exitcode}"}
+    return queue.get()
+
+
+# Create the benchmark database if needed and point the DB stages at it
+def prepare_database():
+    import psycopg2
+    from config import connection_params
+
+    conn = psycopg2.connect(**connection_params())
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %s", (BENCHMARK_DB_NAME,)
+        )
+        if cur.fetchone() is None:
+            cur.execute(f"CREATE DATABASE {BENCHMARK_DB_NAME}")
+    conn.close()
+    # Inherited by the stage processes
+    os.environ['DB_NAME'] = BENCHMARK_DB_NAME
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=src_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(rows_list=DEFAULT_ROWS, stages=STAGES, seed=42):
+    if any(stage in DB_STAGES for stage in stages):
+        prepare_database()
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    results = []
+    for rows in rows_list:
+        with tempfile.TemporaryDirectory(dir=BENCHMARK_DIR) as workdir:
+            for stage in STAGES:
+                if stage not in stages and stage != 'generate':
+                    continue
+                result = {'rows': rows, 'stage': stage}
+                result.update(measure(stage, workdir, rows, seed))
+                results.append(result)
+                if 'error' in result:
+                    print(f"{rows} rows, {stage}: failed, {result['error']}")
+                else:
+                    print(
+                        "{rows} rows, {stage}: {wall_seconds:.2f}s wall, "
+                        "{cpu_seconds:.2f}s CPU, peak RSS {peak_rss_mb:.0f} MB, "
+                        "{rows_per_second:.0f} rows/s".format(**result)
+                    )
+
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'results': results,
+    }
+
+
+# Wall time of every (rows, stage) of a run relative to an earlier run
+def compare_runs(baseline_path, run_path):
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)
+    with open(run_path) as fp:
+        run = json.load(fp)
+
+    baseline_times = {
+        (result['rows'], result['stage']): result.get('wall_seconds')
+        for result in baseline['results']
+    }
+    for result in run['results']:
+        before = baseline_times.get((result['rows'], result['stage']))
+        after = result.get('wall_seconds')
+        if before is None or after is None:
+            continue
+        print(
+            f"{result['rows']} rows, {result['stage']}: "
+            f"{before:.2f}s -> {after:.2f}s ({after / before:.2f}x)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time and memory-profile the pipeline stages on synthetic data"
+    )
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument(
+        '--compare', nargs=2, metavar=('BASELINE', 'RUN'), help="Compare two runs"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_runs(*args.compare)
+        return None
+
+    run = run_benchmarks(args.rows, args.stages, args.seed)
+    output_path = args.output or os.path.join(
+        BENCHMARK_DIR, f"pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(output_path, 'w') as fp:
+        json.dump(run, fp, indent=4)
+    print(f"Results saved to {output_path}")
+    return run
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import time
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(src_path)
+
+import train
+from column_generator import build_training_features
+
+OUTPUT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..',
+    'data',
+    'compare_multi_output.json',
+)
+
+
+def timed_train(data, target_column, hub_id, features):
+    start_time = time.perf_counter()
+    model = train.train_model(data, target_column, hub_id, features)
+    return model, time.perf_counter() - start_time
+
+
+# Train both model layouts of a hub on the same split, returns their training
+# time and test MSE per target
+def compare_hub(data, hub_id, features):
+    per_target = {'train_seconds': 0.0, 'mse': {}}
+    for target_column in train.TARGET_COLUMNS:
+        model, seconds = timed_train(data, target_column, hub_id, features)
+        per_target['train_seconds'] += seconds
+        per_target['mse'].update(
+            train.score_model(model, data, target_column, hub_id, features)
+        )
+
+    model, seconds = timed_train(data, train.MULTI_OUTPUT_TARGET, hub_id, features)
+    multi_output = {
+        'regressor': train.MULTI_OUTPUT_REGRESSOR,
+        'train_seconds': seconds,
+        'mse': train.score_model(
+            model, data, train.MULTI_OUTPUT_TARGET, hub_id, features
+        ),
+    }
+    return {'per_target': per_target, 'multi_output': multi_output}
+
+
+def main():
+    data = train.load_training_data()
+    data = data.dropna(subset=['bags_used', 'cold_bags_used', 'deep_frozen_bags_used'])
+    features = build_training_features(data.columns)
+
+    results = {}
+    for hub_id in train.HUB_IDS:
+        results[hub_id] = compare_hub(data, hub_id, features)
+        per_target = results[hub_id]['per_target']
+        multi_output = results[hub_id]['multi_output']
+        print(
+            f"hub {hub_id}: per-target {per_target['train_seconds']:.1f}s, "
+            f"multi-output {multi_output['train_seconds']:.1f}s"
+        )
+        for target_column in train.TARGET_COLUMNS:
+            print(
+                f"  {target_column} test MSE: "
+                f"{per_target['mse'][target_column]:.5f} per-target, "
+                f"{multi_output['mse'][target_column]:.5f} multi-output"
+            )
+
+    with open(OUTPUT_PATH, 'w') as fp:
+        json.dump(results, fp, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import urlparse
+
+import numpy as np
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(src_path)
+
+# Distinct synthetic orders sent, requests cycle through them
+ORDER_POOL_SIZE = 10000
+
+
+# Orders as the server takes them: the table columns without actuals and
+# forecasts, delivery_time as ISO 8601
+def order_pool(rows, seed):
+    from synthetic_data import generate_orders
+
+    data = generate_orders(rows, seed)
+    data = data.drop(columns=data.filter(regex='_used').columns)
+    data['delivery_time'] = data['delivery_time'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return data.to_dict('records')
+
+
+# Train the models on synthetic orders into models_dir/models, like
+# benchmark_pipeline.py does, so the server has something to load
+def train_synthetic_models(models_dir, rows, seed):
+    import predict
+    import train
+    from ingest import ingest_chunks
+    from synthetic_data import generate_orders
+    from transform import transform_data
+
+    train.EFS_MOUNT_POINT = models_dir
+    predict.EFS_MOUNT_POINT = models_dir
+    os.makedirs(os.path.join(models_dir, 'models'), exist_ok=True)
+    data = transform_data(ingest_chunks([generate_orders(rows, seed)]))
+    train.train_models(data)
+
+
+# Start a server in this process, on a free port. Client and server threads
+# share the GIL, so a server started on its own (make serve) is faster
+def start_server():
+    import predict
+    from prediction_server import PredictionServer
+
+    predict.preload_models()
+    server = PredictionServer(('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+# One client: a keep-alive connection sending its requests one after another.
+# Appends the latency of every request to `latencies`, None for failed ones
+def client(url, bodies, latencies):
+    address = urlparse(url)
+    conn = http.client.HTTPConnection(address.hostname, address.port, timeout=30)
+    headers = {'Content-Type': 'application/json'}
+    for body in bodies:
+        start = time.perf_counter()
+        try:
+            conn.request('POST', '/predict', body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            ok = False
+        latencies.append(time.perf_counter() - start if ok else None)
+    conn.close()
+
+
+def server_metrics(url):
+    address = urlparse(url)
+    conn = http.client.HTTPConnection(address.hostname, address.port, timeout=30)
+    conn.request('GET', '/metrics')
+    metrics = json.loads(conn.getresponse().read())
+    conn.close()
+    return metrics
+
+
+def run_load_test(url, requests, concurrency, orders_per_request, seed=42):
+    orders = order_pool(min(requests * orders_per_request, ORDER_POOL_SIZE), seed)
+    bodies = []
+    for i in range(requests):
+        start = i * orders_per_request % len(orders)
+        batch = [orders[(start + j) % len(orders)] for j in range(orders_per_request)]
+        bodies.append(json.dumps(batch[0] if orders_per_request == 1 else batch))
+
+    latencies = []
+    threads = [
+        threading.Thread(target=client, args=(url, bodies[i::concurrency], latencies))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    succeeded = np.array([latency for latency in latencies if latency is not None])
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'orders_per_request': orders_per_request,
+        'errors': requests - succeeded.size,
+        'seconds': seconds,
+        'requests_per_second': succeeded.size / seconds,
+        'orders_per_second': succeeded.size * orders_per_request / seconds,
+        'p50_ms': (
+            float(np.percentile(succeeded, 50) * 1000) if succeeded.size else None
+        ),
+        'p99_ms': (
+            float(np.percentile(succeeded, 99) * 1000) if succeeded.size else None
+        ),
+        'server': server_metrics(url),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the prediction server")
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--orders-per-request', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument(
+        '--start-server', action='store_true', help="Serve from this process"
+    )
+    parser.add_argument(
+        '--train-rows',
+        type=int,
+        help="With --start-server, first train models on this many synthetic orders",
+    )
+    parser.add_argument('--output', help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    with tempfile.TemporaryDirectory() as models_dir:
+        if args.start_server:
+            # Stage records of the synthetic training are not of interest here
+            os.environ.setdefault('METRICS_LOG', '0')
+            if args.train_rows:
+                train_synthetic_models(models_dir, args.train_rows, args.seed)
+            server, url = start_server()
+
+        result = run_load_test(
+            url, args.requests, args.concurrency, args.orders_per_request, args.seed
+        )
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print(
+        "{requests} requests of {orders_per_request} orders, {concurrency} clients: "
+        "{requests_per_second:.0f} requests/s, {orders_per_second:.0f} orders/s, "
+        "p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms, {errors} errors".format(**result)
+    )
+    server_result = result['server']
+    print(
+        "Server: p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms, "
+        "{batches} batches of {mean_batch_orders:.1f} orders on average".format(
+            **server_result
+        )
+    )
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent=4)
+    return result
+
+
+if __name__ == '__main__':
+    main()
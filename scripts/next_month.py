@@ -1,16 +1,16 @@
 import os
+import sys
 import json
 from decimal import ROUND_HALF_UP, Decimal, getcontext
 from datetime import date, datetime, timedelta
 
 import pandas as pd
-import psycopg2
-from tqdm import tqdm
 
-DEFAULT_DBNAME = 'data_warehouse'
-DEFAULT_USERNAME = 'postgres'
-DEFAULT_PASSWORD = 'postgres'
-DEFAULT_ENDPOINT = 'localhost:5432'
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(src_path)
+
+from bulk_load import upsert_frame
+from config import db_connection
 
 TABLE_NAME = 'bags_forecast'
 
@@ -38,11 +38,6 @@ def load_data(csv_path):
     return data
 
 
-# Convert numerical columns to Decimal and datetime columns to string
-def convert_to_compatible_types(data):
-    return data
-
-
 # Filter data for PostgreSQL load
 def filter_data(data, current_date):
     data['delivery_time'] = pd.to_datetime(data['delivery_time'], utc=True)
@@ -85,43 +80,6 @@ def is_postgres_empty(table_name, conn):
     return not result
 
 
-# Remove duplicates based on 'order_id'
-def remove_duplicates(data):
-    data = data.drop_duplicates(subset=['order_id'])
-    return data
-
-
-# Load data into PostgreSQL
-def load_to_postgres(label, data, table_name, conn):
-    data = convert_to_compatible_types(data)
-    data = remove_duplicates(data)
-
-    # Replace NaN with None to handle NULL values in PostgreSQL
-    data = data.where(pd.notnull(data), None)
-
-    columns = data.columns.tolist()
-    real_bags_used_columns = ['bags_used', 'cold_bags_used', 'deep_frozen_bags_used']
-    update_columns = ', '.join(
-        [f"{col} = EXCLUDED.{col}" for col in real_bags_used_columns]
-    )
-
-    insert_query = f"""
-    INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})
-    ON CONFLICT (order_id) DO UPDATE SET {update_columns};
-    """
-
-    cur = conn.cursor()
-    for row in tqdm(
-        data.itertuples(index=False),
-        total=len(data),
-        desc=f"Loading {label} month data to PostgreSQL DB",
-    ):
-        row = tuple(None if pd.isna(x) else x for x in row)
-        cur.execute(insert_query, row)
-    conn.commit()
-    cur.close()
-
-
 # Update configuration date
 def update_config_date(config):
     current_date = pd.to_datetime(config['current_date'], utc=True)
@@ -149,38 +107,28 @@ def main():
     current_date = pd.to_datetime(config['current_date'])
 
     # Connect to PostgreSQL database
-    conn = psycopg2.connect(
-        host=os.getenv('DB_ENDPOINT', DEFAULT_ENDPOINT).split(':')[0],
-        port=os.getenv('DB_ENDPOINT', DEFAULT_ENDPOINT).split(':')[1],
-        database=os.getenv('DB_NAME', DEFAULT_DBNAME),
-        user=os.getenv('DB_USERNAME', DEFAULT_USERNAME),
-        password=os.getenv('DB_PASSWORD', DEFAULT_PASSWORD),
-    )
-
-    # Check if PostgreSQL table is empty
-    if is_postgres_empty(table_name, conn):
-        # Load all data until the "current month"
-        previous_month_data, current_month_data, _ = filter_data(data, current_date)
-        load_to_postgres(previous_month_data, table_name, conn)
-        load_to_postgres(current_month_data, table_name, conn)
-    else:
-        # Filter data for previous, current, and next month
-        previous_month_data, current_month_data, next_month_data = filter_data(
-            data, current_date
-        )
-        load_to_postgres(
-            "previous", previous_month_data, table_name, conn
-        )  # just in case
-        load_to_postgres("current", current_month_data, table_name, conn)
-        load_to_postgres("next", next_month_data, table_name, conn)
+    with db_connection() as conn:
+        # Check if PostgreSQL table is empty
+        if is_postgres_empty(table_name, conn):
+            # Load all data until the "current month"
+            previous_month_data, current_month_data, _ = filter_data(data, current_date)
+            upsert_frame(previous_month_data, table_name, conn, label="previous month")
+            upsert_frame(current_month_data, table_name, conn, label="current month")
+        else:
+            # Filter data for previous, current, and next month
+            previous_month_data, current_month_data, next_month_data = filter_data(
+                data, current_date
+            )
+            upsert_frame(
+                previous_month_data, table_name, conn, label="previous month"
+            )  # just in case
+            upsert_frame(current_month_data, table_name, conn, label="current month")
+            upsert_frame(next_month_data, table_name, conn, label="next month")
 
     # Update configuration date
     update_config_date(config)
     save_config(config, config_path)
 
-    # Close PostgreSQL connection
-    conn.close()
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,86 @@
+# bulk_load.py
+import io
+
+from column_generator import get_column_types
+
+
+# Render the given columns of a DataFrame as CSV suitable for COPY ... FROM STDIN
+def frame_to_csv(data, columns):
+    column_types = get_column_types()
+    data = data[columns]
+
+    # INTEGER columns holding NaN are read as float by pandas, but COPY
+    # rejects "5.0" for an INTEGER column, so render them as nullable ints
+    integer_columns = [col for col in columns if column_types.get(col) == 'INTEGER']
+    if integer_columns:
+        data = data.assign(
+            **{
+                col: data[col].astype('float64').round().astype('Int64')
+                for col in integer_columns
+            }
+        )
+
+    # NaN/None are written as empty unquoted fields, which COPY reads as NULL
+    buffer = io.StringIO()
+    data.to_csv(buffer, index=False, header=False, na_rep='')
+    buffer.seek(0)
+    return buffer
+
+
+# Stream a DataFrame into a table with a single COPY, returns number of rows sent
+def copy_frame(cur, data, table_name, columns=None):
+    columns = list(data.columns) if columns is None else list(columns)
+    copy_query = (
+        f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    )
+    cur.copy_expert(copy_query, frame_to_csv(data, columns))
+    return len(data)
+
+
+# Columns with real (observed) bag usage, the only ones an upsert may overwrite
+REAL_BAGS_USED_COLUMNS = ['bags_used', 'cold_bags_used', 'deep_frozen_bags_used']
+
+
+# Upsert a DataFrame into the table: COPY it into a temporary staging table and
+# merge it with a single INSERT ... SELECT ... ON CONFLICT statement. Existing
+# rows only get their *_bags_used columns updated, and only when they changed.
+# Returns the number of inserted or updated rows.
+def upsert_frame(data, table_name, conn, label=''):
+    data = data.drop_duplicates(subset=['order_id'])
+    if data.empty:
+        print(f"Loaded {label} data to PostgreSQL DB: nothing to load")
+        return 0
+
+    columns = data.columns.tolist()
+    update_columns = [col for col in REAL_BAGS_USED_COLUMNS if col in columns]
+    staging_table = f"{table_name}_staging"
+
+    if update_columns:
+        set_clause = ', '.join(f'{col} = EXCLUDED.{col}' for col in update_columns)
+        current_values = ', '.join(f'target.{col}' for col in update_columns)
+        new_values = ', '.join(f'EXCLUDED.{col}' for col in update_columns)
+        conflict_action = f"""DO UPDATE SET {set_clause}
+    WHERE ({current_values}) IS DISTINCT FROM ({new_values})"""
+    else:
+        conflict_action = "DO NOTHING"
+
+    merge_query = f"""
+    INSERT INTO {table_name} AS target ({', '.join(columns)})
+    SELECT {', '.join(columns)} FROM {staging_table}
+    ON CONFLICT (order_id) {conflict_action};
+    """
+
+    cur = conn.cursor()
+    cur.execute(
+        f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    copy_frame(cur, data, staging_table, columns)
+    cur.execute(merge_query)
+    rows = cur.rowcount
+    conn.commit()
+    cur.close()
+
+    print(
+        f"Loaded {label} data to PostgreSQL DB: {len(data)} rows, {rows} inserted or updated"
+    )
+    return rows
@@ -1,4 +1,5 @@
 # column_generator.py
+import numpy as np
 
 
 def generate_columns():
@@ -38,6 +39,53 @@ def get_column_names():
     return columns
 
 
+def get_column_types():
+    return {col.split()[0]: col.split()[1] for col in generate_columns()}
+
+
+# pandas dtypes of the table columns, nullable INTEGER columns are kept as float64
+def get_column_dtypes():
+    sql_dtypes = {
+        'FLOAT': 'float64',
+        'INTEGER': 'float64',
+        'TIMESTAMP': 'datetime64[ns]',
+    }
+    dtypes = {col: sql_dtypes[col_type] for col, col_type in get_column_types().items()}
+    dtypes.update({'order_id': 'int64', 'hub_id': 'int64'})
+    return dtypes
+
+
+# Compact dtypes of the feature frame built by ingest: measures as float32 (they
+# may be NULL), calendar features as the smallest fitting ints. Keys keep their
+# dtypes, hub_id is the partition key of the snapshots
+def get_feature_schema():
+    sql_dtypes = {'FLOAT': 'float32', 'INTEGER': 'float32'}
+    schema = {
+        col: sql_dtypes[col_type]
+        for col, col_type in get_column_types().items()
+        if col_type in sql_dtypes and col not in ('order_id', 'hub_id')
+    }
+    schema.update(
+        {
+            'day_of_year': 'int16',
+            'day_of_week': 'int8',
+            'number_of_week': 'int8',
+            'delivery_hour': 'int8',
+        }
+    )
+    return schema
+
+
+def apply_feature_schema(data):
+    schema = get_feature_schema()
+    return data.astype({col: dtype for col, dtype in schema.items() if col in data})
+
+
+# Features as one C-contiguous float32 matrix, the layout the models work on
+def feature_matrix(data, features):
+    return np.ascontiguousarray(data[features].to_numpy(dtype=np.float32))
+
+
 def build_training_features(data_columns):
     extra_features = ['day_of_week', 'number_of_week', 'delivery_hour']
     totals_columns = ['lint_item_count', 'total_quantity', 'positions', 'total_weight']
@@ -0,0 +1,212 @@
+# compiled_model.py
+import json
+
+import numpy as np
+
+# Rows scored at a time, bounds the (rows x trees) node index arrays
+PREDICT_BATCH_ROWS = 4096
+# Largest difference to the original model's predictions a compiled model may have
+PARITY_TOLERANCE = 1e-4
+
+# XGBoost objectives whose prediction is the raw margin
+IDENTITY_OBJECTIVES = [
+    'reg:squarederror',
+    'reg:absoluteerror',
+    'reg:pseudohubererror',
+]
+
+
+# A tree ensemble flattened into numpy node tables, so it can be scored without
+# sklearn or xgboost and loaded without unpickling thousands of tree objects.
+# All trees share the tables, a row walks every tree at once:
+#   feature, threshold  split of each node
+#   children            global index of the left and right child of node i at
+#                       2 * i and 2 * i + 1; leaves loop back onto themselves
+#   default_left        where missing (NaN) values go
+#   value               (nodes, outputs) leaf values
+#   roots               first node of each tree
+# The prediction is base + scale * the sum of the leaf values over the trees.
+class CompiledEnsemble:
+    ARRAYS = ['feature', 'threshold', 'children', 'default_left', 'value']
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        for name in self.ARRAYS + ['roots', 'base']:
+            setattr(self, name, arrays[name])
+        self.scale = float(arrays['scale'])
+        self.depth = int(arrays['depth'])
+        # sklearn sends x <= threshold left, xgboost x < threshold
+        self.strict = bool(arrays['strict'])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def save(self, path):
+        # Uncompressed, so loading is a plain read
+        with open(path, 'wb') as fp:
+            np.savez(fp, **self.arrays)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        result = np.empty((X.shape[0], self.value.shape[1]))
+        for start in range(0, X.shape[0], PREDICT_BATCH_ROWS):
+            stop = start + PREDICT_BATCH_ROWS
+            result[start:stop] = self.predict_batch(X[start:stop])
+        return result[:, 0] if result.shape[1] == 1 else result
+
+    # Walk all trees for a batch of rows, one level per step, with flat np.take
+    # gathers (faster than fancy indexing)
+    def predict_batch(self, X):
+        rows, columns = X.shape
+        X = X.ravel()
+        row_offsets = (np.arange(rows, dtype=np.int32) * columns)[:, None]
+        node = np.repeat(self.roots[None, :], rows, axis=0)
+        for _ in range(self.depth):
+            x = np.take(X, row_offsets + np.take(self.feature, node))
+            threshold = np.take(self.threshold, node)
+            go_right = x >= threshold if self.strict else x > threshold
+            missing = np.isnan(x)
+            if missing.any():
+                go_right = np.where(
+                    missing, ~np.take(self.default_left, node), go_right
+                )
+            node = np.take(self.children, 2 * node + go_right)
+        values = np.take(self.value, node, axis=0)
+        return self.base + self.scale * values.sum(axis=1)
+
+
+# Depth of the deepest leaf, i.e. the steps needed to walk any tree
+def tree_depth(roots, left, right):
+    depth = 0
+    frontier = roots
+    while True:
+        inner = frontier[left[frontier] != frontier]
+        if inner.size == 0:
+            return depth
+        frontier = np.concatenate([left[inner], right[inner]])
+        depth += 1
+
+
+# Concatenate per-tree node tables into the global ones; each table is a dict of
+# the ARRAYS with the children indexed within the tree and left = -1 at leaves
+def build_arrays(tables, base, scale, strict):
+    offsets = np.cumsum([0] + [len(table['left']) for table in tables])
+    children = {}
+    for name in ['left', 'right']:
+        columns = []
+        for offset, table in zip(offsets, tables):
+            nodes = np.arange(len(table[name]), dtype=np.int32)
+            child = table[name].astype(np.int32)
+            # Leaves point to themselves, so walking past them is a no-op
+            columns.append(np.where(table['left'] < 0, nodes, child) + offset)
+        children[name] = np.concatenate(columns).astype(np.int32)
+
+    arrays = {}
+    arrays['children'] = np.stack([children['left'], children['right']], axis=1)
+    arrays['children'] = arrays['children'].ravel()
+
+    leaves = np.concatenate([table['left'] < 0 for table in tables])
+    feature = np.concatenate([table['feature'] for table in tables])
+    arrays['feature'] = np.where(leaves, 0, feature).astype(np.int32)
+    threshold = np.concatenate([table['threshold'] for table in tables])
+    arrays['threshold'] = np.where(leaves, 0.0, threshold).astype(np.float64)
+    arrays['default_left'] = np.concatenate(
+        [table['default_left'] for table in tables]
+    ).astype(bool)
+    arrays['value'] = np.concatenate([table['value'] for table in tables])
+    arrays['roots'] = offsets[:-1].astype(np.int32)
+    arrays['base'] = np.asarray(base, dtype=np.float64)
+    arrays['scale'] = np.float64(scale)
+    arrays['strict'] = np.bool_(strict)
+    arrays['depth'] = np.int32(
+        tree_depth(arrays['roots'], children['left'], children['right'])
+    )
+    return arrays
+
+
+def compile_random_forest(model):
+    tables = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        tables.append(
+            {
+                'feature': tree.feature,
+                'threshold': tree.threshold,
+                'left': tree.children_left,
+                'right': tree.children_right,
+                'default_left': getattr(
+                    tree, 'missing_go_to_left', np.zeros(tree.node_count)
+                ),
+                'value': tree.value[:, :, 0],
+            }
+        )
+    outputs = tables[0]['value'].shape[1]
+    return build_arrays(tables, np.zeros(outputs), 1 / len(tables), strict=False)
+
+
+# base_score is saved as "5E-1", or as "[5E-1,...]" with one value per target
+def parse_base_score(base_score):
+    return [float(value) for value in base_score.strip('[]').split(',')]
+
+
+def compile_xgboost(model):
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    learner = json.loads(booster.save_raw('json'))['learner']
+
+    objective = learner['objective']['name']
+    if objective not in IDENTITY_OBJECTIVES:
+        raise ValueError(f"Cannot compile XGBoost objective {objective}")
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError("Only gbtree XGBoost boosters can be compiled")
+
+    base = parse_base_score(learner['learner_model_param']['base_score'])
+    outputs = int(learner['learner_model_param'].get('num_target', 1))
+    base = np.broadcast_to(base, outputs)
+
+    gbtree = learner['gradient_booster']['model']
+    tables = []
+    for tree, output in zip(gbtree['trees'], gbtree['tree_info']):
+        left = np.asarray(tree['left_children'])
+        leaves = (left < 0)[:, None]
+        # Thresholds are float32 in xgboost, round the JSON decimals back to them
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        conditions = conditions.astype(np.float64)
+
+        if int(tree['tree_param'].get('size_leaf_vector', 1)) > 1:
+            # multi_output_tree: every leaf holds the values of all targets
+            weights = np.asarray(tree['base_weights'], dtype=np.float32)
+            value = np.where(leaves, weights.reshape(len(left), outputs), 0.0)
+        else:
+            # A scalar leaf value is stored in split_conditions, it goes to the
+            # column of the target the tree belongs to
+            value = np.zeros((len(left), outputs))
+            value[:, output] = np.where(leaves[:, 0], conditions, 0.0)
+        tables.append(
+            {
+                'feature': np.asarray(tree['split_indices']),
+                'threshold': conditions,
+                'left': left,
+                'right': np.asarray(tree['right_children']),
+                'default_left': np.asarray(tree['default_left']),
+                'value': value.astype(np.float64),
+            }
+        )
+    return build_arrays(tables, base, 1.0, strict=True)
+
+
+def compile_model(model):
+    if hasattr(model, 'estimators_'):
+        return CompiledEnsemble(compile_random_forest(model))
+    return CompiledEnsemble(compile_xgboost(model))
+
+
+# Largest difference between the predictions of a model and its compiled form
+def parity_error(model, compiled, X):
+    expected = np.asarray(model.predict(X), dtype=np.float64)
+    return float(np.max(np.abs(expected - compiled.predict(X)), initial=0.0))
@@ -1,30 +1,150 @@
 import os
+import time
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
 TABLE_NAME = 'bags_forecast'
 
+# Rows still waiting for a forecast. Queries must use this exact predicate
+# for PostgreSQL to serve them from the partial index below
+NULL_FORECAST_PREDICATE = (
+    '(bags_used_forecast IS NULL OR cold_bags_used_forecast IS NULL'
+    ' OR deep_frozen_bags_used_forecast IS NULL)'
+)
 
-def db_connect():
-    DEFAULT_DBNAME = 'data_warehouse'
-    DEFAULT_USERNAME = 'postgres'
-    DEFAULT_PASSWORD = 'postgres'
-    DEFAULT_ENDPOINT = 'localhost:5432'
+# Secondary indexes of the table, name -> definition after `ON <table>`
+TABLE_INDEXES = {
+    f'{TABLE_NAME}_hub_id_delivery_time_idx': '(hub_id, delivery_time)',
+    f'{TABLE_NAME}_delivery_time_idx': '(delivery_time)',
+    f'{TABLE_NAME}_null_forecast_idx': f'(order_id) WHERE {NULL_FORECAST_PREDICATE}',
+}
+
+
+DEFAULT_DBNAME = 'data_warehouse'
+DEFAULT_USERNAME = 'postgres'
+DEFAULT_PASSWORD = 'postgres'
+DEFAULT_ENDPOINT = 'localhost:5432'
+
+# Connections the pool keeps open between uses, and the most it hands out at once
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 1))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', 4))
+# Connections idle for longer are pinged before being reused, a warm Lambda can
+# be frozen for minutes and RDS drops idle connections
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv('DB_POOL_PING_AFTER_SECONDS', 30))
+# Default statement timeout of the connections in milliseconds, 0 for none
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
 
-    # Get parameters from environment variables
+# Pool of this process, kept at module level so the connections survive between
+# warm Lambda invocations. A forked child must not use its parent's sockets, so
+# the pool is recreated when the pid changes
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# id(connection) -> time.monotonic() it was returned to the pool
+_last_used = {}
+
+
+# psycopg2.connect() arguments from the DB_* environment variables
+def connection_params(statement_timeout=DB_STATEMENT_TIMEOUT_MS):
     db_endpoint = os.getenv('DB_ENDPOINT', DEFAULT_ENDPOINT)
-    db_username = os.getenv('DB_USERNAME', DEFAULT_USERNAME)
-    db_password = os.getenv('DB_PASSWORD', DEFAULT_PASSWORD)
-    db_name = os.getenv('DB_NAME', DEFAULT_DBNAME)
-
-    # Example path to the CSV file
-
-    # Connect to the PostgreSQL database
-    conn = psycopg2.connect(
-        host=db_endpoint.split(':')[0],
-        port=db_endpoint.split(':')[1],
-        database=db_name,
-        user=db_username,
-        password=db_password,
-    )
-
-    return conn
+    host, port = db_endpoint.split(':')
+    params = {
+        'host': host,
+        'port': port,
+        'database': os.getenv('DB_NAME', DEFAULT_DBNAME),
+        'user': os.getenv('DB_USERNAME', DEFAULT_USERNAME),
+        'password': os.getenv('DB_PASSWORD', DEFAULT_PASSWORD),
+    }
+    if statement_timeout:
+        params['options'] = f'-c statement_timeout={int(statement_timeout)}'
+    return params
+
+
+# A new connection outside the pool, the caller closes it
+def db_connect():
+    return psycopg2.connect(**connection_params())
+
+
+def get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Connections inherited through fork are dropped without closing
+            # them, closing would end the parent's sessions
+            _last_used.clear()
+            _pool = ThreadedConnectionPool(
+                DB_POOL_SIZE, DB_POOL_MAX_CONNECTIONS, **connection_params()
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
+
+
+def is_alive(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+# Take a live connection from the pool, dead ones are closed and replaced
+def checkout(pool):
+    for _ in range(DB_POOL_MAX_CONNECTIONS + 1):
+        conn = pool.getconn()
+        if is_alive(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("No live connection to the database")
+
+
+# Borrow a pooled connection for the duration of the with block. Work not
+# committed in the block is rolled back. statement_timeout (in ms) overrides
+# DB_STATEMENT_TIMEOUT_MS for this use only:
+#
+#     with db_connection() as conn:
+#         with conn.cursor() as cur:
+#             cur.execute(...)
+#         conn.commit()
+@contextmanager
+def db_connection(statement_timeout=None):
+    pool = get_pool()
+    conn = checkout(pool)
+    try:
+        if statement_timeout is not None:
+            with conn.cursor() as cur:
+                cur.execute('SET statement_timeout = %s', (int(statement_timeout),))
+        yield conn
+    finally:
+        broken = conn.closed != 0
+        if not broken and statement_timeout is not None:
+            # Rolls back and restores the session defaults, the timeout included
+            try:
+                conn.reset()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        # putconn() rolls back an open transaction before pooling the connection
+        pool.putconn(conn, close=broken)
@@ -1,11 +1,17 @@
 import os
+import sys
+import json
+import resource
 
 import pandas as pd
-import psycopg2
-from column_generator import get_column_names
-from config import db_connect
+from column_generator import get_column_names, get_column_dtypes
+from config import db_connection
+from instrumentation import Stage, clear_metrics, collected_metrics
+from profiling import profiled
 
 TABLE_NAME = 'bags_forecast'
+# Columns filled in once an order is delivered
+ACTUALS_COLUMNS = ['bags_used', 'cold_bags_used', 'deep_frozen_bags_used']
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -19,39 +25,246 @@ EFS_MOUNT_POINT = (
 # Path to the output CSV file
 DEFAULT_CSV_OUTPUT = os.path.join(EFS_MOUNT_POINT, 'current_state.csv')
 
+# Fetch only new or changed rows and merge them into the existing CSV snapshot
+INCREMENTAL_DOWNLOAD = os.getenv('DOWNLOAD_INCREMENTAL', '0') == '1'
 
-def select_to_df():
-    conn = db_connect()
-    cur = conn.cursor()
-    columns = get_column_names()
+# Read the table in chunks through a server-side cursor instead of fetchall()
+STREAM_SELECT = os.getenv('DB_STREAM', '0') == '1'
+# Rows fetched per round trip in streaming mode
+STREAM_ITERSIZE = int(os.getenv('DB_STREAM_ITERSIZE', 50000))
 
-    # Query to select all data from the table
-    select_query = f"SELECT {', '.join(columns)} FROM {TABLE_NAME};"
-    cur.execute(select_query)
 
-    # Fetch all rows from the table
-    rows = cur.fetchall()
+def build_select_query(columns, where=None):
+    select_query = f"SELECT {', '.join(columns)} FROM {TABLE_NAME}"
+    if where is not None:
+        select_query += f" WHERE {where}"
+    return select_query + ';'
+
+
+def select_to_df(columns=None, where=None, params=None):
+    columns = get_column_names() if columns is None else columns
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            # Query to select all data from the table
+            with Stage('query'):
+                cur.execute(build_select_query(columns, where), params)
+
+            # Fetch all rows from the table
+            with Stage('fetch') as step:
+                rows = cur.fetchall()
+                step.rows_out = len(rows)
+
+    # An empty selection has no values to infer the dtypes from
+    if not rows:
+        return typed_frame(rows, columns)
 
     # Create a DataFrame from the fetched data
     data = pd.DataFrame(rows, columns=columns)
-    # Close the cursor and connection
-    cur.close()
-    conn.close()
+    # Columns holding only NULLs come back as object, read_csv makes them float
+    null_columns = [
+        col for col in columns if data[col].dtype == object and data[col].isna().all()
+    ]
+    data = data.astype({col: 'float64' for col in null_columns})
 
     return data
 
 
-def download_to_csv(output_csv_file_path=DEFAULT_CSV_OUTPUT):
-    data = select_to_df()
-    # Save the DataFrame to a CSV file
+def typed_frame(rows, columns):
+    dtypes = get_column_dtypes()
+    data = pd.DataFrame(rows, columns=columns)
+    return data.astype({col: dtypes[col] for col in columns if col in dtypes})
+
+
+# Generator of DataFrame chunks read through a named (server-side) cursor, so
+# only one chunk of rows is held in memory at a time
+def iter_select(columns=None, where=None, params=None, itersize=STREAM_ITERSIZE):
+    columns = get_column_names() if columns is None else columns
+
+    # The connection goes back to the pool when the generator is exhausted or closed
+    with db_connection() as conn:
+        with conn.cursor(name=f'{TABLE_NAME}_stream') as cur:
+            cur.itersize = itersize
+            cur.execute(build_select_query(columns, where), params)
+
+            chunks = 0
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                chunks += 1
+                yield typed_frame(rows, columns)
+
+            # Let consumers always get the columns, even from an empty table
+            if chunks == 0:
+                yield typed_frame([], columns)
+
+
+# Peak resident set size of this process so far, in MB
+def peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def watermark_path_for(csv_file_path):
+    return os.path.splitext(csv_file_path)[0] + '.watermark.json'
+
+
+# Rows still waiting for their actuals. A missing forecast does not count, an
+# old order never forecast would hold the watermark back for good
+def awaiting_actuals(data):
+    actuals_columns = [col for col in ACTUALS_COLUMNS if col in data.columns]
+    return data[actuals_columns].isna().any(axis=1)
+
+
+# High-water mark of a snapshot: the last order and delivery time seen, and the
+# delivery time from which rows may still get their actuals updated
+def build_watermark(data):
+    delivery_time = pd.to_datetime(data['delivery_time'])
+    open_rows = awaiting_actuals(data)
+    if open_rows.any():
+        actuals_since = delivery_time[open_rows].min()
+    else:
+        actuals_since = delivery_time.max()
+
+    return {
+        'order_id': int(data['order_id'].max()),
+        'delivery_time': str(delivery_time.max()),
+        'actuals_since': str(actuals_since),
+    }
+
+
+def load_watermark(watermark_path):
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path, 'r') as fp:
+        return json.load(fp)
+
+
+def save_watermark(watermark, watermark_path):
+    with open(watermark_path, 'w') as fp:
+        json.dump(watermark, fp, indent=4)
+
+
+# The rows of a chunk build_watermark() depends on, so a watermark of a whole
+# table can be built from the (small) concatenation of these rows of its chunks
+def watermark_rows(data):
+    delivery_time = pd.to_datetime(data['delivery_time'])
+    open_rows = awaiting_actuals(data)
+
+    index = [data['order_id'].idxmax(), delivery_time.idxmax()]
+    if open_rows.any():
+        index.append(delivery_time[open_rows].idxmin())
+    return data.loc[index]
+
+
+# Write the chunks to a CSV file one at a time, returns the watermark of all rows
+# and their number
+def write_chunks_to_csv(chunks, output_csv_file_path):
+    summary = []
+    rows = 0
+    for number, chunk in enumerate(chunks):
+        chunk.to_csv(
+            output_csv_file_path,
+            index=False,
+            mode='w' if number == 0 else 'a',
+            header=number == 0,
+        )
+        rows += chunk.shape[0]
+        if not chunk.empty:
+            summary.append(watermark_rows(chunk))
+
+    return (build_watermark(pd.concat(summary)) if summary else None), rows
+
+
+# Rows added or possibly updated since the watermark was taken, or None when the
+# table no longer matches it (e.g. it was truncated and reloaded)
+def select_changes(watermark):
+    max_order_id = select_to_df(['max(order_id)']).iloc[0, 0]
+    # max() of an empty table comes back as NaN, select_to_df() casts it to float
+    if pd.isna(max_order_id) or max_order_id < watermark['order_id']:
+        return None
+
+    return select_to_df(
+        where="order_id > %(order_id)s OR delivery_time >= %(actuals_since)s",
+        params=watermark,
+    )
+
+
+# Replace changed rows of the snapshot and append the new ones
+def merge_snapshot(snapshot, changes):
+    snapshot = snapshot[~snapshot['order_id'].isin(changes['order_id'])]
+    data = pd.concat([snapshot, changes], ignore_index=True)
+    data['delivery_time'] = pd.to_datetime(data['delivery_time'])
+    return data.sort_values('order_id', ignore_index=True)
+
+
+# Save the data as the CSV snapshot, along with its watermark
+def save_csv(data, output_csv_file_path=DEFAULT_CSV_OUTPUT):
     data.to_csv(output_csv_file_path, index=False)
+    if not data.empty:
+        save_watermark(build_watermark(data), watermark_path_for(output_csv_file_path))
+
+
+@profiled('download')
+def download_to_csv(
+    output_csv_file_path=DEFAULT_CSV_OUTPUT,
+    incremental=INCREMENTAL_DOWNLOAD,
+    stream=STREAM_SELECT,
+):
+    with Stage('download') as download:
+        watermark_path = watermark_path_for(output_csv_file_path)
+        watermark = load_watermark(watermark_path) if incremental else None
+
+        changes = None
+        if watermark is not None and os.path.exists(output_csv_file_path):
+            changes = select_changes(watermark)
+
+        if changes is not None:
+            with Stage('merge', rows_in=changes.shape[0]) as step:
+                snapshot = pd.read_csv(
+                    output_csv_file_path, float_precision='round_trip'
+                )
+                data = merge_snapshot(snapshot, changes)
+                step.rows_out = data.shape[0]
+            mode = f'incremental, {changes.shape[0]} rows fetched'
+        elif stream:
+            data = None
+            mode = 'full, streamed'
+        else:
+            data = select_to_df()
+            mode = 'full'
+
+        # Save the DataFrame to a CSV file
+        if data is None:
+            # Rows are fetched as the chunks are written
+            with Stage('fetch_write') as step:
+                watermark, rows = write_chunks_to_csv(
+                    iter_select(), output_csv_file_path
+                )
+                step.rows_out = rows
+            download.rows_out = rows
+            if watermark is not None:
+                save_watermark(watermark, watermark_path)
+        else:
+            with Stage('write', rows_in=data.shape[0]):
+                save_csv(data, output_csv_file_path)
+            download.rows_out = data.shape[0]
 
-    return f"Data successfully downloaded to {output_csv_file_path}"
+    return (
+        f"Data successfully downloaded to {output_csv_file_path} "
+        f"({mode}, peak RSS {peak_rss_mb():.0f} MB)"
+    )
 
 
 def lambda_handler(event, context):
+    clear_metrics()
     result = download_to_csv()
-    return {'statusCode': 200, 'body': result}
+    return {
+        'statusCode': 200,
+        'body': {'result': result, 'metrics': collected_metrics()},
+    }
 
 
 if __name__ == '__main__':
@@ -0,0 +1,463 @@
+# drift_engine.py
+import numpy as np
+
+# Evidently's defaults: a column drifted when its test says so, the data when at
+# least DRIFT_SHARE of the columns did
+DRIFT_SHARE = 0.5
+# The tests Evidently picks by default for numeric columns: on columns with at
+# most CATEGORICAL_MAX_VALUES values (of reference and current together)
+# Jensen-Shannon, or chi-square and the Z-test on references of at most
+# SMALL_REFERENCE_ROWS rows; on the others Wasserstein, or K-S on small
+# references. Display name and threshold of each
+STATTESTS = {
+    'wasserstein': ('Wasserstein distance (normed)', 0.1),
+    'ks': ('K-S p_value', 0.05),
+    'jensenshannon': ('Jensen-Shannon distance', 0.1),
+    'chisquare': ('chi-square p_value', 0.05),
+    'z': ('Z-test p_value', 0.05),
+}
+CATEGORICAL_MAX_VALUES = 5
+SMALL_REFERENCE_ROWS = 1000
+# scipy's ks_2samp, which Evidently calls, computes exact p-values for samples
+# of up to this many rows
+KS_EXACT_MAX_ROWS = 10000
+# Samples above this size get the limiting Kolmogorov distribution instead of
+# the two-sample one, which takes seconds per column for large samples
+KS_LIMIT_MIN_ROWS = 10000
+# Evidently norms the Wasserstein distance by the reference std, at least this
+WASSERSTEIN_MIN_STD = 0.001
+# The PSI of every column is reported next to the test Evidently picks, as
+# Evidently's PSI test computes it: over Sturges bins of reference and current
+# for columns with more than PSI_MAX_VALUES reference values, over the values
+# otherwise. Empty bins get a share of PSI_EPSILON, so the PSI stays finite
+PSI_MAX_VALUES = 20
+PSI_EPSILON = 1e-4
+# Columns tested at once, bounds the memory of the sorted reference + current
+COLUMN_BATCH = 16
+SMALL_DISTRIBUTION_BINS = 10
+
+
+# Arrays are column-major, of shape (columns, rows), so that every column is
+# sorted and summed up in contiguous memory
+def column_major(data, columns):
+    return np.ascontiguousarray(data[columns].to_numpy(dtype=float).T)
+
+
+# Values of reference and current together, sorted per column, and the row each
+# came from, reference rows first. The ECDFs and histograms of both are read
+# off these, so every batch of columns is sorted once
+def sorted_columns(reference, current):
+    values = np.concatenate([reference, current], axis=1)
+    # Not stable: the order within equal values does not matter, see ks_statistic
+    order = np.argsort(values, axis=1)
+    return np.take_along_axis(values, order, axis=1), order
+
+
+# How many of the first 1, 2, ... sorted values are reference values
+def reference_below(order, reference_rows):
+    return np.cumsum(order < reference_rows, axis=1, dtype=np.int64)
+
+
+# Difference of the ECDFs of reference and current after every sorted value,
+# computed in integers first so that equal ECDFs give exactly 0
+def cdf_difference(reference_below, reference_rows, current_rows):
+    current_below = np.arange(1, reference_below.shape[1] + 1) - reference_below
+    difference = reference_below * current_rows - current_below * reference_rows
+    return difference / (reference_rows * current_rows)
+
+
+# Two-sample Kolmogorov-Smirnov statistic per column. Within a run of equal
+# values the ECDFs only step together, so only the last of them counts
+def ks_statistic(values, difference):
+    last = np.ones(values.shape, dtype=bool)
+    last[:, :-1] = values[:, :-1] != values[:, 1:]
+    return np.max(np.abs(difference) * last, axis=1)
+
+
+# P-values of scipy.stats.ks_2samp() for the columns of reference and current
+def ks_p_value(statistic, reference, current):
+    reference_rows, current_rows = reference.shape[1], current.shape[1]
+    if max(reference_rows, current_rows) <= KS_EXACT_MAX_ROWS:
+        # scipy.stats takes a second or two to import
+        from scipy.stats import ks_2samp
+
+        return np.array([ks_2samp(r, c).pvalue for r, c in zip(reference, current)])
+
+    from scipy.special import kolmogorov
+
+    rows = round(reference_rows * current_rows / (reference_rows + current_rows))
+    if rows > KS_LIMIT_MIN_ROWS:
+        return np.clip(kolmogorov(np.sqrt(rows) * statistic), 0.0, 1.0)
+
+    from scipy.stats import kstwo
+
+    return np.clip(kstwo.sf(statistic, rows), 0.0, 1.0)
+
+
+# First Wasserstein distance per column, the area between the ECDFs
+def wasserstein_distance(values, difference):
+    return np.sum(np.abs(difference[:, :-1]) * np.diff(values, axis=1), axis=1)
+
+
+# Reference and current counts per column in the bins between `edges`, of shape
+# (columns, bins + 1), with the semantics of np.histogram. Only the positions of
+# the edges in the sorted values are searched for
+def binned_counts(values, reference_below, edges):
+    rows = values.shape[1]
+    inner = [
+        np.searchsorted(values[i], edges[i, 1:-1], 'left')
+        for i in range(values.shape[0])
+    ]
+    below = np.column_stack(
+        [
+            np.zeros(len(inner), dtype=np.int64),
+            np.array(inner),
+            np.full(len(inner), rows),
+        ]
+    )
+    reference = np.where(
+        below > 0,
+        np.take_along_axis(reference_below, np.maximum(below - 1, 0), axis=1),
+        0,
+    )
+    return np.diff(reference, axis=1), np.diff(below - reference, axis=1)
+
+
+# Reference and current counts of every value of a sorted column
+def value_counts(values, reference_below):
+    last = np.append(np.flatnonzero(values[1:] != values[:-1]), values.size - 1)
+    reference = np.diff(reference_below[last], prepend=0)
+    return reference, np.diff(last + 1, prepend=0) - reference
+
+
+# Jensen-Shannon distance of the value frequencies, as scipy computes it
+def jensenshannon(reference_counts, current_counts):
+    from scipy.special import rel_entr
+
+    reference = reference_counts / reference_counts.sum()
+    current = current_counts / current_counts.sum()
+    middle = (reference + current) / 2
+    divergence = rel_entr(reference, middle).sum() + rel_entr(current, middle).sum()
+    return float(np.sqrt(divergence / 2))
+
+
+# P-value of scipy.stats.chisquare() of the current counts, expected in the
+# proportions of the reference. A value new in current gives 0
+def chisquare(reference_counts, current_counts):
+    from scipy.special import chdtrc
+
+    expected = reference_counts * current_counts.sum() / reference_counts.sum()
+    with np.errstate(divide='ignore'):
+        statistic = np.sum((current_counts - expected) ** 2 / expected)
+    return float(chdtrc(len(current_counts) - 1, statistic))
+
+
+# Two-sided p-value of the Z-test for the share of the rows not having the
+# lowest value
+def z_test(reference_counts, current_counts):
+    from scipy.special import ndtr
+
+    if len(reference_counts) == 1:
+        return 1.0
+    reference_rows, current_rows = reference_counts.sum(), current_counts.sum()
+    reference_share = 1 - reference_counts[0] / reference_rows
+    current_share = 1 - current_counts[0] / current_rows
+    share = (reference_share * reference_rows + current_share * current_rows) / (
+        reference_rows + current_rows
+    )
+    z = (reference_share - current_share) / np.sqrt(
+        share * (1 - share) * (1 / reference_rows + 1 / current_rows)
+    )
+    return float(2 * (1 - ndtr(np.abs(z))))
+
+
+# Shares of the bins, along the last axis. Empty bins get PSI_EPSILON, or a
+# millionth of the smallest share when that is not above PSI_EPSILON
+def bin_shares(counts):
+    shares = counts / counts.sum(axis=-1, keepdims=True)
+    smallest = np.min(np.where(shares > 0, shares, 1.0), axis=-1, keepdims=True)
+    empty = np.where(smallest <= PSI_EPSILON, smallest / 10**6, PSI_EPSILON)
+    return np.where(shares == 0, empty, shares)
+
+
+# Population stability index of counts per bin, along the last axis, so of one
+# column or of a batch of columns with the same bins
+def population_stability_index(reference_counts, current_counts):
+    reference, current = bin_shares(reference_counts), bin_shares(current_counts)
+    return np.sum((reference - current) * np.log(reference / current), axis=-1)
+
+
+# Bins np.histogram_bin_edges(data, 'sturges') makes, per sorted column
+def sturges_bins(values):
+    span = values[:, -1] - values[:, 0]
+    width = span / (np.log2(values.shape[1]) + 1.0)
+    return np.where(width > 0, np.ceil(span / np.where(width > 0, width, 1)), 1)
+
+
+# PSI per column of sorted values. Columns with the same number of bins are
+# binned at once
+def psi_statistics(values, reference_below):
+    psi = np.zeros(values.shape[0])
+    binned = []
+    for i in range(values.shape[0]):
+        counts = value_counts(values[i], reference_below[i])
+        if np.count_nonzero(counts[0]) > PSI_MAX_VALUES:
+            binned.append(i)
+        else:
+            psi[i] = population_stability_index(*counts)
+
+    bins = sturges_bins(values).astype(int)
+    for bin_count in np.unique(bins[binned]):
+        same_bins = [i for i in binned if bins[i] == bin_count]
+        edges = histogram_edges(values[same_bins], bin_count)
+        psi[same_bins] = population_stability_index(
+            *binned_counts(values[same_bins], reference_below[same_bins], edges)
+        )
+    return psi
+
+
+VALUE_TESTS = {'jensenshannon': jensenshannon, 'chisquare': chisquare, 'z': z_test}
+
+
+# The test Evidently picks by default for a numeric column
+def stattest(unique_values, reference_rows):
+    if unique_values <= CATEGORICAL_MAX_VALUES:
+        if reference_rows > SMALL_REFERENCE_ROWS:
+            return 'jensenshannon'
+        return 'chisquare' if unique_values > 2 else 'z'
+    return 'wasserstein' if reference_rows > SMALL_REFERENCE_ROWS else 'ks'
+
+
+# P-values drift below their threshold, distances from it on
+def is_drift(test, score, threshold):
+    if test == 'ks':
+        return score <= threshold
+    if test in ('chisquare', 'z'):
+        return score < threshold
+    return score >= threshold
+
+
+# Edges of the bins np.histogram(data, bins) uses, per column
+def histogram_edges(data, bins=SMALL_DISTRIBUTION_BINS):
+    low, high = data.min(axis=1), data.max(axis=1)
+    constant = low == high
+    return np.linspace(
+        np.where(constant, low - 0.5, low),
+        np.where(constant, high + 0.5, high),
+        bins + 1,
+        axis=1,
+    )
+
+
+# Small distribution of Evidently: np.histogram(data, 10, density=True)
+def small_distribution(counts, edges):
+    return {
+        'x': edges.tolist(),
+        'y': (counts / max(counts.sum(), 1) / np.diff(edges)).tolist(),
+    }
+
+
+# Test scores and small distributions of a batch of columns without missing
+# values, given their sorted values and reference_below()
+def sorted_statistics(reference, current, values, reference_below):
+    reference_rows, current_rows = reference.shape[1], current.shape[1]
+    distinct = 1 + np.sum(values[:, 1:] != values[:, :-1], axis=1)
+    tests = [stattest(unique_values, reference_rows) for unique_values in distinct]
+
+    difference = cdf_difference(reference_below, reference_rows, current_rows)
+    score = wasserstein_distance(values, difference) / np.maximum(
+        reference.std(axis=1), WASSERSTEIN_MIN_STD
+    )
+    ks_columns = [i for i, test in enumerate(tests) if test == 'ks']
+    if ks_columns:
+        statistic = ks_statistic(values[ks_columns], difference[ks_columns])
+        score[ks_columns] = ks_p_value(
+            statistic, reference[ks_columns], current[ks_columns]
+        )
+    del difference
+    for i, test in enumerate(tests):
+        if test in VALUE_TESTS:
+            score[i] = VALUE_TESTS[test](*value_counts(values[i], reference_below[i]))
+
+    reference_edges, current_edges = histogram_edges(reference), histogram_edges(
+        current
+    )
+    return {
+        'tests': tests,
+        'score': score,
+        'psi': psi_statistics(values, reference_below),
+        'reference_edges': reference_edges,
+        'current_edges': current_edges,
+        'small_reference': binned_counts(values, reference_below, reference_edges)[0],
+        'small_current': binned_counts(values, reference_below, current_edges)[1],
+    }
+
+
+def column_statistics(reference, current):
+    values, order = sorted_columns(reference, current)
+    return sorted_statistics(
+        reference, current, values, reference_below(order, reference.shape[1])
+    )
+
+
+def column_drift(name, statistics, i):
+    test = statistics['tests'][i]
+    stattest_name, threshold = STATTESTS[test]
+    score = float(statistics['score'][i])
+    return {
+        'column_name': name,
+        'column_type': 'num',
+        'stattest_name': stattest_name,
+        'stattest_threshold': threshold,
+        'drift_score': score,
+        'drift_detected': bool(is_drift(test, score, threshold)),
+        # Not part of Evidently's report
+        'psi': float(statistics['psi'][i]),
+        'current': {
+            'small_distribution': small_distribution(
+                statistics['small_current'][i], statistics['current_edges'][i]
+            )
+        },
+        'reference': {
+            'small_distribution': small_distribution(
+                statistics['small_reference'][i], statistics['reference_edges'][i]
+            )
+        },
+    }
+
+
+# Report of the drift of every column, shaped like Evidently's
+# Report(metrics=[DataDriftPreset()]).as_dict()
+def column_report(drift_by_columns):
+    drifted = sum(column['drift_detected'] for column in drift_by_columns.values())
+    share = drifted / max(len(drift_by_columns), 1)
+    summary = {
+        'number_of_columns': len(drift_by_columns),
+        'number_of_drifted_columns': drifted,
+        'share_of_drifted_columns': share,
+        'dataset_drift': share >= DRIFT_SHARE,
+    }
+    return {
+        'metrics': [
+            {
+                'metric': 'DatasetDriftMetric',
+                'result': {'drift_share': DRIFT_SHARE, **summary},
+            },
+            {
+                'metric': 'DataDriftTable',
+                'result': {
+                    **summary,
+                    'drift_by_columns': drift_by_columns,
+                    # Feature importances, Evidently leaves them out by default
+                    'current_fi': None,
+                    'reference_fi': None,
+                },
+            },
+        ]
+    }
+
+
+def check_not_empty(reference, current):
+    if reference.shape[1] == 0 or current.shape[1] == 0:
+        raise ValueError("The reference and current datasets must not be empty.")
+
+
+# Drift of a batch of columns, of column-major arrays without missing values
+def array_report(columns, reference, current):
+    check_not_empty(reference, current)
+    drift_by_columns = {}
+    for start in range(0, len(columns), COLUMN_BATCH):
+        batch = slice(start, start + COLUMN_BATCH)
+        statistics = column_statistics(reference[batch], current[batch])
+        for i, name in enumerate(columns[batch]):
+            drift_by_columns[name] = column_drift(name, statistics, i)
+    return column_report(drift_by_columns)
+
+
+# Drift of every numeric column of current against reference, shaped like
+# Evidently's Report(metrics=[DataDriftPreset()]).as_dict(). Rows with missing
+# values are dropped, as validate.run() does for Evidently
+def drift_report(reference, current, columns=None):
+    columns = list(reference.columns if columns is None else columns)
+    return array_report(
+        columns,
+        column_major(reference[columns].dropna(), columns),
+        column_major(current[columns].dropna(), columns),
+    )
+
+
+# drift_report() of all rows, and of every hub without the hub column itself.
+# Every batch of columns is sorted once: regrouping the sorted rows by hub with
+# a stable sort of the hub codes leaves each hub's rows sorted by value
+def drift_reports(reference, current, columns=None, hub_column='hub_id'):
+    columns = list(reference.columns if columns is None else columns)
+    frame_columns = columns + ([hub_column] if hub_column not in columns else [])
+    reference = reference[frame_columns].dropna()
+    current = current[frame_columns].dropna()
+    reference_rows = reference.shape[0]
+    hub_ids, row_hubs = np.unique(
+        np.concatenate([reference[hub_column], current[hub_column]]),
+        return_inverse=True,
+    )
+    # Radix sorted, in linear time
+    row_hubs = row_hubs.astype(np.int16)
+    hub_rows = np.bincount(row_hubs, minlength=len(hub_ids))
+    hub_starts = np.concatenate([[0], np.cumsum(hub_rows)])
+    reference_hubs, current_hubs = row_hubs[:reference_rows], row_hubs[reference_rows:]
+    reference = column_major(reference, columns)
+    current = column_major(current, columns)
+    check_not_empty(reference, current)
+
+    # Hubs with reference and current rows
+    hubs = [
+        hub
+        for hub in range(len(hub_ids))
+        if (reference_hubs == hub).any() and (current_hubs == hub).any()
+    ]
+    drift_by_columns = {}
+    hub_drift = {hub: {} for hub in hubs}
+    for start in range(0, len(columns), COLUMN_BATCH):
+        names = columns[start : start + COLUMN_BATCH]
+        batch_reference = reference[start : start + COLUMN_BATCH]
+        batch_current = current[start : start + COLUMN_BATCH]
+        values, order = sorted_columns(batch_reference, batch_current)
+        statistics = sorted_statistics(
+            batch_reference,
+            batch_current,
+            values,
+            reference_below(order, reference_rows),
+        )
+        for i, name in enumerate(names):
+            drift_by_columns[name] = column_drift(name, statistics, i)
+
+        hub_columns = [i for i, name in enumerate(names) if name != hub_column]
+        if not hub_columns:
+            continue
+        by_hub = np.argsort(row_hubs[order[hub_columns]], axis=1, kind='stable')
+        order = np.take_along_axis(order[hub_columns], by_hub, axis=1)
+        values = np.take_along_axis(values[hub_columns], by_hub, axis=1)
+        del by_hub
+        for hub in hubs:
+            rows = slice(hub_starts[hub], hub_starts[hub + 1])
+            hub_reference = batch_reference[hub_columns][:, reference_hubs == hub]
+            statistics = sorted_statistics(
+                hub_reference,
+                batch_current[hub_columns][:, current_hubs == hub],
+                values[:, rows],
+                reference_below(order[:, rows], reference_rows),
+            )
+            for i, column in enumerate(hub_columns):
+                hub_drift[hub][names[column]] = column_drift(
+                    names[column], statistics, i
+                )
+
+    return column_report(drift_by_columns), {
+        str(hub_ids[hub]): column_report(hub_drift[hub]) for hub in hubs
+    }
+
+
+# drift_report() of every hub, without the hub column itself
+def drift_report_by_hub(reference, current, columns=None, hub_column='hub_id'):
+    columns = list(reference.columns if columns is None else columns)
+    columns = [col for col in columns if col != hub_column]
+    return drift_reports(reference, current, columns, hub_column)[1]
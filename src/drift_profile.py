@@ -0,0 +1,279 @@
+# drift_profile.py
+import numpy as np
+import pandas as pd
+from instrumentation import Stage
+from snapshot import read_snapshot
+
+# Bump when the layout of the profiles changes, cached profiles are rebuilt
+PROFILE_VERSION = 1
+# Columns identifying an order rather than describing it, and calendar features
+# that differ between any two windows by construction
+EXCLUDED_COLUMNS = [
+    'order_id',
+    'hub_id',
+    'delivery_month',
+    'day_of_year',
+    'day_of_week',
+    'number_of_week',
+]
+HISTOGRAM_BINS = 10
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+# Whole-number columns with at most this many values are compared value by value
+CATEGORY_MAX_VALUES = 20
+# A column drifted when its PSI is above PSI_THRESHOLD, a window when at least
+# DRIFT_SHARE of its columns did, the defaults of Evidently's DataDriftPreset
+PSI_THRESHOLD = 0.1
+DRIFT_SHARE = 0.5
+# Share given to empty bins, so the PSI stays finite
+PSI_EPSILON = 1e-4
+# Rolling windows in days, each ending with the latest complete day
+WINDOW_DAYS = {'day': 1, 'week': 7}
+
+
+def profile_columns(data):
+    numeric = data.select_dtypes(include=[np.number]).columns
+    return [
+        col
+        for col in numeric
+        if col not in EXCLUDED_COLUMNS and not col.endswith('_forecast')
+    ]
+
+
+def column_values(data, col):
+    return data[col].to_numpy(dtype=float, na_value=np.nan)
+
+
+# Bins of a column: the histogram bins between the reference deciles, or one bin
+# per reference value plus one for values the reference did not have
+def bin_count(column):
+    if column['type'] == 'cat':
+        return len(column['categories']) + 1
+    return len(column['edges']) + 1
+
+
+def bin_index(values, column):
+    if column['type'] == 'cat':
+        categories = np.asarray(column['categories'], dtype=float)
+        index = np.minimum(np.searchsorted(categories, values), len(categories) - 1)
+        return np.where(categories[index] == values, index, len(categories))
+    return np.searchsorted(np.asarray(column['edges'], dtype=float), values, 'right')
+
+
+# Histogram, quantiles and moments of the reference values of a column
+def column_profile(values):
+    present = values[~np.isnan(values)]
+    profile = {'rows': int(values.size), 'missing': int(values.size - present.size)}
+    if present.size == 0:
+        return {**profile, 'type': 'num', 'edges': [], 'counts': [0], 'mean': None}
+
+    categories = np.unique(present)
+    if categories.size <= CATEGORY_MAX_VALUES and np.all(
+        categories == np.round(categories)
+    ):
+        profile.update(type='cat', categories=categories.tolist())
+    else:
+        deciles = np.quantile(present, np.linspace(0, 1, HISTOGRAM_BINS + 1)[1:-1])
+        profile.update(type='num', edges=np.unique(deciles).tolist())
+    counts = np.bincount(bin_index(present, profile), minlength=bin_count(profile))
+    profile.update(
+        counts=counts.tolist(),
+        quantiles=dict(
+            zip([str(q) for q in QUANTILES], np.quantile(present, QUANTILES).tolist())
+        ),
+        mean=float(present.mean()),
+        std=float(present.std()),
+        min=float(present.min()),
+        max=float(present.max()),
+    )
+    return profile
+
+
+# Profile of the reference window, per hub, which every window of that hub is
+# compared against
+def build_reference_profile(data, start, end):
+    columns = profile_columns(data)
+    hubs = {}
+    for hub_id, hub_data in data.groupby('hub_id'):
+        hubs[str(hub_id)] = {
+            'rows': int(hub_data.shape[0]),
+            'columns': {
+                col: column_profile(column_values(hub_data, col)) for col in columns
+            },
+        }
+    return {
+        'version': PROFILE_VERSION,
+        'start': str(start),
+        'end': str(end),
+        'columns': columns,
+        'hubs': hubs,
+    }
+
+
+def day_key(day):
+    return day.strftime('%Y-%m-%d')
+
+
+# Per day and hub, the rows and, per column, the counts in the bins of the
+# reference profile of the hub, missing values and sum. Counts of a window are
+# the sums of the counts of its days, so a day is read and binned only once
+def day_profiles(data, reference):
+    profiles = {}
+    days = data['delivery_time'].dt.floor('D')
+    for hub_id, hub_data in data.groupby('hub_id'):
+        hub_reference = reference['hubs'].get(str(hub_id))
+        if hub_reference is None:
+            continue
+        codes, hub_days = pd.factorize(days.loc[hub_data.index], sort=True)
+        rows = np.bincount(codes, minlength=len(hub_days))
+
+        columns = {}
+        for col in reference['columns']:
+            column = hub_reference['columns'][col]
+            values = column_values(hub_data, col)
+            missing = np.isnan(values)
+            # The last bin of every day counts the missing values
+            bins = bin_count(column) + 1
+            index = np.where(missing, bins - 1, bin_index(values, column))
+            counts = np.bincount(codes * bins + index, minlength=len(hub_days) * bins)
+            sums = np.bincount(
+                codes, weights=np.where(missing, 0.0, values), minlength=len(hub_days)
+            )
+            columns[col] = (counts.reshape(len(hub_days), bins), sums)
+
+        for i, day in enumerate(hub_days):
+            profiles.setdefault(day_key(day), {})[str(hub_id)] = {
+                'rows': int(rows[i]),
+                'columns': {
+                    col: {
+                        'counts': counts[i, :-1].tolist(),
+                        'missing': int(counts[i, -1]),
+                        'sum': float(sums[i]),
+                    }
+                    for col, (counts, sums) in columns.items()
+                },
+            }
+    return profiles
+
+
+def population_stability_index(reference_counts, current_counts):
+    reference = np.asarray(reference_counts, dtype=float)
+    current = np.asarray(current_counts, dtype=float)
+    reference = np.clip(reference / max(reference.sum(), 1.0), PSI_EPSILON, None)
+    current = np.clip(current / max(current.sum(), 1.0), PSI_EPSILON, None)
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+
+# Drift of a window of a hub, from the profiles of the days it spans
+def compare_window(reference, profiles, hub, days, window):
+    hub_reference = reference['hubs'][hub]
+    day_profiles = [profiles[day][hub] for day in days if hub in profiles.get(day, {})]
+    rows = sum(profile['rows'] for profile in day_profiles)
+    if rows == 0:
+        return None
+
+    drift_by_columns = {}
+    for col in reference['columns']:
+        column = hub_reference['columns'][col]
+        counts = np.sum(
+            [profile['columns'][col]['counts'] for profile in day_profiles], axis=0
+        )
+        present = int(counts.sum())
+        if present == 0 or column['mean'] is None:
+            continue
+        current_sum = sum(profile['columns'][col]['sum'] for profile in day_profiles)
+        score = population_stability_index(column['counts'], counts)
+        drift_by_columns[col] = {
+            'column_type': column['type'],
+            'stattest_name': 'PSI',
+            'drift_score': score,
+            'threshold': PSI_THRESHOLD,
+            'drift_detected': score > PSI_THRESHOLD,
+            'reference_mean': column['mean'],
+            'current_mean': current_sum / present,
+        }
+
+    drifted = sum(result['drift_detected'] for result in drift_by_columns.values())
+    share = drifted / max(len(drift_by_columns), 1)
+    return {
+        'window': window,
+        'hub_id': int(hub),
+        'start': days[0],
+        'end': day_key(pd.Timestamp(days[-1]) + pd.Timedelta(days=1)),
+        'rows': rows,
+        'number_of_columns': len(drift_by_columns),
+        'number_of_drifted_columns': drifted,
+        'share_of_drifted_columns': share,
+        'dataset_drift': share >= DRIFT_SHARE,
+        'drift_by_columns': drift_by_columns,
+    }
+
+
+# What a cached state of the rolling windows was computed against
+def reference_key(reference):
+    return {key: reference[key] for key in ['version', 'start', 'end', 'columns']}
+
+
+def new_state(reference):
+    return {'reference': reference_key(reference), 'last_day': None, 'days': {}}
+
+
+# Bring the rolling windows up to the last complete day before `latest`: read
+# the days after the last day of `state` (at most `backfill_days` of them, plus
+# the days before them the windows need), bin them, and compare the windows
+# ending with each of those days against the reference. The work is bounded by
+# the window lengths and backfill_days, not by the history in the snapshot.
+# Returns the updated state and the results of the windows computed
+def update_drift(
+    snapshot_path, reference, state, latest, windows=WINDOW_DAYS, backfill_days=7
+):
+    if state is None or state['reference'] != reference_key(reference):
+        state = new_state(reference)
+
+    # The day of the latest delivery is still open
+    last_day = latest.floor('D') - pd.Timedelta(days=1)
+    first_day = last_day - pd.Timedelta(days=backfill_days - 1)
+    # Days up to the last day of the state are binned already
+    known_until = None
+    if state['last_day'] is not None:
+        known_until = pd.Timestamp(state['last_day'], tz='UTC')
+        first_day = max(first_day, known_until + pd.Timedelta(days=1))
+    if first_day > last_day:
+        return state, []
+
+    longest = max(windows.values())
+    read_start = first_day - pd.Timedelta(days=longest - 1)
+    if known_until is not None:
+        read_start = max(read_start, known_until + pd.Timedelta(days=1))
+    columns = ['hub_id', 'delivery_time'] + reference['columns']
+    with Stage('read') as step:
+        data = read_snapshot(
+            snapshot_path,
+            columns=columns,
+            start=read_start,
+            end=last_day + pd.Timedelta(days=1),
+        )
+        step.rows_out = data.shape[0]
+    with Stage('profile', rows_in=data.shape[0]):
+        state['days'].update(day_profiles(data, reference))
+
+    results = []
+    with Stage('compare') as step:
+        for end_day in pd.date_range(first_day, last_day, freq='D'):
+            for window, length in windows.items():
+                days = [
+                    day_key(day)
+                    for day in pd.date_range(end=end_day, periods=length, freq='D')
+                ]
+                for hub in reference['hubs']:
+                    result = compare_window(reference, state['days'], hub, days, window)
+                    if result is not None:
+                        results.append(result)
+        step.rows_out = len(results)
+
+    # Keep only the days the windows ending after last_day still need
+    oldest = day_key(last_day - pd.Timedelta(days=longest - 2))
+    state['days'] = {
+        day: profile for day, profile in state['days'].items() if day >= oldest
+    }
+    state['last_day'] = day_key(last_day)
+    return state, results
@@ -0,0 +1,44 @@
+# hpo_dataset.py
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+
+from column_generator import build_training_features, feature_matrix
+
+
+# Train/validation split of one HPO study, built once and shared by all its
+# trials: float32 feature matrices for the random forest, and the quantized
+# DMatrix pair for XGBoost, built on first use in each process
+class StudyDataset:
+    def __init__(self, df, target, hub_id):
+        self.features = build_training_features(df.columns)
+        self.target = target
+        self.hub_id = hub_id
+
+        train, test = train_test_split(df, test_size=0.3, random_state=42)
+        self.X_train = feature_matrix(train, self.features)
+        self.y_train = train[target].to_numpy(dtype=np.float64)
+        self.X_val = feature_matrix(test, self.features)
+        self.y_val = test[target].to_numpy(dtype=np.float64)
+
+        self._dmatrices = None
+
+    # DMatrix objects are not sent to the worker processes, each worker builds
+    # its own on the first trial of the study
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_dmatrices'] = None
+        return state
+
+    # Train and validation matrices for xgb.train; the validation one shares the
+    # quantile cuts of the train one, as early stopping needs
+    def dmatrices(self, nthread=None):
+        if self._dmatrices is None:
+            train_matrix = xgb.QuantileDMatrix(
+                self.X_train, label=self.y_train, nthread=nthread
+            )
+            valid_matrix = xgb.QuantileDMatrix(
+                self.X_val, label=self.y_val, ref=train_matrix, nthread=nthread
+            )
+            self._dmatrices = (train_matrix, valid_matrix)
+        return self._dmatrices
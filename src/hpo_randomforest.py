@@ -2,20 +2,19 @@ import os
 import sys
 import json
 
-import numpy as np
 import mlflow
-import pandas as pd
-from joblib import dump
-from hyperopt import STATUS_OK, Trials, hp, tpe, fmin
+from hyperopt import STATUS_OK, hp
 from hyperopt.pyll import scope
 from sklearn.metrics import mean_squared_error
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
 
 src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
 sys.path.append(src_path)
 
 from column_generator import build_training_features
+from hpo_dataset import StudyDataset
+from parallel_hpo import rungs, run_studies
+from snapshot import read_snapshot, snapshot_columns
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -30,9 +29,9 @@ EFS_MOUNT_POINT = (
 # mlflow.set_tracking_uri("sqlite:///" + os.path.join(EFS_MOUNT_POINT, 'mlflow.db'))
 # mlflow.set_tracking_uri("sqlite:///" + os.path.join(EFS_MOUNT_POINT, 'mlflow.db')
 
-input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.pkl')
+input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.parquet')
 output_file_path = os.path.join(EFS_MOUNT_POINT, 'hpo_randomforest.json')
-max_evals = os.getenv("HPO_MAX_EVALS", 10)
+max_evals = int(os.getenv("HPO_MAX_EVALS", 10))
 
 mlflow.set_experiment("hpo-bags")
 
@@ -55,84 +54,117 @@ def data_for_target(df, target_column, hub_id):
     return data
 
 
+# Trees of the smallest forest pruning compares trials at
+MIN_TREES = 100
+
+
+def objective(params, study, n_jobs, report=None):
+    with mlflow.start_run():
+        print(params)
+        mlflow.log_params(params)
+        mlflow.log_param('features', len(study.features))
+        mlflow.set_tag('regressor', 'randomforest')
+        mlflow.log_param('target', study.target)
+        mlflow.log_param('hub_id', study.hub_id)
+
+        # With pruning, grow the forest in stages (warm_start adds trees to the
+        # fitted ones) and check its RMSE at every rung
+        n_estimators = params['n_estimators']
+        stages = [n_estimators]
+        if report is not None:
+            stages = rungs(MIN_TREES, n_estimators) + stages
+
+        model = RandomForestRegressor(
+            **{**params, 'warm_start': report is not None}, n_jobs=n_jobs
+        )
+        pruned = False
+        for trees in stages:
+            model.set_params(n_estimators=trees)
+            model.fit(study.X_train, study.y_train)
+            y_pred = model.predict(study.X_val)
+            rmse = mean_squared_error(study.y_val, y_pred, squared=False)
+            if trees < n_estimators and report(trees, rmse):
+                pruned = True
+                break
+        mlflow.log_metric("rmse", rmse)
+        mlflow.log_metric("trees", trees)
+        mlflow.set_tag('pruned', pruned)
+
+    return {'loss': rmse, 'status': STATUS_OK, 'pruned': pruned}
+
+
+# n_jobs is not searched, it is set from the cores available to a trial
+space = {
+    'bootstrap': hp.choice('bootstrap', [False]),
+    'ccp_alpha': hp.uniform('ccp_alpha', 0.0, 0.1),
+    'criterion': hp.choice('criterion', ['squared_error']),
+    'max_depth': scope.int(hp.quniform('max_depth', 20, 40, 1)),
+    'max_features': hp.choice('max_features', ['sqrt']),
+    'max_leaf_nodes': hp.choice('max_leaf_nodes', [None]),
+    'max_samples': hp.choice('max_samples', [None]),
+    'min_impurity_decrease': hp.uniform('min_impurity_decrease', 0.0, 0.1),
+    'min_samples_leaf': scope.int(hp.quniform('min_samples_leaf', 1, 5, 1)),
+    'min_samples_split': scope.int(hp.quniform('min_samples_split', 5, 15, 1)),
+    'min_weight_fraction_leaf': hp.uniform('min_weight_fraction_leaf', 0.0, 0.1),
+    'n_estimators': scope.int(hp.quniform('n_estimators', 700, 900, 100)),
+    'oob_score': hp.choice('oob_score', [False]),
+    'random_state': hp.choice('random_state', [42]),
+    'verbose': hp.choice('verbose', [0]),
+    'warm_start': hp.choice('warm_start', [False]),
+}
+
+
 def hpo(df, target, hub_id):
-    def objective(params):
-        with mlflow.start_run():
-            print(params)
-            mlflow.log_params(params)
-            mlflow.log_param('features', len(features))
-            mlflow.set_tag('regressor', 'randomforest')
-            mlflow.log_param('target', target)
-            mlflow.log_param('hub_id', hub_id)
-
-            X_train = train[features].values
-            y_train = train[target].values
-            X_val = test[features].values
-            y_val = test[target].values
-
-            model = RandomForestRegressor(**params)
-            model.fit(X_train, y_train)
-            y_pred = model.predict(X_val)
-            rmse = mean_squared_error(y_val, y_pred, squared=False)
-            mlflow.log_metric("rmse", rmse)
-
-        return {'loss': rmse, 'status': STATUS_OK}
+    studies = {hub_id: (space, max_evals, StudyDataset(df, target, hub_id))}
+    return run_studies(objective, studies)[hub_id]
 
-    features = build_training_features(df.columns)
-    train, test = train_test_split(df, test_size=0.3, random_state=42)
-
-    space = {
-        'bootstrap': hp.choice('bootstrap', [False]),
-        'ccp_alpha': hp.uniform('ccp_alpha', 0.0, 0.1),
-        'criterion': hp.choice('criterion', ['squared_error']),
-        'max_depth': scope.int(hp.quniform('max_depth', 20, 40, 1)),
-        'max_features': hp.choice('max_features', ['sqrt']),
-        'max_leaf_nodes': hp.choice('max_leaf_nodes', [None]),
-        'max_samples': hp.choice('max_samples', [None]),
-        'min_impurity_decrease': hp.uniform('min_impurity_decrease', 0.0, 0.1),
-        'min_samples_leaf': scope.int(hp.quniform('min_samples_leaf', 1, 5, 1)),
-        'min_samples_split': scope.int(hp.quniform('min_samples_split', 5, 15, 1)),
-        'min_weight_fraction_leaf': hp.uniform('min_weight_fraction_leaf', 0.0, 0.1),
-        'n_estimators': scope.int(hp.quniform('n_estimators', 700, 900, 100)),
-        'n_jobs': hp.choice('n_jobs', [6]),
-        'oob_score': hp.choice('oob_score', [False]),
-        'random_state': hp.choice('random_state', [42]),
-        'verbose': hp.choice('verbose', [0]),
-        'warm_start': hp.choice('warm_start', [False]),
-    }
-
-    trials = Trials()
-    best = fmin(
-        fn=objective, space=space, algo=tpe.suggest, max_evals=max_evals, trials=trials
-    )
 
-    return best
+TARGET_COLUMNS = ['deep_frozen_bags', 'cold_bags', 'bags']
+HUB_IDS = [1, 4]
 
 
-def run(data):
-    target_columns = ['deep_frozen_bags', 'cold_bags', 'bags']
+def load_data():
+    # Load only the columns and hubs the studies use
+    features = build_training_features(snapshot_columns(input_file_path))
+    used_columns = []
+    for target_column in TARGET_COLUMNS:
+        used_columns.extend(build_names(target_column))
+    return read_snapshot(
+        input_file_path, columns=['hub_id'] + features + used_columns, hub_ids=HUB_IDS
+    )
 
-    result = {}
-    for hub_id in [1, 4]:
-        print("hub ", hub_id)
-        for target_column_prefix in target_columns:
+
+# All (hub, target) studies run concurrently, see parallel_hpo.run_studies
+def run(data):
+    studies = {}
+    for hub_id in HUB_IDS:
+        for target_column_prefix in TARGET_COLUMNS:
             df = data_for_target(data, target_column_prefix, hub_id)
             target_column_name, _ = build_names(target_column_prefix)
             target = target_column_name
 
-            best_params = hpo(df, target, hub_id)
-            if target_column_prefix not in result:
-                result[target_column_prefix] = {}
-            result[target_column_prefix][hub_id] = best_params
+            studies[(target_column_prefix, hub_id)] = (
+                space,
+                max_evals,
+                StudyDataset(df, target, hub_id),
+            )
+
+    best_params = run_studies(objective, studies)
+
+    result = {}
+    for (target_column_prefix, hub_id), best in best_params.items():
+        if target_column_prefix not in result:
+            result[target_column_prefix] = {}
+        result[target_column_prefix][hub_id] = best
 
-            # model = train_model(df, best_params, target, features)
-            # save_model(model, target_column, hub_id)
+        # model = train_model(df, best_params, target, features)
+        # save_model(model, target_column, hub_id)
     print(result)
     return result
 
 
 def main():
-    data = pd.read_pickle(input_file_path)
+    data = load_data()
     result = run(data)
     with open(output_file_path, 'w') as fp:
         json.dump(result, fp, indent=4, default=str)
@@ -141,8 +173,8 @@ def main():
 
 def lambda_handler(event, context):
     result = main()
-    json = json.dumps(result, indent=4, default=str)
-    return {'statusCode': 200, 'body': json}
+    body = json.dumps(result, indent=4, default=str)
+    return {'statusCode': 200, 'body': body}
 
 
 if __name__ == '__main__':
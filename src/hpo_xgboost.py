@@ -4,18 +4,18 @@ import json
 
 import numpy as np
 import mlflow
-import pandas as pd
 import xgboost as xgb
-from joblib import dump
-from hyperopt import STATUS_OK, Trials, hp, tpe, fmin
+from hyperopt import STATUS_OK, hp
 from hyperopt.pyll import scope
 from sklearn.metrics import mean_squared_error
-from sklearn.model_selection import train_test_split
 
 src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
 sys.path.append(src_path)
 
 from column_generator import build_training_features
+from hpo_dataset import StudyDataset
+from parallel_hpo import rungs, run_studies
+from snapshot import read_snapshot, snapshot_columns
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -30,7 +30,7 @@ EFS_MOUNT_POINT = (
 # mlflow.set_tracking_uri("sqlite:///" + os.path.join(EFS_MOUNT_POINT, 'mlflow.db'))
 # mlflow.set_tracking_uri("sqlite:///" + os.path.join(EFS_MOUNT_POINT, 'mlflow.db')
 
-input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.pkl')
+input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.parquet')
 output_file_path = os.path.join(EFS_MOUNT_POINT, 'hpo_xgboost.json')
 max_evals = int(os.getenv("HPO_MAX_EVALS", 10))
 
@@ -55,87 +55,120 @@ def data_for_target(df, target_column, hub_id):
     return data
 
 
+# Boosting rounds of a trial, and the rounds at which pruning compares trials
+NUM_BOOST_ROUND = 1000
+BOOST_ROUND_RUNGS = rungs(30, NUM_BOOST_ROUND)
+
+
+# Reports the validation RMSE at the rungs, stops boosting if the trial is pruned
+class RungCallback(xgb.callback.TrainingCallback):
+    def __init__(self, report):
+        super().__init__()
+        self.report = report
+        self.pruned = False
+
+    def after_iteration(self, model, epoch, evals_log):
+        rounds = epoch + 1
+        if rounds in BOOST_ROUND_RUNGS:
+            self.pruned = self.report(rounds, evals_log['validation']['rmse'][-1])
+        return self.pruned
+
+
+def objective(params, study, n_jobs, report=None):
+    with mlflow.start_run():
+        print(params)
+        mlflow.log_params(params)
+        mlflow.log_param('features', len(study.features))
+        mlflow.set_tag('regressor', 'xgboost')
+        mlflow.log_param('target', study.target)
+        mlflow.log_param('hub_id', study.hub_id)
+
+        train_matrix, valid_matrix = study.dmatrices(n_jobs)
+        callbacks = [] if report is None else [RungCallback(report)]
+        model = xgb.train(
+            params={**params, 'nthread': n_jobs},
+            # device="cuda", tree_method="gpu_hist",
+            dtrain=train_matrix,
+            num_boost_round=NUM_BOOST_ROUND,
+            evals=[(valid_matrix, 'validation')],
+            early_stopping_rounds=50,
+            callbacks=callbacks,
+        )
+        pruned = any(callback.pruned for callback in callbacks)
+        y_pred = model.predict(valid_matrix)
+        rmse = mean_squared_error(study.y_val, y_pred, squared=False)
+        mlflow.log_metric("rmse", rmse)
+        mlflow.log_metric("boost_rounds", model.num_boosted_rounds())
+        mlflow.set_tag('pruned', pruned)
+
+    return {'loss': rmse, 'status': STATUS_OK, 'pruned': pruned}
+
+
+space = {
+    # 'booster': hp.choice('booster', ['gbtree', 'gblinear']),
+    'objective': hp.choice('objective', ["reg:squarederror"]),
+    'random_state': 42,
+    'colsample_bytree': hp.uniform('colsample_bytree', 0.5, 1),
+    'gamma': hp.uniform('gamma', 0.2, 0.35),
+    'learning_rate': hp.loguniform('learning_rate', np.log(0.005), np.log(0.03)),
+    'max_depth': scope.int(hp.quniform('max_depth', 7, 13, 1)),
+    'n_estimators': scope.int(hp.quniform('n_estimators', 700, 1400, 100)),
+    'subsample': hp.uniform('subsample', 0.4, 1),
+    'verbosity': 0,
+}
+
+
 def hpo(df, target, hub_id):
-    def objective(params):
-        with mlflow.start_run():
-            print(params)
-            mlflow.log_params(params)
-            mlflow.log_param('features', len(features))
-            mlflow.set_tag('regressor', 'xgboost')
-            mlflow.log_param('target', target)
-            mlflow.log_param('hub_id', hub_id)
-
-            # model = RandomForestRegressor(**params)
-            X_train = train[features].values
-            y_train = train[target].values
-            print(X_train[0])
-            print(y_train[0])
-            X_val = test[features].values
-            y_val = test[target].values
-            train_matrix = xgb.DMatrix(X_train, label=y_train)
-            valid_matrix = xgb.DMatrix(X_val, label=y_val)
-            model = xgb.train(
-                params=params,
-                # device="cuda", tree_method="gpu_hist",
-                dtrain=train_matrix,
-                num_boost_round=1000,
-                evals=[(valid_matrix, 'validation')],
-                early_stopping_rounds=50,
-            )
-            y_pred = model.predict(valid_matrix)
-            rmse = mean_squared_error(y_val, y_pred, squared=False)
-            mlflow.log_metric("rmse", rmse)
+    studies = {hub_id: (space, max_evals, StudyDataset(df, target, hub_id))}
+    return run_studies(objective, studies)[hub_id]
 
-        return {'loss': rmse, 'status': STATUS_OK}
 
-    features = build_training_features(df.columns)
-    train, test = train_test_split(df, test_size=0.3, random_state=42)
-
-    space = {
-        # 'booster': hp.choice('booster', ['gbtree', 'gblinear']),
-        'objective': hp.choice('objective', ["reg:squarederror"]),
-        'random_state': 42,
-        'colsample_bytree': hp.uniform('colsample_bytree', 0.5, 1),
-        'gamma': hp.uniform('gamma', 0.2, 0.35),
-        'learning_rate': hp.loguniform('learning_rate', np.log(0.005), np.log(0.03)),
-        'max_depth': scope.int(hp.quniform('max_depth', 7, 13, 1)),
-        'n_estimators': scope.int(hp.quniform('n_estimators', 700, 1400, 100)),
-        'subsample': hp.uniform('subsample', 0.4, 1),
-        'verbosity': 0,
-    }
-
-    trials = Trials()
-    best = fmin(
-        fn=objective, space=space, algo=tpe.suggest, max_evals=max_evals, trials=trials
-    )
+TARGET_COLUMNS = ['deep_frozen_bags', 'cold_bags', 'bags']
+HUB_IDS = [1, 4]
 
-    return best
 
+def load_data():
+    # Load only the columns and hubs the studies use
+    features = build_training_features(snapshot_columns(input_file_path))
+    used_columns = []
+    for target_column in TARGET_COLUMNS:
+        used_columns.extend(build_names(target_column))
+    return read_snapshot(
+        input_file_path, columns=['hub_id'] + features + used_columns, hub_ids=HUB_IDS
+    )
 
-def run(data):
-    target_columns = ['deep_frozen_bags', 'cold_bags', 'bags']
 
-    result = {}
-    for hub_id in [1, 4]:
-        print("hub ", hub_id)
-        for target_column_prefix in target_columns:
+# All (hub, target) studies run concurrently, see parallel_hpo.run_studies
+def run(data):
+    studies = {}
+    for hub_id in HUB_IDS:
+        for target_column_prefix in TARGET_COLUMNS:
             df = data_for_target(data, target_column_prefix, hub_id)
             target_column_name, _ = build_names(target_column_prefix)
             target = target_column_name
 
-            best_params = hpo(df, target, hub_id)
-            if target_column_prefix not in result:
-                result[target_column_prefix] = {}
-            result[target_column_prefix][hub_id] = best_params
+            studies[(target_column_prefix, hub_id)] = (
+                space,
+                max_evals,
+                StudyDataset(df, target, hub_id),
+            )
+
+    best_params = run_studies(objective, studies)
+
+    result = {}
+    for (target_column_prefix, hub_id), best in best_params.items():
+        if target_column_prefix not in result:
+            result[target_column_prefix] = {}
+        result[target_column_prefix][hub_id] = best
 
-            # model = train_model(df, best_params, target, features)
-            # save_model(model, target_column, hub_id)
+        # model = train_model(df, best_params, target, features)
+        # save_model(model, target_column, hub_id)
     print(result)
     return result
 
 
 def main():
-    data = pd.read_pickle(input_file_path)
+    data = load_data()
     result = run(data)
     with open(output_file_path, 'w') as fp:
         json.dump(result, fp, indent=4, default=str)
@@ -144,8 +177,8 @@ def main():
 
 def lambda_handler(event, context):
     result = main()
-    json = json.dumps(result, indent=4, default=str)
-    return {'statusCode': 200, 'body': json}
+    body = json.dumps(result, indent=4, default=str)
+    return {'statusCode': 200, 'body': body}
 
 
 if __name__ == '__main__':
@@ -2,59 +2,98 @@ import os
 
 import pandas as pd
 from pandas import DataFrame
+from column_generator import apply_feature_schema
+from download import STREAM_SELECT, STREAM_ITERSIZE
+from instrumentation import Stage, clear_metrics, collected_metrics
+from profiling import profiled
+from snapshot import write_snapshot
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
 
+# EFS mount point for Lambda
+current_script_dir = os.path.dirname(__file__)
+EFS_MOUNT_POINT = (
+    '/mnt/efs' if IS_LAMBDA else os.path.join(current_script_dir, '../data')
+)
+# Path to the input CSV file
+input_csv_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.csv')
+# Path to the output Parquet snapshot
+output_snapshot_path = os.path.join(EFS_MOUNT_POINT, 'current_state.parquet')
+
 
 def transform(data: DataFrame, *args, **kwargs) -> DataFrame:
     data['delivery_time'] = pd.to_datetime(data['delivery_time'], utc=True)
     return data
 
 
+# Adds the calendar features to data in place, without copying the frame
 def extra_features(data: DataFrame, *args, **kwargs) -> DataFrame:
-    df_enriched = data.copy()
-    df_enriched['day_of_year'] = df_enriched['delivery_time'].dt.dayofyear
-    df_enriched['day_of_week'] = df_enriched['delivery_time'].dt.dayofweek
-    df_enriched['number_of_week'] = df_enriched['delivery_time'].dt.isocalendar().week
-    df_enriched['delivery_hour'] = df_enriched['delivery_time'].dt.hour
-    return df_enriched
-
-
-def do_ingest():
-    # EFS mount point for Lambda
-    current_script_dir = os.path.dirname(__file__)
-    EFS_MOUNT_POINT = (
-        '/mnt/efs' if IS_LAMBDA else os.path.join(current_script_dir, '../data')
-    )
-    # Path to the input CSV file
-    input_csv_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.csv')
-    # Path to the output pickle file
-    output_pickle_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.pkl')
+    delivery_time = data['delivery_time'].dt
+    day_of_week = delivery_time.dayofweek
+    data['day_of_year'] = delivery_time.dayofyear.astype('int16')
+    data['day_of_week'] = day_of_week.astype('int8')
+    # ISO week number is the week of the year the Thursday of the same week is in
+    thursday = data['delivery_time'] + pd.to_timedelta(3 - day_of_week, unit='D')
+    data['number_of_week'] = ((thursday.dt.dayofyear - 1) // 7 + 1).astype('int8')
+    data['delivery_hour'] = delivery_time.hour.astype('int8')
+    return data
 
-    # Load data from CSV
-    data = pd.read_csv(input_csv_file_path)
 
-    # Apply transformations
-    data = transform(data)
-    data = extra_features(data)
+# Transform and enrich the data one chunk at a time, e.g. chunks of
+# download.iter_select(), so the raw rows never have to be held all at once
+def ingest_chunks(chunks):
+    return pd.concat(
+        [apply_feature_schema(extra_features(transform(chunk))) for chunk in chunks],
+        ignore_index=True,
+    )
 
-    # Print first and last delivery_time found
-    first_delivery_time = data['delivery_time'].min()
-    last_delivery_time = data['delivery_time'].max()
-    print(f"First delivery time: {first_delivery_time}")
-    print(f"Last delivery time: {last_delivery_time}")
-    # Save the DataFrame as a pickle file
-    data.to_pickle(output_pickle_file_path)
 
-    print(f"Data successfully ingested and saved to {output_pickle_file_path}")
+@profiled('ingest')
+def do_ingest(chunks=None):
+    with Stage('ingest') as ingest:
+        # Load data from CSV, unless the chunks are streamed in by the caller.
+        # Floats are parsed exactly as written, to get the values of the database
+        if chunks is None and STREAM_SELECT:
+            chunks = pd.read_csv(
+                input_csv_file_path,
+                chunksize=STREAM_ITERSIZE,
+                float_precision='round_trip',
+            )
+        elif chunks is None:
+            with Stage('read') as step:
+                chunks = [
+                    pd.read_csv(input_csv_file_path, float_precision='round_trip')
+                ]
+                step.rows_out = chunks[0].shape[0]
+
+        # Apply transformations, streamed chunks are read as they are transformed
+        with Stage('features') as step:
+            data = ingest_chunks(chunks)
+            step.rows_out = data.shape[0]
+
+        # Print first and last delivery_time found
+        first_delivery_time = data['delivery_time'].min()
+        last_delivery_time = data['delivery_time'].max()
+        print(f"First delivery time: {first_delivery_time}")
+        print(f"Last delivery time: {last_delivery_time}")
+        # Save the DataFrame as a Parquet snapshot
+        with Stage('write', rows_in=data.shape[0]):
+            write_snapshot(data, output_snapshot_path)
+        ingest.rows_out = data.shape[0]
+
+    print(f"Data successfully ingested and saved to {output_snapshot_path}")
 
 
 def lambda_handler(event, context):
+    clear_metrics()
     do_ingest()
     return {
         'statusCode': 200,
-        'body': f"Data successfully ingested and saved to {output_pickle_file_path}",
+        'body': {
+            'result': f"Data successfully ingested and saved to {output_snapshot_path}",
+            'metrics': collected_metrics(),
+        },
     }
 
 
@@ -0,0 +1,176 @@
+# instrumentation.py
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from datetime import datetime, timezone
+
+# Print every finished stage as a JSON line on stdout (CloudWatch on Lambda),
+# append them to METRICS_FILE if set, and log them as MLflow metrics
+METRICS_LOG = os.getenv('METRICS_LOG', '1') == '1'
+METRICS_FILE = os.getenv('METRICS_FILE')
+METRICS_MLFLOW = os.getenv('METRICS_MLFLOW', '0') == '1'
+
+METRIC_NAMES = ['wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'rows_per_second']
+# Fields of a record, any other field is a label
+RECORD_FIELDS = METRIC_NAMES + ['stage', 'started_at', 'rows_in', 'rows_out', 'error']
+
+# Records of the stages finished since clear_metrics(), and the stages running,
+# per thread. Kept at module level, so a Lambda handler clears them first
+_records = []
+_local = threading.local()
+
+
+def open_stages():
+    if not hasattr(_local, 'stages'):
+        _local.stages = []
+    return _local.stages
+
+
+# Peak RSS of the process since the last reset_peak_rss(), in KB. Linux keeps
+# it in VmHWM; elsewhere it falls back to the peak of the whole process
+def read_peak_rss_kb():
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+
+# Times a stage or a sub-step of one, nested stages are named after the stages
+# they run in, e.g. predict.writeback:
+#
+#     with Stage('writeback', rows_in=data.shape[0]) as step:
+#         step.rows_out = update_postgresql(data)
+#
+# Records wall and CPU time, peak RSS, rows in and out and rows/sec. Extra
+# keyword arguments are recorded as labels, e.g. model='bags_1'
+class Stage:
+    def __init__(self, name, rows_in=None, rows_out=None, **labels):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.labels = labels
+        self.record = None
+
+    def __enter__(self):
+        stages = open_stages()
+        self.path = '.'.join([parent.name for parent in stages] + [self.name])
+        # The peak RSS is reset for this stage, the stages it runs in keep the
+        # peak they had seen so far
+        peak_rss = read_peak_rss_kb()
+        for parent in stages:
+            parent.peak_rss_kb = max(parent.peak_rss_kb, peak_rss)
+        reset_peak_rss()
+        self.peak_rss_kb = read_peak_rss_kb()
+        stages.append(self)
+
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall_seconds = time.perf_counter() - self.start_wall
+        cpu_seconds = time.process_time() - self.start_cpu
+        stages = open_stages()
+        stages.remove(self)
+        self.peak_rss_kb = max(self.peak_rss_kb, read_peak_rss_kb())
+        for parent in stages:
+            parent.peak_rss_kb = max(parent.peak_rss_kb, self.peak_rss_kb)
+
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        self.record = {
+            'stage': self.path,
+            'started_at': self.started_at,
+            'wall_seconds': round(wall_seconds, 6),
+            'cpu_seconds': round(cpu_seconds, 6),
+            'peak_rss_mb': round(self.peak_rss_kb / 1024, 1),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rows_per_second': (
+                None if rows is None else round(rows / max(wall_seconds, 1e-9), 1)
+            ),
+            **self.labels,
+        }
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        _records.append(self.record)
+        emit(self.record)
+        if METRICS_MLFLOW and not stages:
+            log_to_mlflow(self.path)
+        return False
+
+
+# Stands in for Stage where timing a step would cost about as much as the step,
+# e.g. the micro-batches of the prediction server. Records nothing
+class Untimed:
+    def __init__(self, name, rows_in=None, rows_out=None, **labels):
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+def emit(record):
+    line = json.dumps(record, default=str)
+    if METRICS_LOG:
+        print(line, flush=True)
+    if METRICS_FILE:
+        with open(METRICS_FILE, 'a') as fp:
+            fp.write(line + '\n')
+
+
+# Records of the stages finished since the last clear_metrics(), e.g. for the
+# body of a Lambda response
+def collected_metrics():
+    return list(_records)
+
+
+def clear_metrics():
+    _records.clear()
+
+
+# Log the records of a finished top-level stage and its sub-steps as the metrics
+# of one MLflow run, named after the stage and labels, e.g.
+# train.fit.bags_1.wall_seconds
+def log_to_mlflow(top_stage):
+    import mlflow
+
+    records = [
+        record
+        for record in _records
+        if record['stage'] == top_stage or record['stage'].startswith(top_stage + '.')
+    ]
+    with mlflow.start_run(run_name=f"{top_stage}-metrics"):
+        for record in records:
+            labels = [
+                str(value) for key, value in record.items() if key not in RECORD_FIELDS
+            ]
+            prefix = '.'.join([record['stage']] + labels)
+            mlflow.log_metrics(
+                {
+                    f"{prefix}.{name}": record[name]
+                    for name in METRIC_NAMES
+                    if record[name] is not None
+                }
+            )
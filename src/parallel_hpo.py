@@ -0,0 +1,212 @@
+# parallel_hpo.py
+import os
+import threading
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import Manager
+
+import numpy as np
+from hyperopt import JOB_STATE_DONE, Trials, space_eval, tpe
+from hyperopt.base import Domain, spec_from_misc
+
+# Determine if running in AWS Lambda or locally
+IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
+
+# Worker processes evaluating trials, and the maximum number of trials of all
+# studies evaluated at the same time. Lambda has no /dev/shm for process pools,
+# so trials are evaluated one after another there
+HPO_WORKERS = int(os.getenv('HPO_WORKERS', 1 if IS_LAMBDA else os.cpu_count() or 1))
+HPO_MAX_CONCURRENT_TRIALS = int(os.getenv('HPO_MAX_CONCURRENT_TRIALS', HPO_WORKERS))
+HPO_CORES = int(os.getenv('HPO_CORES', os.cpu_count() or 1))
+# Seed of the TPE suggestions of every study
+HPO_SEED = int(os.getenv('HPO_SEED', 42))
+# Stop trials early when their intermediate loss falls behind the other trials
+HPO_PRUNING = os.getenv('HPO_PRUNING', '0') == '1'
+# Keep the best 1/eta of the trials at each rung, rungs are eta times apart
+HPO_PRUNING_ETA = int(os.getenv('HPO_PRUNING_ETA', 3))
+
+# Objective and per-study data of the worker process, set by init_worker()
+_worker_state = {}
+
+
+# A hyperopt TPE study driven from outside: ask() for the parameters of a new
+# trial, tell() its result. Asked one at a time and told in order, it suggests
+# exactly what fmin(..., rstate=np.random.default_rng(seed)) would
+class Study:
+    def __init__(self, space, max_evals, seed=HPO_SEED):
+        self.space = space
+        self.max_evals = max_evals
+        self.domain = Domain(lambda params: None, space)
+        self.trials = Trials()
+        self.rstate = np.random.default_rng(seed)
+        self.asked = 0
+
+    def can_ask(self):
+        return self.asked < self.max_evals
+
+    # Returns the id of the new trial and the parameters to evaluate it with
+    def ask(self):
+        trial_ids = self.trials.new_trial_ids(1)
+        self.trials.refresh()
+        docs = tpe.suggest(
+            trial_ids, self.domain, self.trials, self.rstate.integers(2**31 - 1)
+        )
+        self.trials.insert_trial_docs(docs)
+        self.trials.refresh()
+        self.asked += 1
+
+        trial = self.trial(trial_ids[0])
+        return trial_ids[0], space_eval(self.space, spec_from_misc(trial['misc']))
+
+    def tell(self, trial_id, result):
+        trial = self.trial(trial_id)
+        trial['state'] = JOB_STATE_DONE
+        trial['result'] = result
+        self.trials.refresh()
+
+    def trial(self, trial_id):
+        return next(trial for trial in self.trials.trials if trial['tid'] == trial_id)
+
+    # Best point found, in the format fmin() returns it
+    def best(self):
+        return self.trials.argmin
+
+
+# Resource levels (boosting rounds, trees) at which trials are compared:
+# min_resource, min_resource * eta, ... below max_resource
+def rungs(min_resource, max_resource, eta=HPO_PRUNING_ETA):
+    levels = []
+    resource = min_resource
+    while resource < max_resource:
+        levels.append(resource)
+        resource *= eta
+    return levels
+
+
+# Asynchronous successive halving (ASHA): a trial reaching a rung goes on only
+# if its loss is among the best 1/eta of the losses reported at that rung so
+# far. The losses are kept in `losses`, a Manager dict when the trials of a
+# study run in several processes.
+class RungPruner:
+    def __init__(self, eta=HPO_PRUNING_ETA, losses=None, lock=None):
+        self.eta = eta
+        self.losses = {} if losses is None else losses
+        self.lock = threading.Lock() if lock is None else lock
+
+    # Record the loss of a trial at a rung, returns True if it should stop
+    def report(self, study_key, resource, loss):
+        key = (study_key, resource)
+        with self.lock:
+            rung_losses = sorted(self.losses.get(key, []) + [loss])
+            self.losses[key] = rung_losses
+
+        # Let the first trials of a rung through to have something to compare to
+        if len(rung_losses) < self.eta:
+            return False
+        return loss > rung_losses[len(rung_losses) // self.eta - 1]
+
+
+def init_worker(objective, studies_data, n_jobs, pruner=None):
+    _worker_state['objective'] = objective
+    _worker_state['studies_data'] = studies_data
+    _worker_state['n_jobs'] = n_jobs
+    _worker_state['pruner'] = pruner
+
+
+# Evaluate a trial. With pruning, the objective calls report(resource, loss) at
+# its rungs and stops training when it returns True; otherwise report is None
+def run_trial(study_key, params):
+    objective = _worker_state['objective']
+    study_data = _worker_state['studies_data'][study_key]
+    pruner = _worker_state['pruner']
+    report = None if pruner is None else partial(pruner.report, study_key)
+    return objective(params, study_data, _worker_state['n_jobs'], report)
+
+
+# Next study to ask a trial from: the one with the fewest trials in flight, so
+# the concurrent studies advance evenly
+def next_study(studies, in_flight):
+    candidates = [key for key, study in studies.items() if study.can_ask()]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda key: in_flight[key])
+
+
+# Run TPE studies concurrently on a pool of worker processes, evaluating up to
+# max_concurrent trials at a time. `studies` maps a study key to a tuple of
+# (space, max_evals, study_data), objective(params, study_data, n_jobs, report)
+# returns a hyperopt result dict. Returns the best point of every study.
+def run_studies(
+    objective,
+    studies,
+    workers=HPO_WORKERS,
+    max_concurrent=HPO_MAX_CONCURRENT_TRIALS,
+    cores=HPO_CORES,
+    seed=HPO_SEED,
+    pruning=HPO_PRUNING,
+):
+    state = {
+        key: Study(space, max_evals, seed)
+        for key, (space, max_evals, _) in studies.items()
+    }
+    studies_data = {key: study_data for key, (_, _, study_data) in studies.items()}
+    workers = max(1, min(workers, max_concurrent))
+    # Threads of a single trial, so concurrent trials don't oversubscribe the cores
+    n_jobs = max(1, cores // workers)
+
+    if workers == 1:
+        init_worker(objective, studies_data, n_jobs, RungPruner() if pruning else None)
+        while True:
+            key = next_study(state, {key: 0 for key in state})
+            if key is None:
+                break
+            trial_id, params = state[key].ask()
+            state[key].tell(trial_id, run_trial(key, params))
+        return best_points(state)
+
+    if not pruning:
+        run_pool(objective, state, studies_data, workers, n_jobs, None)
+        return best_points(state)
+
+    # The rung losses are shared by the trials running in the worker processes
+    with Manager() as manager:
+        pruner = RungPruner(losses=manager.dict(), lock=manager.Lock())
+        run_pool(objective, state, studies_data, workers, n_jobs, pruner)
+    return best_points(state)
+
+
+def run_pool(objective, state, studies_data, workers, n_jobs, pruner):
+    in_flight = {key: 0 for key in state}
+    pending = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(objective, studies_data, n_jobs, pruner),
+    ) as executor:
+        while True:
+            # Keep the pool busy with trials of the studies that are behind
+            while len(pending) < workers:
+                key = next_study(state, in_flight)
+                if key is None:
+                    break
+                trial_id, params = state[key].ask()
+                future = executor.submit(run_trial, key, params)
+                pending[future] = (key, trial_id)
+                in_flight[key] += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, trial_id = pending.pop(future)
+                in_flight[key] -= 1
+                state[key].tell(trial_id, future.result())
+
+
+# Best point of every study, with the number of its trials that were pruned
+def best_points(state):
+    for key, study in state.items():
+        pruned = sum(1 for result in study.trials.results if result.get('pruned'))
+        print(f"Study {key}: {len(study.trials.trials)} trials, {pruned} pruned")
+    return {key: study.best() for key, study in state.items()}
@@ -0,0 +1,83 @@
+# pipeline.py
+import os
+import sys
+import time
+
+from download import select_to_df, save_csv, DEFAULT_CSV_OUTPUT
+from ingest import ingest_chunks, output_snapshot_path
+from instrumentation import Stage, clear_metrics, collected_metrics
+from profiling import profiled
+from snapshot import as_snapshot, write_snapshot
+from transform import transform_data
+
+STAGES = ['download', 'ingest', 'transform', 'train']
+
+# Stage boundaries to write files at, e.g. PIPELINE_WRITE=download,transform
+DEFAULT_WRITE = [stage for stage in os.getenv('PIPELINE_WRITE', '').split(',') if stage]
+
+
+# Run download -> ingest -> transform -> train in this process on one DataFrame.
+# The files of a stage (current_state.csv for download, the Parquet snapshot for
+# ingest and transform) are written only if the stage is in `write`; the models
+# are always saved. Returns the train result and the seconds spent per stage.
+@profiled('pipeline')
+def run_pipeline(write=DEFAULT_WRITE, until='train'):
+    unknown_stages = set(write) - set(STAGES)
+    if unknown_stages:
+        raise ValueError(
+            f"Unknown pipeline stages: {', '.join(sorted(unknown_stages))}"
+        )
+
+    timings = {}
+    result = None
+    data = None
+    with Stage('pipeline'):
+        for stage in STAGES[: STAGES.index(until) + 1]:
+            start_time = time.perf_counter()
+
+            rows_in = None if data is None else data.shape[0]
+            with Stage(stage, rows_in=rows_in) as step:
+                if stage == 'download':
+                    data = select_to_df()
+                    if stage in write:
+                        save_csv(data, DEFAULT_CSV_OUTPUT)
+                elif stage == 'ingest':
+                    # Continue with the frame the next stage would read from the snapshot
+                    data = as_snapshot(ingest_chunks([data]))
+                    if stage in write:
+                        write_snapshot(data, output_snapshot_path)
+                elif stage == 'transform':
+                    data = as_snapshot(transform_data(data))
+                    if stage in write:
+                        write_snapshot(data, output_snapshot_path)
+                elif stage == 'train':
+                    # Runs without until='train' never import the training libraries
+                    from train import train_models
+
+                    result = train_models(data)
+                step.rows_out = data.shape[0]
+
+            timings[stage] = time.perf_counter() - start_time
+            print(f"Stage {stage} done in {timings[stage]:.2f}s, {data.shape[0]} rows")
+
+    return result, timings
+
+
+def lambda_handler(event, context):
+    clear_metrics()
+    result, timings = run_pipeline(
+        write=event.get('write', DEFAULT_WRITE), until=event.get('until', 'train')
+    )
+    return {
+        'statusCode': 200,
+        'body': {
+            'result': result,
+            'timings': timings,
+            'metrics': collected_metrics(),
+        },
+    }
+
+
+if __name__ == '__main__':
+    # Stages to write files at can be given as arguments: pipeline.py download ingest
+    print(run_pipeline(write=sys.argv[1:] or DEFAULT_WRITE))
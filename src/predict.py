@@ -1,15 +1,21 @@
 import os
-import warnings
+from collections import OrderedDict
 
-import numpy as np
-import joblib
 import pandas as pd
-import psycopg2
-from sklearn.metrics import mean_squared_error
-from column_generator import get_column_names, build_training_features
-from config import db_connect, TABLE_NAME
-from download import select_to_df
+from bulk_load import copy_frame
+from column_generator import (
+    get_column_names,
+    get_column_types,
+    apply_feature_schema,
+    build_training_features,
+    feature_matrix,
+)
+from compiled_model import CompiledEnsemble
+from config import db_connection, TABLE_NAME, NULL_FORECAST_PREDICATE
+from download import select_to_df, iter_select, peak_rss_mb, STREAM_SELECT
 from ingest import extra_features
+from instrumentation import Stage, Untimed, clear_metrics, collected_metrics
+from profiling import profiled
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -17,100 +23,263 @@ current_script_dir = os.path.dirname(__file__)
 EFS_MOUNT_POINT = '/mnt/efs' if IS_LAMBDA else os.path.join(current_script_dir, '..')
 # input_file_path = os.path.join(EFS_MOUNT_POINT, 'data', 'current_state.pkl')
 
+FORECAST_COLUMNS = [
+    'bags_used_forecast',
+    'cold_bags_used_forecast',
+    'deep_frozen_bags_used_forecast',
+]
+# Temporary table the forecasts are streamed into before the update
+FORECASTS_TABLE_NAME = 'bags_forecast_updates'
+# Number of forecasts streamed to PostgreSQL per COPY
+WRITEBACK_BATCH_SIZE = int(os.getenv('WRITEBACK_BATCH_SIZE', 50000))
 
-def load_data():
-    return extra_features(select_to_df())  # return pd.read_pickle(input_file_path)
+TARGET_COLUMNS = ['cold_bags', 'bags', 'deep_frozen_bags']
+HUB_IDS = [1, 4]
 
+# Score each hub with its single all_bags model trained by train.py with
+# MULTI_OUTPUT_MODELS=1, which predicts all TARGET_COLUMNS in one pass
+MULTI_OUTPUT_MODELS = os.getenv('MULTI_OUTPUT_MODELS', '0') == '1'
+MULTI_OUTPUT_TARGET = 'all_bags'
 
-def filter_rows_with_null_forecasts(data):
-    forecast_columns = [
-        'bags_used_forecast',
-        'cold_bags_used_forecast',
-        'deep_frozen_bags_used_forecast',
+# Upper bound for the memory held by cached models, in MB
+MODEL_CACHE_MAX_MB = int(os.getenv('MODEL_CACHE_MAX_MB', 2048))
+# Load all models while the module is imported, i.e. in the Lambda init phase
+PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', '0') == '1'
+
+# 'native' scores with the sklearn/xgboost models, 'compiled' with their numpy
+# node tables saved by train.py, where they exist and are up to date
+PREDICT_BACKEND = os.getenv('PREDICT_BACKEND', 'native')
+
+# Models loaded by this process, path -> (file signature, size, model). Kept
+# at module level so they survive between warm Lambda invocations
+_model_cache = OrderedDict()
+
+# Do not score past orders which already have their actual bag counts
+SKIP_LABELED = os.getenv('PREDICT_SKIP_LABELED', '0') == '1'
+LABELED_PREDICATE = (
+    "delivery_time < (now() AT TIME ZONE 'UTC') AND bags_used IS NOT NULL"
+    " AND cold_bags_used IS NOT NULL AND deep_frozen_bags_used IS NOT NULL"
+)
+
+
+# Table columns the features are built from, plus the keys of the rows
+def select_columns():
+    table_columns = get_column_names()
+    features = [
+        col for col in build_training_features(table_columns) if col in table_columns
     ]
-    return data[data[forecast_columns].isna().any(axis=1)]
+    # Calendar features are computed from delivery_time by extra_features()
+    return ['order_id', 'hub_id', 'delivery_time'] + features
 
 
-def load_model(target_column, hub_id):
-    model_path = os.path.join(
-        EFS_MOUNT_POINT, 'models', f"{target_column}_{hub_id}.joblib"
+# Load only the rows still missing a forecast, and only the columns to score them
+def load_data(stream=STREAM_SELECT, skip_labeled=SKIP_LABELED):
+    where = NULL_FORECAST_PREDICATE
+    if skip_labeled:
+        where += f" AND NOT ({LABELED_PREDICATE})"
+
+    if stream:
+        chunks = iter_select(select_columns(), where)
+    else:
+        chunks = [select_to_df(select_columns(), where)]
+    return pd.concat(
+        [apply_feature_schema(extra_features(chunk)) for chunk in chunks],
+        ignore_index=True,
     )
-    return joblib.load(model_path)
 
 
-def make_predictions(data, hub_id, features):
-    target_columns = ['cold_bags', 'bags', 'deep_frozen_bags']
+def model_path(target_column, hub_id):
+    return os.path.join(EFS_MOUNT_POINT, 'models', f"{target_column}_{hub_id}.joblib")
+
+
+def compiled_model_path(target_column, hub_id):
+    return os.path.join(EFS_MOUNT_POINT, 'models', f"{target_column}_{hub_id}.npz")
+
+
+# File to load a model from: its compiled form if asked for and newer than the
+# model file, the model file otherwise
+def model_file(target_column, hub_id, backend=PREDICT_BACKEND):
+    path = model_path(target_column, hub_id)
+    if backend == 'compiled':
+        compiled_path = compiled_model_path(target_column, hub_id)
+        if (
+            os.path.exists(compiled_path)
+            and os.stat(compiled_path).st_mtime_ns >= os.stat(path).st_mtime_ns
+        ):
+            return compiled_path
+    return path
+
+
+# Rough in-memory size of a fitted model, to bound the model cache
+def model_size(model, file_size):
+    if isinstance(model, CompiledEnsemble):
+        return model.nbytes
+    estimators = getattr(model, 'estimators_', None)
+    if estimators is not None:
+        # sklearn tree nodes are 64 byte structs, plus one value per node
+        return sum(
+            tree.tree_.node_count * 64 + tree.tree_.value.nbytes for tree in estimators
+        )
+    if hasattr(model, 'get_booster'):
+        return len(model.get_booster().save_raw())
+    return file_size
+
+
+def evict_models(max_bytes=MODEL_CACHE_MAX_MB * 1024 * 1024):
+    # Least recently used first, but always keep the model just loaded
+    while len(_model_cache) > 1:
+        if sum(size for _, size, _ in _model_cache.values()) <= max_bytes:
+            break
+        _model_cache.popitem(last=False)
+
+
+def load_model(target_column, hub_id, backend=PREDICT_BACKEND):
+    path = model_file(target_column, hub_id, backend)
+    # A new model file on EFS gets a new mtime, which invalidates the cached one
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _model_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        _model_cache.move_to_end(path)
+        return cached[2]
 
-    for target_column in target_columns:
+    if path.endswith('.npz'):
+        model = CompiledEnsemble.load(path)
+    else:
+        # Unpickling imports sklearn/xgboost, the compiled backend never needs them
+        import joblib
+
+        model = joblib.load(path)
+    _model_cache[path] = (signature, model_size(model, stat.st_size), model)
+    _model_cache.move_to_end(path)
+    evict_models()
+    return model
+
+
+# Models a hub is scored with: one per target, or the multi-output one
+def model_targets():
+    return [MULTI_OUTPUT_TARGET] if MULTI_OUTPUT_MODELS else TARGET_COLUMNS
+
+
+def preload_models(hub_ids=HUB_IDS):
+    for hub_id in hub_ids:
+        for target_column in model_targets():
+            if os.path.exists(model_path(target_column, hub_id)):
+                load_model(target_column, hub_id)
+
+
+# instrument=False skips the stage records, for callers scoring a few orders at
+# a time like the prediction server
+def make_predictions(data, hub_id, features, instrument=True):
+    stage = Stage if instrument else Untimed
+    # Filter the data for the specific hub_id, its features are built only once
+    hub_rows = data.hub_id == hub_id
+    with stage('features', hub=hub_id) as step:
+        X = feature_matrix(data[hub_rows], features)
+        step.rows_out = X.shape[0]
+
+    for target_column in model_targets():
         model = load_model(target_column, hub_id)
-        # target_column_name = f"{target_column}_used"
-        forecast_column_name = f"{target_column}_used_forecast"
-        hub_data = data[data.hub_id == hub_id]
-        # Filter the data for the specific hub_id
-        hub_data = data[data.hub_id == hub_id]
+        if target_column == MULTI_OUTPUT_TARGET:
+            # One column of predictions per target, in TARGET_COLUMNS order
+            forecast_columns = [f"{target}_used_forecast" for target in TARGET_COLUMNS]
+        else:
+            forecast_columns = [f"{target_column}_used_forecast"]
 
         # Safely assign the predicted values back to the original DataFrame using .loc[]
-        data.loc[data.hub_id == hub_id, forecast_column_name] = model.predict(
-            hub_data[features].values
-        )
+        with stage('predict', rows_in=X.shape[0], model=f"{target_column}_{hub_id}"):
+            predictions = model.predict(X).reshape(X.shape[0], -1)
+            data.loc[hub_rows, forecast_columns] = predictions
     return data
 
 
-def update_postgresql(data):
-    conn = db_connect()
-    cur = conn.cursor()
-    columns = get_column_names()
-    for index, row in data.iterrows():
-        update_query = f"""
-            UPDATE {TABLE_NAME}
-            SET bags_used_forecast = %s,
-                cold_bags_used_forecast = %s,
-                deep_frozen_bags_used_forecast = %s
-            WHERE order_id = %s;
-        """
-        cur.execute(
-            update_query,
-            (
-                row['bags_used_forecast'],
-                row['cold_bags_used_forecast'],
-                row['deep_frozen_bags_used_forecast'],
-                row['order_id'],
-            ),
-        )
+def update_postgresql(data, batch_size=WRITEBACK_BATCH_SIZE):
+    columns = ['order_id'] + FORECAST_COLUMNS
+    column_types = get_column_types()
+
+    create_query = f"""
+    CREATE TEMP TABLE {FORECASTS_TABLE_NAME} (
+        {', '.join(f'{col} {column_types[col]}' for col in columns)}
+    ) ON COMMIT DROP;
+    """
+    update_query = f"""
+    UPDATE {TABLE_NAME} AS target
+    SET {', '.join(f'{col} = tmp.{col}' for col in FORECAST_COLUMNS)}
+    FROM {FORECASTS_TABLE_NAME} AS tmp
+    WHERE target.order_id = tmp.order_id
+        AND ({', '.join(f'target.{col}' for col in FORECAST_COLUMNS)})
+            IS DISTINCT FROM ({', '.join(f'tmp.{col}' for col in FORECAST_COLUMNS)});
+    """
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(create_query)
+            # Stream the forecasts into the temporary table, then apply them at once
+            for start in range(0, data.shape[0], batch_size):
+                copy_frame(
+                    cur,
+                    data.iloc[start : start + batch_size],
+                    FORECASTS_TABLE_NAME,
+                    columns,
+                )
+            cur.execute(update_query)
+            updated = cur.rowcount
+        conn.commit()
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Rows are skipped when the stored forecast is already up to date
+    skipped = data.shape[0] - updated
+    print(f"Updated {updated} forecasts, skipped {skipped}")
+    return updated, skipped
 
 
+@profiled('predict')
 def do_predict():
     # Download data from PostgreSQL if necessary
     # download_to_csv()
 
-    # Load data
-    data = load_data()
+    with Stage('predict') as predict_stage:
+        # Load rows with null forecasts
+        with Stage('load') as step:
+            data_with_nulls = load_data()
+            step.rows_out = data_with_nulls.shape[0]
+        predict_stage.rows_in = data_with_nulls.shape[0]
 
-    # Filter rows with null forecasts
-    data_with_nulls = filter_rows_with_null_forecasts(data)
+        print(
+            f"Prepared {data_with_nulls.shape[0]} rows for prediction "
+            f"(peak RSS {peak_rss_mb():.0f} MB)"
+        )
+        # Build features
+        features = build_training_features(data_with_nulls.columns)
 
-    print(f"Prepared {data_with_nulls.shape[0]} rows for prediction")
-    # Build features
-    features = build_training_features(data_with_nulls.columns)
+        # Make predictions
+        hub_ids = data_with_nulls['hub_id'].unique()
+        for hub_id in hub_ids:
+            data_with_nulls = make_predictions(data_with_nulls, hub_id, features)
 
-    # Make predictions
-    hub_ids = data_with_nulls['hub_id'].unique()
-    for hub_id in hub_ids:
-        data_with_nulls = make_predictions(data_with_nulls, hub_id, features)
+        # Update PostgreSQL
+        with Stage('writeback', rows_in=data_with_nulls.shape[0]) as step:
+            updated, skipped = update_postgresql(data_with_nulls)
+            step.rows_out = updated
+        predict_stage.rows_out = updated
+
+    return (
+        "Predictions made and database updated successfully "
+        f"({updated} rows updated, {skipped} skipped)."
+    )
 
-    # Update PostgreSQL
-    update_postgresql(data_with_nulls)
 
-    return "Predictions made and database updated successfully."
+if PRELOAD_MODELS:
+    preload_models()
 
 
 def lambda_handler(event, context):
+    clear_metrics()
     result = do_predict()
-    return {'statusCode': 200, 'body': result}
+    return {
+        'statusCode': 200,
+        'body': {'result': result, 'metrics': collected_metrics()},
+    }
 
 
 if __name__ == '__main__':
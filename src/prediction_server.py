@@ -0,0 +1,286 @@
+# prediction_server.py
+import os
+import json
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import predict
+from column_generator import apply_feature_schema, build_training_features
+from ingest import extra_features
+
+SERVER_HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.getenv('SERVER_PORT', 8080))
+# Orders of the requests arriving within BATCH_MAX_WAIT_MS of the first one
+# waiting are scored together, up to BATCH_MAX_ROWS of them
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', 1024))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 2))
+# Latest requests the latency percentiles and throughput are computed over
+LATENCY_WINDOW = int(os.getenv('LATENCY_WINDOW', 10000))
+
+# The columns of an order predict.load_data() selects, the calendar features are
+# computed from delivery_time
+ORDER_COLUMNS = predict.select_columns()
+FEATURES = build_training_features(ORDER_COLUMNS)
+
+
+# Frame of one order (a JSON object) or a list of them, with the features of
+# predict.load_data(). Categories an order has no goods of may be left out
+def orders_frame(orders, hub_ids):
+    if isinstance(orders, dict):
+        orders = [orders]
+    if not orders or not all(isinstance(order, dict) for order in orders):
+        raise ValueError("Expected an order or a non-empty list of orders")
+
+    data = pd.DataFrame.from_records(orders)
+    missing = [
+        col for col in ORDER_COLUMNS if col not in data and not col.startswith('cat_')
+    ]
+    if missing:
+        raise ValueError(f"Orders without {', '.join(missing)}")
+    data = data.reindex(columns=ORDER_COLUMNS)
+    # As in the training data, transform.remove_outliers() fills them with 0
+    category_columns = [col for col in ORDER_COLUMNS if col.startswith('cat_')]
+    data[category_columns] = data[category_columns].fillna(0.0)
+    data['hub_id'] = data['hub_id'].astype('int64')
+    unknown = sorted(set(data['hub_id']) - set(hub_ids))
+    if unknown:
+        raise ValueError(f"No models for hubs {unknown}")
+    data['delivery_time'] = pd.to_datetime(data['delivery_time'], utc=True)
+    return apply_feature_schema(extra_features(data))
+
+
+# Forecasts of a batch of orders, in the order of its rows. Stage records per
+# batch would flood stdout, like an access log line per request
+def predict_orders(data):
+    for hub_id in data['hub_id'].unique():
+        data = predict.make_predictions(data, hub_id, FEATURES, instrument=False)
+    return data[['order_id'] + predict.FORECAST_COLUMNS]
+
+
+# Hubs with all the models predict.make_predictions() scores them with
+def available_hubs():
+    return [
+        hub_id
+        for hub_id in predict.HUB_IDS
+        if all(
+            os.path.exists(predict.model_path(target_column, hub_id))
+            for target_column in predict.model_targets()
+        )
+    ]
+
+
+# Scores the orders of concurrent requests in one call of predict_batch. A
+# single thread takes the first request waiting, then the ones arriving within
+# max_wait_ms of it, up to max_rows orders, and hands every request its rows
+class MicroBatcher:
+    def __init__(
+        self, predict_batch, max_rows=BATCH_MAX_ROWS, max_wait_ms=BATCH_MAX_WAIT_MS
+    ):
+        self.predict_batch = predict_batch
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batch_rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    # Queue a frame of orders, the future resolves to the rows of the result
+    # of the batch for them
+    def submit(self, data):
+        future = Future()
+        self._queue.put((data, future))
+        return future
+
+    def next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_rows:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop once this batch is done
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            try:
+                result = self.predict_batch(
+                    pd.concat([data for data, _ in batch], ignore_index=True)
+                )
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            self.batches += 1
+            self.batch_rows += len(result)
+            start = 0
+            for data, future in batch:
+                future.set_result(result.iloc[start : start + len(data)])
+                start += len(data)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+# Latency and throughput of the latest `window` requests
+class LatencyStats:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.started_at = time.perf_counter()
+        self.requests = 0
+        self.orders = 0
+        self.errors = 0
+        # (finished at, seconds, orders) of the latest requests
+        self._latest = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, orders, error=False):
+        with self._lock:
+            self.requests += 1
+            self.orders += orders
+            self.errors += error
+            self._latest.append((time.perf_counter(), seconds, orders))
+
+    def snapshot(self):
+        with self._lock:
+            latest = list(self._latest)
+            totals = {
+                'requests': self.requests,
+                'orders': self.orders,
+                'errors': self.errors,
+                'uptime_seconds': time.perf_counter() - self.started_at,
+            }
+        if not latest:
+            return {**totals, 'p50_ms': None, 'p99_ms': None}
+
+        finished_at, seconds, orders = (np.array(values) for values in zip(*latest))
+        # From the start of the first of the latest requests to the last one done
+        span = max(finished_at[-1] - (finished_at[0] - seconds[0]), 1e-9)
+        return {
+            **totals,
+            'p50_ms': float(np.percentile(seconds, 50) * 1000),
+            'p99_ms': float(np.percentile(seconds, 99) * 1000),
+            'requests_per_second': len(latest) / span,
+            'orders_per_second': float(orders.sum()) / span,
+        }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, every response has a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.reply(200, self.server.metrics())
+        elif self.path == '/health':
+            self.reply(200, {'status': 'ok', 'hub_ids': self.server.hub_ids})
+        else:
+            self.reply(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.reply(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        # Requests are recorded before the reply, so /metrics counts every
+        # request a client got the response of
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            orders = json.loads(self.rfile.read(length))
+            data = orders_frame(orders, self.server.hub_ids)
+        except (ValueError, TypeError, KeyError) as error:
+            self.server.stats.record(time.perf_counter() - start, 0, error=True)
+            self.reply(400, {'error': str(error)})
+            return
+
+        try:
+            forecasts = self.server.batcher.submit(data).result().to_dict('records')
+        except Exception as error:
+            self.server.stats.record(time.perf_counter() - start, 0, error=True)
+            self.reply(500, {'error': f"{type(error).__name__}: {error}"})
+            return
+        self.server.stats.record(time.perf_counter() - start, len(forecasts))
+        self.reply(200, forecasts[0] if isinstance(orders, dict) else forecasts)
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # One access log line per request would cost more than scoring it
+    def log_message(self, format, *args):
+        pass
+
+
+# HTTP server scoring orders with the models kept in predict's model cache:
+#   POST /predict  an order, or a list of orders, as JSON objects with the
+#                  columns of the table; returns their forecasts
+#   GET /metrics   latency percentiles, throughput and batch sizes
+#   GET /health    the hubs it has models for
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=(SERVER_HOST, SERVER_PORT), hub_ids=None):
+        super().__init__(address, PredictionHandler)
+        self.hub_ids = available_hubs() if hub_ids is None else list(hub_ids)
+        self.batcher = MicroBatcher(predict_orders)
+        self.stats = LatencyStats()
+
+    def metrics(self):
+        batches = self.batcher.batches
+        return {
+            **self.stats.snapshot(),
+            'batches': batches,
+            'mean_batch_orders': self.batcher.batch_rows / batches if batches else None,
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+def serve(address=(SERVER_HOST, SERVER_PORT)):
+    # Load every model once, they stay in predict's cache for all requests
+    predict.preload_models()
+    server = PredictionServer(address)
+    if not server.hub_ids:
+        raise FileNotFoundError(
+            f"No models in {os.path.join(predict.EFS_MOUNT_POINT, 'models')}"
+        )
+    host, port = server.server_address[:2]
+    print(f"Serving forecasts for hubs {server.hub_ids} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
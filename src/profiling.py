@@ -0,0 +1,201 @@
+# profiling.py
+import os
+import sys
+import json
+import time
+import threading
+from functools import wraps
+from collections import Counter
+
+# Determine if running in AWS Lambda or locally
+IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
+
+# EFS mount point for Lambda
+current_script_dir = os.path.dirname(__file__)
+EFS_MOUNT_POINT = (
+    '/mnt/efs' if IS_LAMBDA else os.path.join(current_script_dir, '../data')
+)
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(EFS_MOUNT_POINT, 'profiles'))
+
+# Stages to profile, e.g. PROFILE_STAGE=predict or PROFILE_STAGE=train,predict.
+# Stages not listed run their undecorated function, without any overhead
+PROFILE_STAGES = [stage for stage in os.getenv('PROFILE_STAGE', '').split(',') if stage]
+# 'sampling' samples the stack every PROFILE_INTERVAL_MS and writes a speedscope
+# and a folded-stacks (flamegraph.pl) file, 'deterministic' runs cProfile and
+# writes a .pstats file. Both write the PROFILE_TOP hottest functions as text
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampling')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 30))
+
+
+# Samples the Python stack of one thread from a background thread. Each sample
+# is weighted by the wall time since the previous one, so time spent in native
+# code (xgboost, numpy, psycopg2) is attributed to the Python line calling it,
+# even when that code holds the GIL and delays the sampler
+class StackSampler:
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        # stack (root first, tuple of frame keys) -> seconds
+        self.stacks = Counter()
+        self._frame_keys = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self.started_at
+
+    def frame_key(self, code):
+        key = self._frame_keys.get(code)
+        if key is None:
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            self._frame_keys[code] = key
+        return key
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_key(frame.f_code))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += now - last
+            last = now
+
+
+def frame_name(key):
+    name, filename, line = key
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+# https://www.speedscope.app/file-format-schema.json, a "sampled" profile
+def speedscope_profile(stacks, name):
+    frames = {}
+    samples = []
+    weights = []
+    for stack, seconds in stacks.items():
+        samples.append([frames.setdefault(key, len(frames)) for key in stack])
+        weights.append(seconds)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'profiling.py',
+        'shared': {
+            'frames': [
+                {'name': key[0], 'file': key[1], 'line': key[2]} for key in frames
+            ]
+        },
+        'profiles': [
+            {
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }
+        ],
+    }
+
+
+# One "root;...;leaf milliseconds" line per stack, for flamegraph.pl
+def folded_stacks(stacks):
+    return ''.join(
+        f"{';'.join(frame_name(key) for key in stack)} {round(seconds * 1000)}\n"
+        for stack, seconds in stacks.items()
+    )
+
+
+# Hottest functions by self time (at the top of the stack) and total time (on
+# the stack, counted once per sample even when recursive)
+def hot_functions(stacks, top=PROFILE_TOP):
+    self_time = Counter()
+    total_time = Counter()
+    for stack, seconds in stacks.items():
+        self_time[stack[-1]] += seconds
+        for key in set(stack):
+            total_time[key] += seconds
+    total = sum(stacks.values()) or 1.0
+
+    lines = [f"{'self s':>9} {'self %':>7} {'total s':>9} {'total %':>7}  function"]
+    for key, seconds in self_time.most_common(top):
+        lines.append(
+            f"{seconds:9.3f} {100 * seconds / total:6.1f}% "
+            f"{total_time[key]:9.3f} {100 * total_time[key] / total:6.1f}%  "
+            f"{frame_name(key)}"
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def output_prefix(stage):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{stage}_{timestamp}")
+
+
+def write_sampling_profile(sampler, stage):
+    prefix = output_prefix(stage)
+    with open(f"{prefix}.speedscope.json", 'w') as fp:
+        json.dump(speedscope_profile(sampler.stacks, stage), fp)
+    with open(f"{prefix}.folded", 'w') as fp:
+        fp.write(folded_stacks(sampler.stacks))
+    with open(f"{prefix}.top.txt", 'w') as fp:
+        fp.write(hot_functions(sampler.stacks))
+    return prefix
+
+
+def write_deterministic_profile(profile, stage):
+    import pstats
+
+    prefix = output_prefix(stage)
+    profile.dump_stats(f"{prefix}.pstats")
+    with open(f"{prefix}.top.txt", 'w') as fp:
+        stats = pstats.Stats(profile, stream=fp)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    return prefix
+
+
+# Decorator profiling a stage entry point when the stage is in PROFILE_STAGE.
+# Checked once at import; otherwise the function is returned as it is
+def profiled(stage):
+    def decorator(function):
+        if stage not in PROFILE_STAGES:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if PROFILE_MODE == 'deterministic':
+                import cProfile
+
+                profile = cProfile.Profile()
+                try:
+                    return profile.runcall(function, *args, **kwargs)
+                finally:
+                    prefix = write_deterministic_profile(profile, stage)
+                    print(f"Profile of {stage} saved to {prefix}.*")
+
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                sampler.stop()
+                prefix = write_sampling_profile(sampler, stage)
+                print(
+                    f"Profile of {stage} ({sampler.seconds:.1f}s) saved to {prefix}.*"
+                )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,125 @@
+# snapshot.py
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+# pyarrow made get_partition_keys public in 13.0, the locked 10.0 only has the
+# underscored name
+get_partition_keys = getattr(ds, 'get_partition_keys', None) or ds._get_partition_keys
+
+# Snapshots are Parquet datasets partitioned by hub and delivery month (YYYYMM),
+# so readers can skip whole hubs and months and load only the columns they need
+PARTITIONING = ds.partitioning(
+    pa.schema([('hub_id', pa.int64()), ('delivery_month', pa.int32())]),
+    flavor='hive',
+)
+
+
+def month_key(timestamp):
+    return timestamp.year * 100 + timestamp.month
+
+
+def to_utc(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize('UTC')
+    return timestamp.tz_convert('UTC')
+
+
+# Rows are stored ordered by order_id and without pandas metadata, so the same
+# data always gives the same files, whichever order and dtypes it came in
+def to_table(data):
+    delivery_month = month_key(data['delivery_time'].dt).astype('int32')
+    data = data.assign(delivery_month=delivery_month)
+    table = pa.Table.from_pandas(data.sort_values('order_id'), preserve_index=False)
+    return table.replace_schema_metadata(None)
+
+
+# The frame read_snapshot() returns for data stored with write_snapshot(),
+# without the round trip through the files
+def as_snapshot(data):
+    table = to_table(data)
+    columns = [
+        col for col in table.column_names if col not in PARTITIONING.schema.names
+    ]
+    return table.select(columns + ['hub_id']).to_pandas()
+
+
+def write_snapshot(data, path):
+    table = to_table(data)
+
+    # Write next to the old snapshot and swap, so readers never see a partial one
+    tmp_path = path + '.tmp'
+    old_path = path + '.old'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    # Threads may write the rows of a partition out of order. preserve_order
+    # needs pyarrow 21, mlflow 2.1.1 pins pyarrow below 11
+    ds.write_dataset(
+        table,
+        tmp_path,
+        format='parquet',
+        partitioning=PARTITIONING,
+        use_threads=False,
+    )
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def snapshot_columns(path):
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+    return [col for col in dataset.schema.names if col != 'delivery_month']
+
+
+# Load a snapshot, reading only the given columns of the given hubs and the
+# delivery time range [start, end); partitions outside of it are not opened
+def read_snapshot(path, columns=None, hub_ids=None, start=None, end=None):
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+    conditions = []
+    if hub_ids is not None:
+        conditions.append(ds.field('hub_id').isin([int(hub) for hub in hub_ids]))
+    if start is not None:
+        start = to_utc(start)
+        conditions.append(ds.field('delivery_month') >= month_key(start))
+        conditions.append(ds.field('delivery_time') >= start)
+    if end is not None:
+        end = to_utc(end)
+        conditions.append(ds.field('delivery_month') <= month_key(end))
+        conditions.append(ds.field('delivery_time') < end)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    if columns is None:
+        read_columns = snapshot_columns(path)
+    else:
+        # order_id is always read to return the rows in a stable order
+        read_columns = list(dict.fromkeys(['order_id'] + list(columns)))
+
+    data = dataset.to_table(columns=read_columns, filter=expression).to_pandas()
+    data = data.sort_values('order_id', ignore_index=True)
+    return data if columns is None else data[list(columns)]
+
+
+# Latest delivery time in a snapshot, reading only the partitions of its latest
+# delivery month. None for an empty snapshot
+def latest_delivery_time(path):
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+    months = [
+        get_partition_keys(fragment.partition_expression)['delivery_month']
+        for fragment in dataset.get_fragments()
+    ]
+    if not months:
+        return None
+    table = dataset.to_table(
+        columns=['delivery_time'], filter=ds.field('delivery_month') == max(months)
+    )
+    latest = pc.max(table['delivery_time']).as_py()
+    return None if latest is None else to_utc(latest)
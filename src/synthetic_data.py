@@ -0,0 +1,160 @@
+# synthetic_data.py
+import numpy as np
+import pandas as pd
+from column_generator import get_column_names
+
+# Orders generated at a time; a table of any size is generated chunk by chunk,
+# every chunk from its own seed spawned from the seed of the table
+CHUNK_ROWS = 100000
+FIRST_ORDER_ID = 100000001
+START_DATE = '2022-01-01'
+DAYS = 365
+
+CATEGORIES = 10
+TEMPERATURES = ['normal', 'cold', 'frozen']
+# Volume units one bag of each temperature holds
+BAG_VU = {'normal': 20.0, 'cold': 12.0, 'frozen': 8.0}
+
+# Share of the orders, mean number of positions and how likely an order of the
+# hub is to contain cold and frozen goods
+HUB_PROFILES = {
+    1: {'share': 0.65, 'positions': 14.0, 'cold': 0.55, 'frozen': 0.25},
+    4: {'share': 0.35, 'positions': 9.0, 'cold': 0.35, 'frozen': 0.12},
+}
+# Orders per delivery hour (7 to 21), peaking in the morning and the evening
+DELIVERY_HOURS = np.arange(7, 22)
+HOUR_WEIGHTS = np.array([3, 5, 6, 5, 4, 3, 3, 3, 4, 5, 7, 8, 7, 4, 2], dtype=float)
+# Orders per day of the week, Monday first
+WEEKDAY_WEIGHTS = np.array([1.1, 1.0, 1.0, 1.05, 1.2, 1.15, 0.5])
+# Share of the latest orders without actual bag counts and forecasts yet, the
+# rows predict.py fills
+OPEN_ORDER_SHARE = 0.01
+
+
+# Cumulative share of the orders delivered up to each day: more orders in winter
+# and on Fridays and Saturdays, fewer on Sundays
+def day_cdf(days=DAYS, start=START_DATE):
+    dates = pd.date_range(start, periods=days, freq='D')
+    season = 1 + 0.25 * np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 15) / 365)
+    weights = season * WEEKDAY_WEIGHTS[dates.dayofweek.to_numpy()]
+    return np.cumsum(weights) / weights.sum(), season
+
+
+# Delivery times of orders [offset, offset + n) out of `rows`: in order_id
+# order, with the number of orders per day following day_cdf()
+def delivery_times(rng, offset, n, rows, days=DAYS, start=START_DATE):
+    cdf, season = day_cdf(days, start)
+    position = (offset + np.arange(n) + 0.5) / rows
+    day = np.minimum(np.searchsorted(cdf, position), days - 1)
+    hour = rng.choice(DELIVERY_HOURS, n, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    minute = rng.integers(0, 60, n)
+    delivery_time = (
+        pd.Timestamp(start)
+        + pd.to_timedelta(day, unit='D')
+        + pd.to_timedelta(hour * 60 + minute, unit='m')
+    )
+    return pd.Series(delivery_time), season[day]
+
+
+# Profile value of the hub of every order
+def hub_values(hub_id, key):
+    values = {hub: profile[key] for hub, profile in HUB_PROFILES.items()}
+    return pd.Series(hub_id).map(values).to_numpy()
+
+
+# Volume and weight per category and temperature. Most orders contain only a
+# few categories, and cold and frozen goods only in some of them, so the cat_
+# columns are mostly zeros
+def category_columns(rng, hub_id, positions):
+    n = len(positions)
+    # Popular categories first, each is in more orders of larger baskets
+    popularity = 0.6 / np.arange(1, CATEGORIES + 1) ** 0.7
+    columns = {}
+    for i in range(CATEGORIES):
+        in_order = rng.random(n) < 1 - (1 - popularity[i]) ** (positions / 6)
+        for temperature in TEMPERATURES:
+            present = in_order
+            if temperature != 'normal':
+                present = in_order & (rng.random(n) < hub_values(hub_id, temperature))
+            vu = np.where(present, rng.gamma(2.0, 2.0 + i / 2, n), 0.0)
+            # Grams per volume unit differ per category, frozen goods are dense
+            density = 150 + 40 * i + (120 if temperature == 'frozen' else 0)
+            weight = vu * density * rng.lognormal(0, 0.2, n)
+            columns[f'cat_{i + 1:02}_{temperature}_vu'] = np.round(vu, 3)
+            columns[f'cat_{i + 1:02}_{temperature}_weight'] = np.round(weight, 1)
+    return columns
+
+
+def bags_used(rng, vu, temperature):
+    bags = np.ceil(vu / BAG_VU[temperature] + rng.normal(0, 0.3, len(vu)))
+    return np.clip(bags, 0, None)
+
+
+def generate_chunk(rng, offset, n, rows, hub_ids):
+    shares = np.array([HUB_PROFILES[hub_id]['share'] for hub_id in hub_ids])
+    hub_id = rng.choice(hub_ids, n, p=shares / shares.sum())
+    delivery_time, season = delivery_times(rng, offset, n, rows)
+
+    # Larger baskets in the busy season
+    positions = 1 + rng.poisson(hub_values(hub_id, 'positions') * season)
+    data = {
+        'order_id': FIRST_ORDER_ID + offset + np.arange(n),
+        **category_columns(rng, hub_id, positions),
+    }
+    data['lint_item_count'] = positions + rng.poisson(positions * 0.3)
+    data['total_quantity'] = data['lint_item_count'] + rng.poisson(positions * 0.8)
+    data['positions'] = positions
+    weight_columns = [col for col in data if col.endswith('_weight')]
+    total_weight = sum(data[col] for col in weight_columns)
+    data['total_weight'] = np.round(total_weight + rng.normal(0, 50, n).clip(0), 1)
+    data['hub_id'] = hub_id
+    data['delivery_time'] = delivery_time
+
+    targets = {
+        'bags': 'normal',
+        'cold_bags': 'cold',
+        'deep_frozen_bags': 'frozen',
+    }
+    for target, temperature in targets.items():
+        vu = sum(data[f'cat_{i:02}_{temperature}_vu'] for i in range(1, CATEGORIES + 1))
+        used = bags_used(rng, vu, temperature)
+        data[f'{target}_used'] = used
+        # The forecast already in the table: right on average, but noisy
+        forecast = used + rng.normal(0, 0.8, n)
+        data[f'{target}_used_forecast'] = np.round(forecast.clip(0), 2)
+
+    data = pd.DataFrame(data)
+    # The latest orders are not delivered yet: no actuals, no forecasts
+    open_orders = offset + np.arange(n) >= rows * (1 - OPEN_ORDER_SHARE)
+    used_columns = [col for col in data.columns if '_used' in col]
+    data.loc[open_orders, used_columns] = np.nan
+    return data[get_column_names()]
+
+
+# Generator of DataFrame chunks of `rows` synthetic orders with the columns of
+# the table (column_generator.generate_columns), reproducible for a seed
+def iter_orders(rows, seed=42, chunk_rows=CHUNK_ROWS, hub_ids=None):
+    hub_ids = list(HUB_PROFILES) if hub_ids is None else hub_ids
+    chunks = range(0, rows, chunk_rows)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    for offset, chunk_seed in zip(chunks, seeds):
+        rng = np.random.default_rng(chunk_seed)
+        n = min(chunk_rows, rows - offset)
+        yield generate_chunk(rng, offset, n, rows, hub_ids)
+
+
+def generate_orders(rows, seed=42, chunk_rows=CHUNK_ROWS, hub_ids=None):
+    return pd.concat(iter_orders(rows, seed, chunk_rows, hub_ids), ignore_index=True)
+
+
+# Write synthetic orders as a CSV like data/bags_forecast_with_id.csv, one chunk
+# at a time so that 10M rows never have to be held in memory
+def write_orders_csv(csv_file_path, rows, seed=42, chunk_rows=CHUNK_ROWS):
+    for index, chunk in enumerate(iter_orders(rows, seed, chunk_rows)):
+        chunk.to_csv(
+            csv_file_path,
+            mode='w' if index == 0 else 'a',
+            header=index == 0,
+            index=False,
+        )
+    return csv_file_path
@@ -1,23 +1,19 @@
 import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import joblib
-
-import warnings
-
-warnings.filterwarnings(
-    "ignore", category=DeprecationWarning, module="mlflow.utils.requirements_utils"
-)
-
-
-import mlflow
 import pandas as pd
-import xgboost as xgb
-from joblib import dump
-from sklearn.metrics import mean_squared_error
-from column_generator import build_training_features
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
+from column_generator import build_training_features, feature_matrix
+from compiled_model import PARITY_TOLERANCE, compile_model, parity_error
+from instrumentation import Stage, clear_metrics, collected_metrics
+from profiling import profiled
+from snapshot import read_snapshot, snapshot_columns
+
+# sklearn and xgboost take seconds to import, they are imported by the functions
+# fitting and scoring models so that importing this module stays cheap
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -31,95 +27,236 @@ DEVICE = "cpu"
 # mlflow.set_tracking_uri("sqlite:///" + os.path.join(EFS_MOUNT_POINT, 'mlflow.db'))
 # mlflow.set_tracking_uri("sqlite:///" + os.path.join(EFS_MOUNT_POINT, 'mlflow.db')
 
-input_file_path = os.path.join(EFS_MOUNT_POINT, 'data', 'current_state.pkl')
-
-
-def train_model(df_filtered, target_column, hub_id, features):
-
-    target_column_name = target_column + '_used'
-    forecast_column_name = target_column_name + '_forecast'
-
-    columns = features + [target_column_name] + [forecast_column_name]
+input_file_path = os.path.join(EFS_MOUNT_POINT, 'data', 'current_state.parquet')
+
+TARGET_COLUMNS = ['cold_bags', 'bags', 'deep_frozen_bags']
+HUB_IDS = [1, 4]
+
+# Train a single model per hub predicting all TARGET_COLUMNS at once, saved as
+# all_bags_<hub>, instead of one model per target. The multi-output model is a
+# RandomForest or an XGBoost with multi_output_tree (MULTI_OUTPUT_REGRESSOR)
+MULTI_OUTPUT_MODELS = os.getenv('MULTI_OUTPUT_MODELS', '0') == '1'
+MULTI_OUTPUT_TARGET = 'all_bags'
+MULTI_OUTPUT_REGRESSOR = os.getenv('MULTI_OUTPUT_REGRESSOR', 'random_forest')
+
+# 'full' refits every model on the whole history, 'incremental' continues the
+# saved models on the orders labeled since they were trained (more boosting
+# rounds for XGBoost, more trees for the RandomForest), falling back to a full
+# refit for models older than TRAIN_FULL_REFIT_DAYS
+TRAIN_MODE = os.getenv('TRAIN_MODE', 'full')
+TRAIN_FULL_REFIT_DAYS = int(os.getenv('TRAIN_FULL_REFIT_DAYS', 28))
+TRAIN_INCREMENTAL_ROUNDS = int(os.getenv('TRAIN_INCREMENTAL_ROUNDS', 100))
+TRAIN_INCREMENTAL_TREES = int(os.getenv('TRAIN_INCREMENTAL_TREES', 100))
+# Fewer orders labeled since a model was trained are held back until the next
+# run, too few to split into train and test slices and score
+TRAIN_INCREMENTAL_MIN_ROWS = int(os.getenv('TRAIN_INCREMENTAL_MIN_ROWS', 100))
+
+# Also save the models compiled to numpy node tables, for PREDICT_BACKEND=compiled
+TRAIN_COMPILE_MODELS = os.getenv('TRAIN_COMPILE_MODELS', '1') == '1'
+# Rows the compiled models are checked against the original ones on
+PARITY_ROWS = 1000
+
+# Cores shared by the training jobs, and the number of jobs run in parallel.
+# Lambda has no /dev/shm for process pools, so jobs run one after another there
+TRAIN_CORES = int(os.getenv('TRAIN_CORES', os.cpu_count() or 1))
+TRAIN_WORKERS = int(os.getenv('TRAIN_WORKERS', 1 if IS_LAMBDA else TRAIN_CORES))
+
+MODEL_PARAMS = {
+    'deep_frozen_bags': {
+        'bootstrap': False,
+        'ccp_alpha': 0.0,
+        'criterion': 'squared_error',
+        'max_depth': 30,
+        'max_features': 'sqrt',
+        'max_leaf_nodes': None,
+        'max_samples': None,
+        'min_impurity_decrease': 0.0,
+        'min_samples_leaf': 2,
+        'min_samples_split': 10,
+        'min_weight_fraction_leaf': 0.0,
+        'n_estimators': 800,
+        'oob_score': False,
+        'random_state': 42,
+        'verbose': 0,
+        'warm_start': False,
+    },
+    'bags': {
+        'colsample_bytree': 0.8049310664813739,
+        'gamma': 0.31904734990860323,
+        'learning_rate': 0.020987723995735754,
+        'max_depth': 8,
+        'n_estimators': 1400,
+        'objective': 'reg:squarederror',
+        'random_state': 42,
+        'subsample': 0.6878477231583816,
+        'verbosity': 1,
+    },
+    'cold_bags': {
+        'colsample_bytree': 0.9332506592696221,
+        'gamma': 0.33126595740822656,
+        'learning_rate': 0.011121117890656158,
+        'max_depth': 8,
+        'n_estimators': 700,
+        'objective': 'reg:squarederror',
+        'random_state': 42,
+        'subsample': 0.5581688088227714,
+        'verbosity': 1,
+    },
+}
+
+
+# Models trained per hub: one per target, or the multi-output one
+def model_targets():
+    return [MULTI_OUTPUT_TARGET] if MULTI_OUTPUT_MODELS else TARGET_COLUMNS
+
+
+# Targets a model predicts, in the order of its outputs
+def model_target_columns(target_column):
+    if target_column == MULTI_OUTPUT_TARGET:
+        return TARGET_COLUMNS
+    return [target_column]
+
+
+def is_random_forest(target_column):
+    if target_column == MULTI_OUTPUT_TARGET:
+        return MULTI_OUTPUT_REGRESSOR == 'random_forest'
+    return target_column == "deep_frozen_bags"
+
+
+def model_params(target_column):
+    if target_column != MULTI_OUTPUT_TARGET:
+        return MODEL_PARAMS[target_column]
+    # The multi-output models use the parameters tuned for the per-target ones
+    if is_random_forest(target_column):
+        return MODEL_PARAMS['deep_frozen_bags']
+    return {**MODEL_PARAMS['bags'], 'multi_strategy': 'multi_output_tree'}
+
+
+def build_model(target_column, n_jobs=None):
+    params = dict(model_params(target_column))
+    if n_jobs is not None:
+        params['n_jobs'] = n_jobs
+
+    if is_random_forest(target_column):
+        from sklearn.ensemble import RandomForestRegressor
+
+        return RandomForestRegressor(**params)
+
+    import xgboost as xgb
+
+    # model = mlflow.pyfunc.load_model('/home/sir/farmy/ch.farmy.scinode/development/9631-update/mlruns/8/dfeb8badb69c493d91fab39c78c9999e/artifacts/model')
+    return xgb.XGBRegressor(**params, device=DEVICE)
+
+
+# Import the libraries fitting and scoring a model, so that the seconds they take
+# to import are not counted as training time
+def import_model_libraries(target_column):
+    import sklearn.metrics
+    import sklearn.model_selection
+
+    if is_random_forest(target_column):
+        import sklearn.ensemble
+    else:
+        import xgboost
+
+
+# Prepare a trained model to be fitted on new data on top of what it learned,
+# returns the model and the arguments for its fit()
+def continue_model(model, target_column, n_jobs=None):
+    if n_jobs is not None:
+        model.set_params(n_jobs=n_jobs)
+
+    if is_random_forest(target_column):
+        # warm_start keeps the fitted trees and fits only the added ones
+        model.set_params(
+            warm_start=True,
+            n_estimators=model.n_estimators + TRAIN_INCREMENTAL_TREES,
+        )
+        return model, {}
+
+    model.set_params(n_estimators=TRAIN_INCREMENTAL_ROUNDS)
+    return model, {'xgb_model': model.get_booster()}
+
+
+# Relative cost of training a model: trees x depth x rows
+def job_cost(target_column, rows, mode='full'):
+    params = model_params(target_column)
+    estimators = params['n_estimators']
+    if mode == 'incremental':
+        if is_random_forest(target_column):
+            estimators = TRAIN_INCREMENTAL_TREES
+        else:
+            estimators = TRAIN_INCREMENTAL_ROUNDS
+    return estimators * params['max_depth'] * rows
+
+
+# Split the cores between the jobs running at the same time proportionally to
+# their cost, so that they finish at about the same time without oversubscribing
+def allocate_threads(costs, cores):
+    if len(costs) >= cores:
+        return [1] * len(costs)
+
+    total_cost = sum(costs) or 1
+    threads = [max(1, int(cores * cost / total_cost)) for cost in costs]
+    # Hand out the cores left after rounding down to the most expensive jobs
+    for index in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        if sum(threads) >= cores:
+            break
+        threads[index] += 1
+    return threads
+
+
+# Rows of a hub a model is trained and tested on, and their split
+def model_data(df_filtered, target_column, hub_id, features):
+    target_columns = model_target_columns(target_column)
+    target = [f"{target}_used" for target in target_columns]
+    forecast = [f"{target}_used_forecast" for target in target_columns]
+
+    columns = features + target + forecast
     data = df_filtered[df_filtered.hub_id == hub_id][columns]
     data.dropna(inplace=True)
-    target = [target_column_name]
 
     # train = data.sample(frac=0.95)
     # test = data.loc[~data.index.isin(train.index)]
 
+    from sklearn.model_selection import train_test_split
+
     train, test = train_test_split(data, test_size=0.3, random_state=42)
+    return data, train, test
 
-    if target_column == "deep_frozen_bags":
-        params = {
-            'bootstrap': False,
-            'ccp_alpha': 0.0,
-            'criterion': 'squared_error',
-            'max_depth': 30,
-            'max_features': 'sqrt',
-            'max_leaf_nodes': None,
-            'max_samples': None,
-            'min_impurity_decrease': 0.0,
-            'min_samples_leaf': 2,
-            'min_samples_split': 10,
-            'min_weight_fraction_leaf': 0.0,
-            'n_estimators': 800,
-            'n_jobs': 6,
-            'oob_score': False,
-            'random_state': 42,
-            'verbose': 0,
-            'warm_start': False,
-        }
 
-        model = RandomForestRegressor(**params)
-
-    elif target_column == "bags":
-        params = {
-            'colsample_bytree': 0.8049310664813739,
-            'gamma': 0.31904734990860323,
-            'learning_rate': 0.020987723995735754,
-            'max_depth': 8,
-            'n_estimators': 1400,
-            'objective': 'reg:squarederror',
-            'random_state': 42,
-            'subsample': 0.6878477231583816,
-            'verbosity': 1,
-        }
+# Mean squared error of the rounded predictions for the test slice, per target
+def score_model(model, df_filtered, target_column, hub_id, features):
+    from sklearn.metrics import mean_squared_error
+
+    _, _, test = model_data(df_filtered, target_column, hub_id, features)
+    y_test = model.predict(feature_matrix(test, features)).reshape(len(test), -1)
+    return {
+        target: mean_squared_error(test[f"{target}_used"], np.around(y_test[:, i]))
+        for i, target in enumerate(model_target_columns(target_column))
+    }
 
-        model = xgb.XGBRegressor(
-            **params,
-            device=DEVICE,
-        )
-        # model = mlflow.pyfunc.load_model('/home/sir/farmy/ch.farmy.scinode/development/9631-update/mlruns/8/dfeb8badb69c493d91fab39c78c9999e/artifacts/model')
-    else:  # cold_bags
-        params = {
-            'colsample_bytree': 0.9332506592696221,
-            'gamma': 0.33126595740822656,
-            'learning_rate': 0.011121117890656158,
-            'max_depth': 8,
-            'n_estimators': 700,
-            'objective': 'reg:squarederror',
-            'random_state': 42,
-            'subsample': 0.5581688088227714,
-            'verbosity': 1,
-        }
-        model = xgb.XGBRegressor(**params, device=DEVICE)
 
-    model.fit(train[features].values, train[target].values.ravel())
+def print_scores(target_column, data, train, test, y_train, y_test):
+    from sklearn.metrics import mean_squared_error
+
+    target = [target_column + '_used']
+    forecast_column_name = target_column + '_used_forecast'
 
     print("Mean Squared Error between {} and:".format(target_column))
     y_forecast = data[forecast_column_name].values.flatten()
     mse_forecast = mean_squared_error(data[target].values.flatten(), y_forecast)
     print("forecast from DB:           {:.5f} (should be worst)".format(mse_forecast))
 
-    y_test = model.predict(test[features].values).flatten()
     mse_test = mean_squared_error(test[target].values.flatten(), np.around(y_test))
-    print(
-        "prediction for test slice:  {:.5f} ({:.2f}% improvement)".format(
-            mse_test, (mse_forecast - mse_test) / mse_test * 100
+    if mse_test > 0:
+        improvement = "{:.2f}% improvement".format(
+            (mse_forecast - mse_test) / mse_test * 100
         )
-    )
+    else:
+        improvement = "no errors"
+    print("prediction for test slice:  {:.5f} ({})".format(mse_test, improvement))
 
-    y_train = model.predict(train[features].values).flatten()
     mse_train = mean_squared_error(train[target].values.flatten(), np.around(y_train))
     print(
         "prediction for train slice: {:.5f} (should be smallest but not differ a lot from test MSE)".format(
@@ -127,6 +264,34 @@ def train_model(df_filtered, target_column, hub_id, features):
         )
     )
 
+
+def train_model(
+    df_filtered, target_column, hub_id, features, n_jobs=None, base_model=None
+):
+    data, train, test = model_data(df_filtered, target_column, hub_id, features)
+    target_columns = model_target_columns(target_column)
+    target = [f"{target}_used" for target in target_columns]
+
+    if base_model is None:
+        model, fit_params = build_model(target_column, n_jobs), {}
+    else:
+        model, fit_params = continue_model(base_model, target_column, n_jobs)
+
+    y = train[target].values
+    with Stage('fit', rows_in=train.shape[0]):
+        model.fit(
+            feature_matrix(train, features),
+            y.ravel() if len(target) == 1 else y,
+            **fit_params,
+        )
+
+    # Scores per target, the columns of a multi-output model's predictions
+    with Stage('score', rows_in=data.shape[0]):
+        y_test = model.predict(feature_matrix(test, features)).reshape(len(test), -1)
+        y_train = model.predict(feature_matrix(train, features)).reshape(len(train), -1)
+        for i, target_name in enumerate(target_columns):
+            print_scores(target_name, data, train, test, y_train[:, i], y_test[:, i])
+
     # dump(model, 'new/{}_model_v3_hub_{}.joblib'.format(target_column, hub_id), compress=True)
     return model
 
@@ -136,37 +301,263 @@ def dump_pickle(obj, filename: str):
         return pickle.dump(obj, f_out)
 
 
-def do_train():
-    # Load data from CSV
-    data = pd.read_pickle(input_file_path)
+# Load only the columns and hubs the models are trained on, delivered from start
+def load_training_data(start=None):
+    features = build_training_features(snapshot_columns(input_file_path))
+    used_columns = [f"{target}_used" for target in TARGET_COLUMNS] + [
+        f"{target}_used_forecast" for target in TARGET_COLUMNS
+    ]
+    return read_snapshot(
+        input_file_path,
+        columns=['hub_id', 'delivery_time'] + features + used_columns,
+        hub_ids=HUB_IDS,
+        start=start,
+    )
+
+
+def model_file_path(target_column, hub_id):
+    return os.path.join(EFS_MOUNT_POINT, 'models', f"{target_column}_{hub_id}.joblib")
+
+
+def compiled_model_path(target_column, hub_id):
+    return os.path.join(EFS_MOUNT_POINT, 'models', f"{target_column}_{hub_id}.npz")
+
+
+# Save the compiled form of a model, unless it predicts differently than the
+# model itself
+def save_compiled_model(model, target_column, hub_id, X):
+    output_file_path = compiled_model_path(target_column, hub_id)
+    try:
+        compiled = compile_model(model)
+        error = parity_error(model, compiled, X)
+    except ValueError as e:
+        compiled, error = None, e
+    if compiled is None or error > PARITY_TOLERANCE:
+        # predict must not pick up a compiled form of the previous model
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        if compiled is None:
+            return f"not compiled: {error}"
+        return f"compiled model rejected, max difference {error:.2g}"
+
+    compiled.save(output_file_path)
+    return f"compiled to {output_file_path}, max difference {error:.2g}"
+
+
+def manifest_path():
+    return os.path.join(EFS_MOUNT_POINT, 'models', 'train_manifest.json')
+
+
+# The manifest records, per model file, how and on which data it was trained
+def load_manifest():
+    if not os.path.exists(manifest_path()):
+        return {}
+    with open(manifest_path(), 'r') as fp:
+        return json.load(fp)
+
+
+def save_manifest(manifest):
+    with open(manifest_path(), 'w') as fp:
+        json.dump(manifest, fp, indent=4)
+
 
+# How each model is trained in the given mode: incrementally only if its file
+# and manifest entry exist and its last full refit is recent enough
+def plan_modes(manifest, mode=TRAIN_MODE, now=None):
+    now = pd.Timestamp.now(tz='UTC') if now is None else now
+    refit_before = now - pd.Timedelta(days=TRAIN_FULL_REFIT_DAYS)
+
+    modes = {}
+    for hub_id in HUB_IDS:
+        for target_column in model_targets():
+            entry = manifest.get(f"{target_column}_{hub_id}")
+            incremental = (
+                mode == 'incremental'
+                and entry is not None
+                and os.path.exists(model_file_path(target_column, hub_id))
+                and pd.Timestamp(entry['full_refit_at']) >= refit_before
+            )
+            modes[(hub_id, target_column)] = 'incremental' if incremental else 'full'
+    return modes
+
+
+# Train one (hub, target) model and save it as soon as it is ready. Returns a
+# message and the manifest entry of the model
+# Sub-steps of jobs run by worker processes are logged by the workers, but are
+# missing from the collected_metrics() of the parent
+def train_job(hub_data, target_column, hub_id, features, n_jobs, mode, entry):
+    import_model_libraries(target_column)
+    start_time = time.perf_counter()
+    output_file_path = model_file_path(target_column, hub_id)
+    with Stage(
+        'model',
+        rows_in=hub_data.shape[0],
+        model=f"{target_column}_{hub_id}",
+        mode=mode,
+    ):
+        base_model = joblib.load(output_file_path) if mode == 'incremental' else None
+        model = train_model(
+            hub_data,
+            target_column,
+            hub_id,
+            features,
+            n_jobs=n_jobs,
+            base_model=base_model,
+        )
+        with Stage('save'):
+            joblib.dump(model, output_file_path, compress=True)
+        train_time = time.perf_counter() - start_time
+
+        compiled = ''
+        if TRAIN_COMPILE_MODELS:
+            with Stage('compile'):
+                X = feature_matrix(hub_data.iloc[:PARITY_ROWS], features)
+                compiled = f", {save_compiled_model(model, target_column, hub_id, X)}"
+
+    trained_at = str(pd.Timestamp.now(tz='UTC'))
+    trained_until = str(hub_data['delivery_time'].max())
+    if mode == 'full':
+        entry = {'full_refit_at': trained_at, 'full_train_seconds': train_time}
+    entry = {
+        **entry,
+        'mode': mode,
+        'trained_at': trained_at,
+        'trained_until': trained_until,
+        'rows': int(hub_data.shape[0]),
+        'train_seconds': train_time,
+        # Compared to the last full refit, which saw less data than a new one
+        'time_saved_seconds': entry['full_train_seconds'] - train_time,
+    }
+    message = (
+        f"Model for prediction of {target_column} of hub {hub_id} trained ({mode}) "
+        f"in {train_time:.1f}s on {n_jobs} threads and saved to {output_file_path}"
+        f"{compiled}"
+    )
+    return message, entry
+
+
+def train_models(
+    data, modes=None, manifest=None, max_workers=TRAIN_WORKERS, cores=TRAIN_CORES
+):
+    modes = {} if modes is None else modes
+    manifest = {} if manifest is None else manifest
     # Filter the DataFrame to skip rows where any of the specified columns have NA values
     df_filtered = data.dropna(
         subset=['bags_used', 'cold_bags_used', 'deep_frozen_bags_used']
     )
     features = build_training_features(df_filtered.columns)
 
-    # print('{}-{} for {}'.format(start_date, end_date, extra_features))
-    target_columns = ['cold_bags', 'bags', 'deep_frozen_bags']
-    result = []
-    for hub_id in [1, 4]:
-        print("hub ", hub_id)
-        for target_column in target_columns:
-            model = train_model(df_filtered, target_column, hub_id, features)
-            output_file_path = os.path.join(
-                EFS_MOUNT_POINT, 'models', f"{target_column}_{hub_id}.joblib"
+    jobs = []
+    results = {}
+    up_to_date = set()
+    for hub_id in HUB_IDS:
+        hub_data = df_filtered[df_filtered.hub_id == hub_id]
+        for target_column in model_targets():
+            mode = modes.get((hub_id, target_column), 'full')
+            entry = manifest.get(f"{target_column}_{hub_id}")
+            job_data = hub_data
+            if mode == 'incremental':
+                # Only the orders labeled since the model was last trained
+                trained_until = pd.Timestamp(entry['trained_until'])
+                job_data = hub_data[hub_data['delivery_time'] > trained_until]
+                if job_data.shape[0] < TRAIN_INCREMENTAL_MIN_ROWS:
+                    # trained_until stays, the next run gets these rows again
+                    up_to_date.add((hub_id, target_column))
+                    results[(hub_id, target_column)] = (
+                        f"Model for prediction of {target_column} of hub {hub_id} "
+                        f"is up to date ({job_data.shape[0]} new orders held back)",
+                        entry,
+                    )
+                    continue
+            cost = job_cost(target_column, job_data.shape[0], mode)
+            jobs.append((job_data, target_column, hub_id, mode, entry, cost))
+
+    if max_workers <= 1 or len(jobs) <= 1:
+        for job_data, target_column, hub_id, mode, entry, _ in jobs:
+            results[(hub_id, target_column)] = train_job(
+                job_data, target_column, hub_id, features, cores, mode, entry
             )
-            joblib.dump(model, output_file_path, compress=True)
-            result.append(
-                f"Model for prediction of {target_column} of hub {hub_id} trained and saved to {output_file_path}"
+        return finish_training(results, manifest, up_to_date)
+
+    # Start the most expensive jobs first, the cheaper ones fill the gaps
+    jobs.sort(key=lambda job: -job[-1])
+    workers = min(max_workers, len(jobs), cores)
+    if workers == len(jobs):
+        threads = allocate_threads([cost for *_, cost in jobs], cores)
+    else:
+        threads = [max(1, cores // workers)] * len(jobs)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                train_job,
+                job_data,
+                target_column,
+                hub_id,
+                features,
+                n_jobs,
+                mode,
+                entry,
+            ): (hub_id, target_column)
+            for (job_data, target_column, hub_id, mode, entry, _), n_jobs in zip(
+                jobs, threads
             )
-
-    return result
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            print(results[futures[future]][0])
+
+    return finish_training(results, manifest, up_to_date)
+
+
+# Record the trained models in the manifest, returns the messages in
+# (hub, target) order and the time saved compared to full refits
+def finish_training(results, manifest, up_to_date):
+    messages = []
+    for hub_id in HUB_IDS:
+        for target_column in model_targets():
+            message, entry = results[(hub_id, target_column)]
+            manifest[f"{target_column}_{hub_id}"] = entry
+            messages.append(message)
+    save_manifest(manifest)
+
+    # A model that is up to date saves its whole full refit
+    time_saved = sum(
+        entry['full_train_seconds' if key in up_to_date else 'time_saved_seconds']
+        for key, (_, entry) in results.items()
+    )
+    if time_saved > 0:
+        messages.append(f"Incremental training saved {time_saved:.1f}s")
+    return messages
+
+
+@profiled('train')
+def do_train(mode=TRAIN_MODE):
+    with Stage('train') as train_stage:
+        manifest = load_manifest()
+        modes = plan_modes(manifest, mode)
+
+        start = None
+        if all(job_mode == 'incremental' for job_mode in modes.values()):
+            # Only the rows after the oldest incremental checkpoint are needed
+            start = min(
+                pd.Timestamp(manifest[f"{target_column}_{hub_id}"]['trained_until'])
+                for hub_id, target_column in modes
+            )
+        with Stage('load') as step:
+            data = load_training_data(start)
+            step.rows_out = data.shape[0]
+        train_stage.rows_in = data.shape[0]
+        return train_models(data, modes, manifest)
 
 
 def lambda_handler(event, context):
+    clear_metrics()
     result = do_train()
-    return {'statusCode': 200, 'body': result}
+    return {
+        'statusCode': 200,
+        'body': {'result': result, 'metrics': collected_metrics()},
+    }
 
 
 if __name__ == '__main__':
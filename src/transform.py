@@ -2,6 +2,9 @@ import os
 
 import pandas as pd
 from pandas import DataFrame
+from instrumentation import Stage, clear_metrics, collected_metrics
+from profiling import profiled
+from snapshot import read_snapshot, write_snapshot
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -12,8 +15,8 @@ EFS_MOUNT_POINT = (
     '/mnt/efs' if IS_LAMBDA else os.path.join(current_script_dir, '../data')
 )
 
-input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.pkl')
-output_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.pkl')
+input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.parquet')
+output_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.parquet')
 
 
 def transform(data: DataFrame, *args, **kwargs) -> DataFrame:
@@ -31,25 +34,43 @@ def remove_outliers(df: DataFrame, *args, **kwargs) -> DataFrame:
     return df
 
 
-def do_transform():
-    # Load data from CSV
-    data = pd.read_pickle(input_file_path)
-
-    # Apply transformations
+def transform_data(data: DataFrame) -> DataFrame:
     data = transform(data)
     data = remove_outliers(data)
+    return data
 
-    # Save the DataFrame as a pickle file
-    data.to_pickle(output_file_path)
+
+@profiled('transform')
+def do_transform():
+    with Stage('transform') as transform_stage:
+        # Load data from the snapshot
+        with Stage('read') as step:
+            data = read_snapshot(input_file_path)
+            step.rows_out = data.shape[0]
+        transform_stage.rows_in = data.shape[0]
+
+        # Apply transformations
+        with Stage('clean', rows_in=data.shape[0]) as step:
+            data = transform_data(data)
+            step.rows_out = data.shape[0]
+
+        # Save the DataFrame as a Parquet snapshot
+        with Stage('write', rows_in=data.shape[0]):
+            write_snapshot(data, output_file_path)
+        transform_stage.rows_out = data.shape[0]
 
     print(f"Data successfully transformed and saved to {output_file_path}")
 
 
 def lambda_handler(event, context):
+    clear_metrics()
     do_transform()
     return {
         'statusCode': 200,
-        'body': f"Data successfully transformed and saved to {output_file_path}",
+        'body': {
+            'result': f"Data successfully transformed and saved to {output_file_path}",
+            'metrics': collected_metrics(),
+        },
     }
 
 
@@ -1,34 +1,46 @@
 # upload_csv.py
 import os
 import sys
+import time
 import warnings
+
+import numpy as np
 import pandas as pd
+from bulk_load import copy_frame
 from column_generator import generate_columns, get_column_names
-from config import db_connect, TABLE_NAME
+from config import db_connection, TABLE_NAME, TABLE_INDEXES
 
+# Number of CSV rows streamed to PostgreSQL per COPY
+COPY_CHUNK_SIZE = int(os.getenv('COPY_CHUNK_SIZE', 100000))
 
-def do_upload(csv_file_path, fraction=1.0):
-    # Suppress deprecation warning
-    warnings.filterwarnings(
-        "ignore", category=DeprecationWarning, module="pandas.core.dtypes.cast"
-    )
-
-    conn = db_connect()
 
-    # Create a cursor
-    cur = conn.cursor()
+def create_table(cur, defer_indexes=False):
+    columns = generate_columns()
+    if defer_indexes:
+        # The primary key is added by build_indexes() once the data is loaded
+        columns = [col.replace(' PRIMARY KEY', '') for col in columns]
 
     cur.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
     # Generate the table structure dynamically
     create_table_query = f"""
     CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-        {', '.join(generate_columns())}
+        {', '.join(columns)}
     );
     """
     print(create_table_query)
     cur.execute(create_table_query)
-    conn.commit()
 
+
+def build_indexes(cur, primary_key=False):
+    if primary_key:
+        cur.execute(f"ALTER TABLE {TABLE_NAME} ADD PRIMARY KEY (order_id)")
+    for index_name, definition in TABLE_INDEXES.items():
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON {TABLE_NAME} {definition}"
+        )
+
+
+def insert_rows(cur, csv_file_path, fraction):
     # Load data from CSV
     data = pd.read_csv(csv_file_path)
     # Convert NaN to None (interpreted as NULL in PostgreSQL)
@@ -45,18 +57,74 @@ def do_upload(csv_file_path, fraction=1.0):
     for _, row in data.iterrows():
         cur.execute(insert_query, tuple(row))
 
-    conn.commit()
+    return data.shape[0]
+
+
+def copy_rows(cur, csv_file_path, fraction, chunksize=COPY_CHUNK_SIZE):
+    columns = get_column_names()
+    # One generator for all chunks, so every chunk gets its own sample
+    random_state = np.random.RandomState(42)
+
+    rows = 0
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunksize):
+        if fraction < 1.0:
+            chunk = chunk.sample(frac=fraction, random_state=random_state)
+        rows += copy_frame(cur, chunk, TABLE_NAME, columns)
+
+    return rows
+
+
+def do_upload(
+    csv_file_path,
+    fraction=1.0,
+    bulk=True,
+    defer_indexes=True,
+    chunksize=COPY_CHUNK_SIZE,
+):
+    # Suppress deprecation warning
+    warnings.filterwarnings(
+        "ignore", category=DeprecationWarning, module="pandas.core.dtypes.cast"
+    )
+
+    # Bulk loads and index builds are not bounded by DB_STATEMENT_TIMEOUT_MS
+    with db_connection(statement_timeout=0) as conn:
+        with conn.cursor() as cur:
+            create_table(cur, defer_indexes=defer_indexes)
+            if not defer_indexes:
+                build_indexes(cur)
+            conn.commit()
+
+            start_time = time.perf_counter()
+            if bulk:
+                rows = copy_rows(cur, csv_file_path, fraction, chunksize=chunksize)
+            else:
+                rows = insert_rows(cur, csv_file_path, fraction)
+            load_time = time.perf_counter() - start_time
+            print(
+                f"Loaded {rows} rows in {load_time:.2f}s ({rows / max(load_time, 1e-9):.0f} rows/sec)"
+            )
+
+            if defer_indexes:
+                start_time = time.perf_counter()
+                build_indexes(cur, primary_key=True)
+                print(f"Built indexes in {time.perf_counter() - start_time:.2f}s")
+            cur.execute(f"ANALYZE {TABLE_NAME}")
+
+        conn.commit()
+
+    return rows
 
-    # Close the cursor and connection
-    cur.close()
-    conn.close()
 
 if __name__ == '__main__':
     # Use the first command-line argument as the filename or default to 'bags_forecast_with_id.csv'
-    csv_file_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
-        os.path.dirname(os.path.abspath(__file__)),
-        '..',
-        'data',
-        'bags_forecast_with_id.csv',
+    csv_file_path = (
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            '..',
+            'data',
+            'bags_forecast_with_id.csv',
+        )
     )
-    do_upload(csv_file_path)
\ No newline at end of file
+    do_upload(csv_file_path)
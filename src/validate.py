@@ -3,15 +3,16 @@ import json
 
 import numpy as np
 import pandas as pd
-from evidently import ColumnMapping
-from evidently.tests import *
-from evidently.report import Report
-from evidently.metrics import *
-from evidently.test_suite import TestSuite
-from evidently.test_preset import DataStabilityTestPreset, NoTargetPerformanceTestPreset
-from evidently.metric_preset import DataDriftPreset, TargetDriftPreset
-from evidently.tests.base_test import generate_column_tests
-from evidently.metrics.base_metric import generate_column_metrics
+from drift_engine import drift_report, drift_reports
+from drift_profile import (
+    WINDOW_DAYS,
+    build_reference_profile,
+    reference_key,
+    update_drift,
+)
+from instrumentation import Stage, clear_metrics, collected_metrics
+from profiling import profiled
+from snapshot import latest_delivery_time, read_snapshot, snapshot_columns
 
 # Determine if running in AWS Lambda or locally
 IS_LAMBDA = os.getenv('AWS_LAMBDA_FUNCTION_NAME') is not None
@@ -22,16 +23,36 @@ EFS_MOUNT_POINT = (
     '/mnt/efs' if IS_LAMBDA else os.path.join(current_script_dir, '../data')
 )
 
-input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.pkl')
+input_file_path = os.path.join(EFS_MOUNT_POINT, 'current_state.parquet')
 output_file_path = os.path.join(EFS_MOUNT_POINT, 'data_drift.json')
-
-
-def run(df_enriched):
+# Statistics of the reference window, computed once
+reference_profile_path = os.path.join(EFS_MOUNT_POINT, 'drift_reference_profile.json')
+# Binned days the rolling windows still need, and every window result computed
+drift_state_path = os.path.join(EFS_MOUNT_POINT, 'drift_state.json')
+drift_history_path = os.path.join(EFS_MOUNT_POINT, 'drift_windows.jsonl')
+
+# Reference window, everything delivered after it is the current data
+REFERENCE_START_DATE = '2022-01-01'
+REFERENCE_END_DATE = '2022-02-20'
+
+# 'report' runs the Evidently report on all the data delivered since the
+# reference window, 'rolling' compares the rolling windows of every hub against
+# the cached profile of the reference window. data_drift.json holds a different
+# JSON then, see validate_rolling()
+VALIDATE_MODE = os.getenv('VALIDATE_MODE', 'report')
+# Rolling windows to compare, e.g. 'day,week', see drift_profile.WINDOW_DAYS
+VALIDATE_WINDOWS = os.getenv('VALIDATE_WINDOWS', ','.join(WINDOW_DAYS)).split(',')
+# Days a run catches up with at most, e.g. on the first run
+VALIDATE_BACKFILL_DAYS = int(os.getenv('VALIDATE_BACKFILL_DAYS', 7))
+# The report of VALIDATE_MODE=report: 'evidently', or 'numpy' for the same JSON
+# from drift_engine.py, with a report per hub under 'hubs'
+VALIDATE_ENGINE = os.getenv('VALIDATE_ENGINE', 'evidently')
+
+
+def run(df_enriched, engine=VALIDATE_ENGINE):
     timezone = df_enriched['delivery_time'].iloc[0].tzinfo
-    start_date = pd.to_datetime('2022-01-01').tz_localize(timezone)
-    end_date = pd.to_datetime('2022-02-20').tz_localize(timezone)
-
-    report = Report(metrics=[DataDriftPreset()])
+    start_date = pd.to_datetime(REFERENCE_START_DATE).tz_localize(timezone)
+    end_date = pd.to_datetime(REFERENCE_END_DATE).tz_localize(timezone)
 
     reference = df_enriched[
         (df_enriched['delivery_time'] > start_date)
@@ -46,7 +67,11 @@ def run(df_enriched):
         raise ValueError("The current dataset is empty. Please check the date range.")
 
     # Ensure no missing values and correct data types for correlation calculation
-    num_columns = reference.select_dtypes(include=[np.number]).columns.tolist()
+    num_columns = [
+        col
+        for col in reference.select_dtypes(include=[np.number]).columns
+        if col != 'order_id'
+    ]
     reference = reference[num_columns].dropna()
     print(current.head())
     current = current[num_columns].dropna()
@@ -58,9 +83,21 @@ def run(df_enriched):
         )
 
     # Run the report
-    report.run(reference_data=reference, current_data=current)
+    rows = reference.shape[0] + current.shape[0]
+    with Stage('report', rows_in=rows, engine=engine):
+        if engine == 'numpy':
+            if 'hub_id' not in num_columns:
+                return drift_report(reference, current)
+            result, hubs = drift_reports(reference, current)
+            return {**result, 'hubs': hubs}
 
-    return report.as_dict()
+        # Evidently takes seconds to import, only its report needs it
+        from evidently.report import Report
+        from evidently.metric_preset import DataDriftPreset
+
+        report = Report(metrics=[DataDriftPreset()])
+        report.run(reference_data=reference, current_data=current)
+        return report.as_dict()
 
 
 def remove_forecast_columns(data: pd.DataFrame) -> pd.DataFrame:
@@ -73,19 +110,115 @@ def remove_forecast_columns(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-def do_validate():
-    data = pd.read_pickle(input_file_path)
+def load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def save_json(data, path):
+    with open(path, 'w') as fp:
+        json.dump(data, fp, indent=4, default=str)
+
+
+def forecast_free_columns(path):
+    return [col for col in snapshot_columns(path) if not col.endswith('_forecast')]
+
+
+# The cached profile of the reference window, rebuilt when the window or the
+# columns of the snapshot changed
+def load_reference_profile():
+    key = {
+        'start': REFERENCE_START_DATE,
+        'end': REFERENCE_END_DATE,
+        'snapshot_columns': forecast_free_columns(input_file_path),
+    }
+    reference = load_json(reference_profile_path)
+    if reference is not None and reference.get('key') == key:
+        return reference
+
+    with Stage('reference') as step:
+        data = read_snapshot(
+            input_file_path,
+            columns=key['snapshot_columns'],
+            start=REFERENCE_START_DATE,
+            end=REFERENCE_END_DATE,
+        )
+        if data.empty:
+            raise ValueError(
+                "The reference dataset is empty. Please check the date range."
+            )
+        step.rows_in = data.shape[0]
+        reference = build_reference_profile(
+            data, REFERENCE_START_DATE, REFERENCE_END_DATE
+        )
+        reference['key'] = key
+    save_json(reference, reference_profile_path)
+    return reference
+
+
+# Compare the windows ending with the days delivered since the last run against
+# the reference profile, and append their results to drift_history_path
+def validate_rolling():
+    reference = load_reference_profile()
+    state = load_json(drift_state_path)
+    latest = latest_delivery_time(input_file_path)
+    if latest is None:
+        raise ValueError("The snapshot is empty.")
+
+    windows = {window: WINDOW_DAYS[window] for window in VALIDATE_WINDOWS}
+    state, results = update_drift(
+        input_file_path, reference, state, latest, windows, VALIDATE_BACKFILL_DAYS
+    )
+    # The results of the latest day of every window and hub
+    latest_results = {(r['window'], r['hub_id']): r for r in state.get('latest', [])}
+    latest_results.update({(r['window'], r['hub_id']): r for r in results})
+    state['latest'] = list(latest_results.values())
+    save_json(state, drift_state_path)
+    with open(drift_history_path, 'a') as fp:
+        for result in results:
+            fp.write(json.dumps(result) + '\n')
+
+    return {
+        'reference': reference_key(reference),
+        'last_day': state['last_day'],
+        'windows': state['latest'],
+    }
+
+
+def validate_report():
+    # Skip the forecast columns and everything delivered before the reference window
+    with Stage('read') as step:
+        data = read_snapshot(
+            input_file_path,
+            columns=forecast_free_columns(input_file_path),
+            start=REFERENCE_START_DATE,
+        )
+        step.rows_out = data.shape[0]
     data = remove_forecast_columns(data)
-    result = run(data)
-    with open(output_file_path, 'w') as fp:
-        json.dump(result, fp, indent=4, default=str)
+    return run(data)
+
+
+@profiled('validate')
+def do_validate(mode=VALIDATE_MODE):
+    with Stage('validate', mode=mode):
+        if mode == 'report':
+            result = validate_report()
+        else:
+            result = validate_rolling()
+        save_json(result, output_file_path)
     return result
 
 
 def lambda_handler(event, context):
-    result = do_validate()
-    json = json.dumps(result, indent=4, default=str)
-    return {'statusCode': 200, 'body': json}
+    clear_metrics()
+    # The report holds timestamps and numpy values Lambda cannot serialize
+    result = json.loads(json.dumps(do_validate(), default=str))
+    return {
+        'statusCode': 200,
+        'body': {'result': result, 'metrics': collected_metrics()},
+    }
 
 
 if __name__ == '__main__':
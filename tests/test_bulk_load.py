@@ -0,0 +1,35 @@
+import pytest
+import numpy as np
+import pandas as pd
+from bulk_load import frame_to_csv
+
+
+@pytest.fixture
+def sample_data():
+    # Sample DataFrame to be used in tests
+    return pd.DataFrame(
+        {
+            'order_id': [100000001, 100000002],
+            'total_weight': [1234.5, np.nan],
+            'delivery_time': ['2023-08-19 12:00:00', '2023-08-19 13:00:00'],
+            'bags_used': [5.0, np.nan],
+        }
+    )
+
+
+def test_frame_to_csv(sample_data):
+    columns = ['order_id', 'total_weight', 'delivery_time', 'bags_used']
+    lines = frame_to_csv(sample_data, columns).read().splitlines()
+
+    # INTEGER columns are rendered without decimals, NaN becomes an empty field (NULL)
+    assert lines[0] == '100000001,1234.5,2023-08-19 12:00:00,5'
+    assert lines[1] == '100000002,,2023-08-19 13:00:00,'
+
+
+def test_frame_to_csv_column_subset(sample_data):
+    lines = frame_to_csv(sample_data, ['bags_used', 'order_id']).read().splitlines()
+    assert lines == ['5,100000001', ',100000002']
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,70 @@
+import pytest
+import numpy as np
+import xgboost as xgb
+from sklearn.ensemble import RandomForestRegressor
+from compiled_model import CompiledEnsemble, compile_model, parity_error
+
+
+@pytest.fixture
+def sample_data():
+    rng = np.random.default_rng(42)
+    X = rng.uniform(size=(500, 6)).astype(np.float32)
+    y = 3 * X[:, 0] + X[:, 1] + rng.normal(scale=0.1, size=500)
+    # Missing values must take the same branches as in the original models
+    X[rng.uniform(size=X.shape) < 0.05] = np.nan
+    return X, y
+
+
+def test_compile_random_forest(sample_data):
+    X, y = sample_data
+    model = RandomForestRegressor(n_estimators=20, random_state=42).fit(X, y)
+
+    compiled = compile_model(model)
+    assert parity_error(model, compiled, X) < 1e-9
+
+
+def test_compile_xgboost(sample_data):
+    X, y = sample_data
+    model = xgb.XGBRegressor(n_estimators=50, max_depth=4).fit(X, y)
+
+    compiled = compile_model(model)
+    assert parity_error(model, compiled, X) < 1e-4
+
+
+def test_compile_multi_output(sample_data):
+    X, y = sample_data
+    Y = np.column_stack([y, 2 * y])
+
+    for model in [
+        RandomForestRegressor(n_estimators=10, random_state=42),
+        xgb.XGBRegressor(n_estimators=20, max_depth=3),
+        xgb.XGBRegressor(
+            n_estimators=20, max_depth=3, multi_strategy='multi_output_tree'
+        ),
+    ]:
+        model.fit(X, Y)
+        compiled = compile_model(model)
+        assert compiled.predict(X).shape == (500, 2)
+        assert parity_error(model, compiled, X) < 1e-4
+
+
+def test_compiled_roundtrip(sample_data, tmp_path):
+    X, y = sample_data
+    compiled = compile_model(xgb.XGBRegressor(n_estimators=10).fit(X, y))
+
+    compiled.save(tmp_path / 'bags_1.npz')
+    loaded = CompiledEnsemble.load(tmp_path / 'bags_1.npz')
+    np.testing.assert_array_equal(loaded.predict(X), compiled.predict(X))
+
+
+def test_compile_unsupported_objective(sample_data):
+    X, y = sample_data
+    model = xgb.XGBRegressor(n_estimators=5, objective='count:poisson')
+    model.fit(X, np.abs(y))
+
+    with pytest.raises(ValueError):
+        compile_model(model)
+
+
+if __name__ == '__main__':
+    pytest.main()
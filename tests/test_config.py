@@ -0,0 +1,128 @@
+import pytest
+import psycopg2
+
+import config
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        if self.conn.dead:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection")
+        self.conn.queries.append((query, params))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.queries = []
+        self.resets = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def reset(self):
+        self.resets += 1
+
+    def close(self):
+        self.closed = 1
+
+
+# Keeps every returned connection, like ThreadedConnectionPool below minconn
+class FakePool:
+    def __init__(self, minconn, maxconn, **params):
+        self.idle = []
+        self.connections = []
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        if close:
+            conn.close()
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        for conn in self.connections:
+            conn.close()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(config, 'ThreadedConnectionPool', FakePool)
+    config.close_pool()
+    yield config.get_pool()
+    config.close_pool()
+
+
+def test_connection_params(monkeypatch):
+    monkeypatch.setenv('DB_ENDPOINT', 'db.example.com:6543')
+    params = config.connection_params(statement_timeout=5000)
+
+    assert params['host'] == 'db.example.com'
+    assert params['port'] == '6543'
+    assert params['options'] == '-c statement_timeout=5000'
+    assert 'options' not in config.connection_params(statement_timeout=0)
+
+
+def test_connection_reused(pool):
+    with config.db_connection() as first:
+        pass
+    with config.db_connection() as second:
+        pass
+
+    assert first is second
+    assert config.get_pool() is pool
+
+
+def test_dead_connection_replaced(pool, monkeypatch):
+    with config.db_connection() as first:
+        pass
+    # Idle past the ping threshold, and dropped by the server meanwhile
+    monkeypatch.setattr(config, 'DB_POOL_PING_AFTER_SECONDS', 0)
+    first.dead = True
+
+    with config.db_connection() as second:
+        pass
+
+    assert second is not first
+    assert first.closed
+    assert len(pool.connections) == 2
+
+
+def test_statement_timeout_reset(pool):
+    with config.db_connection(statement_timeout=1000) as conn:
+        assert conn.queries == [('SET statement_timeout = %s', (1000,))]
+    assert conn.resets == 1
+
+    with config.db_connection() as conn:
+        pass
+    assert conn.resets == 1
+
+
+def test_pool_recreated_after_fork(pool, monkeypatch):
+    monkeypatch.setattr(config.os, 'getpid', lambda: -1)
+
+    assert config.get_pool() is not pool
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,109 @@
+import pytest
+import numpy as np
+import pandas as pd
+import download
+from instrumentation import clear_metrics, collected_metrics
+from download import (
+    build_watermark,
+    merge_snapshot,
+    select_changes,
+    watermark_rows,
+    typed_frame,
+)
+
+
+@pytest.fixture
+def snapshot():
+    # Sample snapshot as it is stored in current_state.csv
+    return pd.DataFrame(
+        {
+            'order_id': [1, 2, 3],
+            'delivery_time': [
+                '2023-08-18 12:00:00',
+                '2023-08-19 12:00:00',
+                '2023-08-20 12:00:00',
+            ],
+            'bags_used': [5, np.nan, np.nan],
+            'bags_used_forecast': [4.5, 3.5, np.nan],
+        }
+    )
+
+
+def test_build_watermark(snapshot):
+    watermark = build_watermark(snapshot)
+    assert watermark['order_id'] == 3
+    assert watermark['delivery_time'] == '2023-08-20 12:00:00'
+    # The first row without actuals bounds the rows which may still change
+    assert watermark['actuals_since'] == '2023-08-19 12:00:00'
+
+
+def test_build_watermark_without_open_rows(snapshot):
+    watermark = build_watermark(snapshot.fillna(1.0))
+    assert watermark['actuals_since'] == watermark['delivery_time']
+
+
+def test_build_watermark_ignores_missing_forecasts(snapshot):
+    # An old order without a forecast does not hold the watermark back
+    snapshot.loc[0, 'bags_used_forecast'] = np.nan
+    assert build_watermark(snapshot)['actuals_since'] == '2023-08-19 12:00:00'
+
+
+def test_select_changes_of_emptied_table(snapshot, monkeypatch):
+    monkeypatch.setattr(
+        download,
+        'select_to_df',
+        lambda *args, **kwargs: pd.DataFrame({'max': [np.nan]}),
+    )
+    assert select_changes(build_watermark(snapshot)) is None
+
+
+def test_streamed_download_rows(snapshot, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        download, 'iter_select', lambda: iter([snapshot.iloc[:2], snapshot.iloc[2:]])
+    )
+    clear_metrics()
+    download.download_to_csv(
+        str(tmp_path / 'state.csv'), incremental=False, stream=True
+    )
+
+    records = {record['stage']: record for record in collected_metrics()}
+    assert records['download']['rows_out'] == 3
+    assert records['download.fetch_write']['rows_out'] == 3
+    assert len(pd.read_csv(tmp_path / 'state.csv')) == 3
+
+
+def test_merge_snapshot(snapshot):
+    changes = pd.DataFrame(
+        {
+            'order_id': [4, 2],
+            'delivery_time': pd.to_datetime(
+                ['2023-08-21 12:00:00', '2023-08-19 12:00:00']
+            ),
+            'bags_used': [np.nan, 2],
+            'bags_used_forecast': [np.nan, 3.5],
+        }
+    )
+    merged = merge_snapshot(snapshot, changes)
+
+    assert merged['order_id'].tolist() == [1, 2, 3, 4]
+    assert merged.loc[merged.order_id == 2, 'bags_used'].item() == 2
+    assert merged['delivery_time'].dtype == 'datetime64[ns]'
+
+
+def test_watermark_rows(snapshot):
+    # A watermark built from the summary rows of each chunk matches the full one
+    chunks = [snapshot.iloc[:1], snapshot.iloc[1:]]
+    summary = pd.concat([watermark_rows(chunk) for chunk in chunks])
+    assert build_watermark(summary) == build_watermark(snapshot)
+
+
+def test_typed_frame():
+    rows = [(1, None, 3), (2, 4, 5)]
+    data = typed_frame(rows, ['order_id', 'bags_used', 'hub_id'])
+    assert data['order_id'].dtype == 'int64'
+    assert data['bags_used'].dtype == 'float64'
+    assert data['hub_id'].dtype == 'int64'
+
+
+if __name__ == '__main__':
+    pytest.main()
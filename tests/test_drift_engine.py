@@ -0,0 +1,304 @@
+import pytest
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import validate
+from drift_engine import (
+    column_statistics,
+    drift_report,
+    drift_report_by_hub,
+    binned_counts,
+    cdf_difference,
+    drift_reports,
+    population_stability_index,
+    reference_below,
+    sorted_columns,
+    ks_statistic,
+    wasserstein_distance,
+)
+from ingest import extra_features, transform
+from synthetic_data import generate_orders
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(3)
+    reference = np.column_stack(
+        [
+            rng.normal(0, 1, 3000),
+            rng.integers(0, 4, 3000),
+            rng.exponential(2, 3000),
+        ]
+    )
+    current = np.column_stack(
+        [
+            rng.normal(0.3, 1, 2000),
+            rng.integers(0, 5, 2000),
+            rng.exponential(2, 2000),
+        ]
+    )
+    return reference, current
+
+
+def test_statistics_match_scipy(samples):
+    reference, current = samples
+    values, order = sorted_columns(reference.T, current.T)
+    below = reference_below(order, len(reference))
+    difference = cdf_difference(below, len(reference), len(current))
+    ks = ks_statistic(values, difference)
+    wasserstein = wasserstein_distance(values, difference)
+
+    # Column 1 has ties, only whole numbers
+    for i in range(reference.shape[1]):
+        expected = stats.ks_2samp(reference[:, i], current[:, i])
+        assert ks[i] == pytest.approx(expected.statistic)
+        assert wasserstein[i] == pytest.approx(
+            stats.wasserstein_distance(reference[:, i], current[:, i])
+        )
+
+
+def test_binned_counts_match_histogram(samples):
+    reference, current = samples
+    values, order = sorted_columns(reference.T, current.T)
+    edges = np.linspace(values[:, 0], values[:, -1], 14, axis=1)
+    reference_counts, current_counts = binned_counts(
+        values, reference_below(order, len(reference)), edges
+    )
+
+    for i in range(reference.shape[1]):
+        expected_edges = np.histogram_bin_edges(
+            np.concatenate([reference[:, i], current[:, i]]), bins=13
+        )
+        expected_reference = np.histogram(reference[:, i], expected_edges)[0]
+        expected_current = np.histogram(current[:, i], expected_edges)[0]
+        assert reference_counts[i].tolist() == expected_reference.tolist()
+        assert current_counts[i].tolist() == expected_current.tolist()
+
+
+def test_drift_report(samples):
+    columns = ['shifted', 'counts', 'same']
+    reference = pd.DataFrame(samples[0], columns=columns)
+    current = pd.DataFrame(samples[1], columns=columns)
+    report = drift_report(reference, current)
+
+    dataset, table = report['metrics']
+    assert dataset['metric'] == 'DatasetDriftMetric'
+    assert table['metric'] == 'DataDriftTable'
+    drift = table['result']['drift_by_columns']
+    assert list(drift) == columns
+    # Large reference, tested as Evidently does by default
+    assert drift['shifted']['stattest_name'] == 'Wasserstein distance (normed)'
+    assert drift['shifted']['drift_detected']
+    assert drift['counts']['stattest_name'] == 'Jensen-Shannon distance'
+    assert drift['counts']['drift_detected']
+    assert not drift['same']['drift_detected']
+    assert dataset['result']['number_of_drifted_columns'] == 2
+    assert dataset['result']['dataset_drift']
+    assert len(drift['same']['current']['small_distribution']['x']) == 11
+
+
+def test_drift_report_small_reference(samples):
+    reference = pd.DataFrame(samples[0][:500, :2], columns=['shifted', 'counts'])
+    current = pd.DataFrame(samples[1][:500, :2], columns=['shifted', 'counts'])
+    drift = drift_report(reference, current)['metrics'][1]['result']
+    shifted = drift['drift_by_columns']['shifted']
+    assert shifted['stattest_name'] == 'K-S p_value'
+    assert shifted['drift_score'] == pytest.approx(
+        stats.ks_2samp(reference['shifted'], current['shifted']).pvalue
+    )
+    counts = drift['drift_by_columns']['counts']
+    assert counts['stattest_name'] == 'chi-square p_value'
+    # A value only current has is drift
+    assert counts['drift_score'] == 0.0
+
+
+# Keys of Report(metrics=[DataDriftPreset()]).as_dict() of Evidently 0.4.30, with
+# the columns of drift_by_columns as '<column>'
+EVIDENTLY_LAYOUT = {
+    'metrics': [
+        {
+            'metric': None,
+            'result': {
+                'drift_share': None,
+                'number_of_columns': None,
+                'number_of_drifted_columns': None,
+                'share_of_drifted_columns': None,
+                'dataset_drift': None,
+            },
+        },
+        {
+            'metric': None,
+            'result': {
+                'number_of_columns': None,
+                'number_of_drifted_columns': None,
+                'share_of_drifted_columns': None,
+                'dataset_drift': None,
+                'drift_by_columns': {
+                    '<column>': {
+                        'column_name': None,
+                        'column_type': None,
+                        'stattest_name': None,
+                        'stattest_threshold': None,
+                        'drift_score': None,
+                        'drift_detected': None,
+                        'current': {'small_distribution': {'x': None, 'y': None}},
+                        'reference': {'small_distribution': {'x': None, 'y': None}},
+                    }
+                },
+                'current_fi': None,
+                'reference_fi': None,
+            },
+        },
+    ]
+}
+
+
+# Per-column keys the engine adds to Evidently's
+ENGINE_KEYS = {'psi'}
+
+
+# Keys of a report without ENGINE_KEYS, values left out
+def layout(report):
+    if isinstance(report, list) and report and isinstance(report[0], dict):
+        return [layout(item) for item in report]
+    if not isinstance(report, dict):
+        return None
+    if report and all(
+        isinstance(value, dict) and 'column_name' in value for value in report.values()
+    ):
+        return {'<column>': layout(next(iter(report.values())))}
+    return {
+        key: layout(value) for key, value in report.items() if key not in ENGINE_KEYS
+    }
+
+
+def test_drift_report_layout(samples):
+    columns = ['shifted', 'counts', 'same']
+    report = drift_report(
+        pd.DataFrame(samples[0], columns=columns),
+        pd.DataFrame(samples[1], columns=columns),
+    )
+    assert layout(report) == EVIDENTLY_LAYOUT
+    drift = report['metrics'][1]['result']['drift_by_columns']
+    assert all(isinstance(column['psi'], float) for column in drift.values())
+
+
+def test_population_stability_index():
+    # Shares 3/4 and 1/4 against 1/4 and 3/4
+    reference, current = np.array([[3, 1], [2, 2]]), np.array([[1, 3], [2, 2]])
+    psi = population_stability_index(reference, current)
+    assert psi == pytest.approx([np.log(3), 0.0])
+
+    # An empty bin gets a share of 0.0001
+    psi = population_stability_index(np.array([3, 1, 0]), np.array([1, 2, 1]))
+    expected = (
+        (0.75 - 0.25) * np.log(0.75 / 0.25)
+        + (0.25 - 0.5) * np.log(0.25 / 0.5)
+        + (0.0001 - 0.25) * np.log(0.0001 / 0.25)
+    )
+    assert psi == pytest.approx(expected)
+
+
+def test_drift_report_psi():
+    # Reference has 2 values, PSI of their shares: 3/4 and 1/4 against 1/4 and 3/4
+    reference = pd.DataFrame({'column': [0.0, 0.0, 0.0, 1.0]})
+    current = pd.DataFrame({'column': [0.0, 1.0, 1.0, 1.0]})
+    drift = drift_report(reference, current)['metrics'][1]['result']
+    assert drift['drift_by_columns']['column']['psi'] == pytest.approx(np.log(3))
+
+    # Reference has 24 values, 32 rows in all give 6 Sturges bins of 4 reference
+    # values each, all of current is in the first bin
+    reference = pd.DataFrame({'column': np.arange(24.0)})
+    current = pd.DataFrame({'column': np.zeros(8)})
+    drift = drift_report(reference, current)['metrics'][1]['result']
+    expected = (1 / 6 - 1) * np.log(1 / 6) + 5 * (1 / 6 - 0.0001) * np.log(
+        1 / 6 / 0.0001
+    )
+    assert drift['drift_by_columns']['column']['psi'] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('reference_rows', [500, 3000])
+def test_drift_report_matches_evidently(samples, reference_rows):
+    pytest.importorskip('evidently')
+    from evidently.metric_preset import DataDriftPreset
+    from evidently.calculations.stattests.psi import _psi
+    from evidently.core import ColumnType
+    from evidently.report import Report
+
+    rng = np.random.default_rng(4)
+    columns = ['shifted', 'counts', 'same']
+    reference = pd.DataFrame(samples[0][:reference_rows], columns=columns)
+    current = pd.DataFrame(samples[1][:1500], columns=columns)
+    # Two values, the Z-test on small references
+    reference['flag'] = rng.integers(0, 2, reference_rows).astype(float)
+    current['flag'] = rng.integers(0, 2, 1500).astype(float)
+    evidently = Report(metrics=[DataDriftPreset()])
+    evidently.run(reference_data=reference, current_data=current)
+    expected = evidently.as_dict()
+    report = drift_report(reference, current)
+
+    assert layout(report) == layout(expected)
+    assert report['metrics'][0] == expected['metrics'][0]
+    expected_columns = expected['metrics'][1]['result']['drift_by_columns']
+    for col, column in report['metrics'][1]['result']['drift_by_columns'].items():
+        for key in ['column_type', 'stattest_name', 'drift_detected']:
+            assert column[key] == expected_columns[col][key]
+        assert column['drift_score'] == pytest.approx(
+            expected_columns[col]['drift_score'], abs=1e-12
+        )
+        # Evidently's PSI test, which DataDriftPreset does not pick by default
+        assert column['psi'] == pytest.approx(
+            _psi(reference[col], current[col], ColumnType.Numerical, 0.1)[0]
+        )
+        for dataset in ['current', 'reference']:
+            small = column[dataset]['small_distribution']
+            expected_small = expected_columns[col][dataset]['small_distribution']
+            assert small['x'] == pytest.approx(list(expected_small['x']))
+            assert small['y'] == pytest.approx(list(expected_small['y']))
+
+
+def test_drift_report_by_hub():
+    orders = extra_features(transform(generate_orders(4000, seed=1)))
+    columns = ['hub_id', 'total_weight', 'positions']
+    split = orders['delivery_time'] < pd.Timestamp('2022-03-01', tz='UTC')
+    reports = drift_report_by_hub(
+        orders.loc[split, columns], orders.loc[~split, columns]
+    )
+
+    assert sorted(reports) == ['1', '4']
+    for hub_id, report in reports.items():
+        hub = orders[orders['hub_id'] == int(hub_id)]
+        hub_split = hub['delivery_time'] < pd.Timestamp('2022-03-01', tz='UTC')
+        expected = drift_report(hub.loc[hub_split], hub.loc[~hub_split], columns[1:])
+        assert report['metrics'][0] == expected['metrics'][0]
+        drift = report['metrics'][1]['result']['drift_by_columns']
+        for col, column in expected['metrics'][1]['result']['drift_by_columns'].items():
+            assert drift[col]['drift_detected'] == column['drift_detected']
+            assert drift[col]['drift_score'] == pytest.approx(column['drift_score'])
+            assert drift[col]['current'] == column['current']
+            assert drift[col]['psi'] == pytest.approx(column['psi'])
+
+    # The report of all rows from the same pass equals drift_report()
+    report, hubs = drift_reports(
+        orders.loc[split, columns], orders.loc[~split, columns]
+    )
+    assert report == drift_report(
+        orders.loc[split, columns], orders.loc[~split, columns]
+    )
+    assert hubs == reports
+
+
+def test_validate_run_numpy_engine():
+    orders = extra_features(transform(generate_orders(4000, seed=1)))
+    orders = orders.drop(columns=orders.filter(regex='_forecast$').columns)
+    result = validate.run(orders, engine='numpy')
+
+    columns = result['metrics'][1]['result']['drift_by_columns']
+    assert 'order_id' not in columns
+    assert 'total_weight' in columns
+    assert sorted(result['hubs']) == ['1', '4']
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,181 @@
+import json
+
+import pytest
+import numpy as np
+import pandas as pd
+
+import validate
+from drift_profile import (
+    PSI_THRESHOLD,
+    build_reference_profile,
+    population_stability_index,
+    update_drift,
+)
+from ingest import extra_features, transform
+from snapshot import read_snapshot, write_snapshot, latest_delivery_time
+from synthetic_data import generate_orders
+
+REFERENCE_START = '2022-01-01'
+REFERENCE_END = '2022-02-20'
+
+
+@pytest.fixture(scope='module')
+def orders():
+    return extra_features(transform(generate_orders(20000, seed=7)))
+
+
+def snapshot_until(orders, end, path):
+    write_snapshot(orders[orders['delivery_time'] < pd.Timestamp(end, tz='UTC')], path)
+    return path
+
+
+@pytest.fixture
+def reference(orders):
+    data = orders[
+        (orders['delivery_time'] >= pd.Timestamp(REFERENCE_START, tz='UTC'))
+        & (orders['delivery_time'] < pd.Timestamp(REFERENCE_END, tz='UTC'))
+    ]
+    return build_reference_profile(data, REFERENCE_START, REFERENCE_END)
+
+
+def test_reference_profile(reference):
+    assert sorted(reference['hubs']) == ['1', '4']
+    for col in ['order_id', 'hub_id', 'day_of_year', 'bags_used_forecast']:
+        assert col not in reference['columns']
+    assert 'total_weight' in reference['columns']
+    assert 'delivery_hour' in reference['columns']
+
+    weight = reference['hubs']['1']['columns']['total_weight']
+    assert weight['type'] == 'num'
+    assert len(weight['counts']) == len(weight['edges']) + 1
+    assert weight['quantiles']['0.01'] <= weight['quantiles']['0.99']
+    # Whole numbers with few values are counted per value
+    bags = reference['hubs']['1']['columns']['bags_used']
+    assert bags['type'] == 'cat'
+    assert sum(bags['counts']) == reference['hubs']['1']['rows'] - bags['missing']
+    # The profile is cached as JSON
+    assert json.loads(json.dumps(reference)) == reference
+
+
+def test_population_stability_index():
+    assert population_stability_index([10, 20, 30], [20, 40, 60]) == pytest.approx(0)
+    assert population_stability_index([10, 20, 30], [30, 20, 10]) > PSI_THRESHOLD
+    # Empty bins keep the index finite
+    assert np.isfinite(population_stability_index([0, 10], [10, 0]))
+
+
+def test_update_drift_incremental(orders, reference, tmp_path):
+    path = str(tmp_path / 'current_state.parquet')
+    snapshot_until(orders, '2022-06-10 12:00', path)
+
+    state, results = update_drift(
+        path, reference, None, latest_delivery_time(path), backfill_days=3
+    )
+    # The windows ending with the 3 complete days before the latest delivery
+    assert state['last_day'] == '2022-06-09'
+    assert sorted({result['end'] for result in results}) == [
+        '2022-06-08',
+        '2022-06-09',
+        '2022-06-10',
+    ]
+    assert {(r['window'], r['hub_id']) for r in results} == {
+        ('day', 1),
+        ('day', 4),
+        ('week', 1),
+        ('week', 4),
+    }
+    week = [r for r in results if r['window'] == 'week' and r['end'] == '2022-06-10']
+    assert week[0]['start'] == '2022-06-03'
+    for col, drift in week[0]['drift_by_columns'].items():
+        assert drift['stattest_name'] == 'PSI'
+        assert drift['drift_detected'] == (drift['drift_score'] > PSI_THRESHOLD)
+
+    # Nothing new to compare
+    state, results = update_drift(
+        path, reference, state, latest_delivery_time(path), backfill_days=3
+    )
+    assert results == []
+
+    # Only the new days are compared, with the same results as from scratch
+    snapshot_until(orders, '2022-06-13 12:00', path)
+    state, results = update_drift(
+        path, reference, state, latest_delivery_time(path), backfill_days=3
+    )
+    _, scratch = update_drift(
+        path, reference, None, latest_delivery_time(path), backfill_days=3
+    )
+    assert sorted({result['end'] for result in results}) == [
+        '2022-06-11',
+        '2022-06-12',
+        '2022-06-13',
+    ]
+    key = lambda result: (result['window'], result['hub_id'], result['end'])
+    assert sorted(results, key=key) == pytest.approx(sorted(scratch, key=key))
+    # Only the days the next week windows need are kept
+    assert sorted(state['days']) == [f'2022-06-{day:02}' for day in range(7, 13)]
+
+    week = [r for r in results if r['window'] == 'week' and r['hub_id'] == 1][-1]
+    data = read_snapshot(path, start='2022-06-06', end='2022-06-13')
+    weight = data.loc[data['hub_id'] == 1, 'total_weight']
+    assert week['rows'] == weight.size
+    assert week['drift_by_columns']['total_weight']['current_mean'] == pytest.approx(
+        weight.mean()
+    )
+
+
+def test_update_drift_detects_shift(orders, reference, tmp_path):
+    path = str(tmp_path / 'current_state.parquet')
+    shifted = orders.copy()
+    late = shifted['delivery_time'] >= pd.Timestamp('2022-06-01', tz='UTC')
+    shifted.loc[late, 'total_weight'] *= 3
+    snapshot_until(shifted, '2022-06-10 12:00', path)
+
+    _, results = update_drift(
+        path, reference, None, latest_delivery_time(path), backfill_days=1
+    )
+    for result in results:
+        assert result['drift_by_columns']['total_weight']['drift_detected']
+
+
+def test_do_validate_rolling(orders, tmp_path, monkeypatch):
+    snapshot_until(orders, '2022-06-10 12:00', str(tmp_path / 'current_state.parquet'))
+    monkeypatch.setattr(
+        validate, 'input_file_path', str(tmp_path / 'current_state.parquet')
+    )
+    for name in [
+        'output_file_path',
+        'reference_profile_path',
+        'drift_state_path',
+        'drift_history_path',
+    ]:
+        monkeypatch.setattr(validate, name, str(tmp_path / name))
+
+    result = validate.do_validate('rolling')
+    assert result['last_day'] == '2022-06-09'
+    assert len(result['windows']) == 4
+    with open(tmp_path / 'output_file_path') as fp:
+        assert json.load(fp) == result
+    history = (tmp_path / 'drift_history_path').read_text().splitlines()
+    assert len(history) == 4 * validate.VALIDATE_BACKFILL_DAYS
+
+    # The second run reuses the cached profile and has no new days to compare
+    profile_mtime = (tmp_path / 'reference_profile_path').stat().st_mtime_ns
+    assert validate.do_validate('rolling') == result
+    assert (tmp_path / 'reference_profile_path').stat().st_mtime_ns == profile_mtime
+    assert len((tmp_path / 'drift_history_path').read_text().splitlines()) == len(
+        history
+    )
+
+
+def test_lambda_handler_body(monkeypatch):
+    monkeypatch.setattr(
+        validate, 'do_validate', lambda: {'last_day': pd.Timestamp('2022-06-09')}
+    )
+    body = validate.lambda_handler({}, None)['body']
+    # A dict like the other handlers return, serializable as it is
+    assert body['result'] == {'last_day': '2022-06-09 00:00:00'}
+    assert json.loads(json.dumps(body)) == body
+
+
+if __name__ == '__main__':
+    pytest.main()
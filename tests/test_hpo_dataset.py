@@ -0,0 +1,48 @@
+import pickle
+
+import pytest
+import numpy as np
+import pandas as pd
+from hpo_dataset import StudyDataset
+
+
+@pytest.fixture
+def sample_data():
+    rng = np.random.default_rng(42)
+    columns = [
+        'cat_fruits',
+        'lint_item_count',
+        'total_quantity',
+        'positions',
+        'total_weight',
+        'day_of_week',
+        'number_of_week',
+        'delivery_hour',
+    ]
+    data = pd.DataFrame(rng.uniform(0, 100, (100, len(columns))), columns=columns)
+    data['bags_used'] = rng.integers(1, 10, 100).astype('float64')
+    return data
+
+
+def test_study_dataset_split(sample_data):
+    study = StudyDataset(sample_data, 'bags_used', 1)
+
+    assert study.features == [col for col in sample_data.columns if col != 'bags_used']
+    assert study.X_train.dtype == np.float32 and study.X_train.flags.c_contiguous
+    assert study.X_train.shape == (70, 8) and study.X_val.shape == (30, 8)
+    assert study.y_train.shape == (70,) and study.y_val.shape == (30,)
+
+
+def test_study_dataset_dmatrices_cached(sample_data):
+    study = StudyDataset(sample_data, 'bags_used', 1)
+
+    train_matrix, valid_matrix = study.dmatrices()
+    assert study.dmatrices() == (train_matrix, valid_matrix)
+    assert train_matrix.num_row() == 70 and valid_matrix.num_row() == 30
+
+    # The matrices stay in the process that built them
+    assert pickle.loads(pickle.dumps(study))._dmatrices is None
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Modules the Lambda handlers live in
+HANDLER_MODULES = [
+    'download',
+    'ingest',
+    'transform',
+    'train',
+    'pipeline',
+    'predict',
+    'validate',
+]
+# Libraries taking seconds to import, which a handler module may only import
+# in the functions of the invocations that use them
+HEAVY_MODULES = ['sklearn', 'xgboost', 'mlflow', 'evidently', 'hyperopt']
+# Cumulative import time allowed for a handler module, in milliseconds
+IMPORT_TIME_BUDGET_MS = int(os.getenv('IMPORT_TIME_BUDGET_MS', 2000))
+
+
+# Import a module in a fresh interpreter with -X importtime, returns the
+# cumulative import time of every module it imported, in microseconds
+def import_profile(module):
+    env = {**os.environ, 'PRELOAD_MODELS': '0'}
+    env.pop('AWS_LAMBDA_FUNCTION_NAME', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=src_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:') :].split('|')
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def report(profile, top=10):
+    slowest = sorted(profile.items(), key=lambda item: -item[1])[:top]
+    return '\n'.join(f"{us / 1000:8.1f} ms  {name}" for name, us in slowest)
+
+
+@pytest.mark.parametrize('module', HANDLER_MODULES)
+def test_handler_imports_no_heavy_modules(module):
+    profile = import_profile(module)
+    heavy = sorted(name for name in profile if name.split('.')[0] in HEAVY_MODULES)
+
+    assert not heavy, f"{module} imports {heavy[:5]}\n{report(profile)}"
+
+
+@pytest.mark.parametrize('module', HANDLER_MODULES)
+def test_handler_import_time_budget(module):
+    profile = import_profile(module)
+    import_ms = profile[module] / 1000
+
+    assert import_ms <= IMPORT_TIME_BUDGET_MS, (
+        f"Importing {module} took {import_ms:.0f} ms, "
+        f"budget {IMPORT_TIME_BUDGET_MS} ms\n{report(profile)}"
+    )
+
+
+if __name__ == '__main__':
+    pytest.main()
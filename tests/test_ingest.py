@@ -1,7 +1,7 @@
 import pytest
 import pandas as pd
 from pandas import DataFrame
-from ingest import extra_features
+from ingest import extra_features, ingest_chunks
 
 
 @pytest.fixture
@@ -33,5 +33,27 @@ def test_extra_features(sample_data):
     )
 
 
+def test_extra_features_iso_week():
+    # Dates around new year, where the ISO week belongs to another year
+    delivery_time = pd.Series(
+        pd.date_range('2020-12-25', '2022-01-10', freq='D', tz='UTC')
+    )
+    enriched_data = extra_features(pd.DataFrame({'delivery_time': delivery_time}))
+
+    expected_week = delivery_time.dt.isocalendar().week.astype('int64')
+    assert (enriched_data['number_of_week'].astype('int64') == expected_week).all()
+    assert enriched_data['number_of_week'].dtype == 'int8'
+    assert enriched_data['day_of_year'].dtype == 'int16'
+
+
+def test_ingest_chunks_schema(sample_data):
+    data = ingest_chunks([sample_data.iloc[:1].copy(), sample_data.iloc[1:].copy()])
+    assert data.shape[0] == 2
+    assert data['bags_used'].dtype == 'float32'
+    assert data['total_weight'].dtype == 'float32'
+    assert data['delivery_hour'].dtype == 'int8'
+    assert data['delivery_time'].dtype == 'datetime64[ns, UTC]'
+
+
 if __name__ == '__main__':
     pytest.main()
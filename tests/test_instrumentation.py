@@ -0,0 +1,67 @@
+import json
+
+import pytest
+import numpy as np
+
+import instrumentation
+from instrumentation import Stage, clear_metrics, collected_metrics
+
+
+@pytest.fixture(autouse=True)
+def metrics(monkeypatch, tmp_path):
+    monkeypatch.setattr(instrumentation, 'METRICS_LOG', False)
+    monkeypatch.setattr(instrumentation, 'METRICS_FILE', str(tmp_path / 'm.jsonl'))
+    clear_metrics()
+    yield tmp_path / 'm.jsonl'
+    clear_metrics()
+
+
+def test_nested_stages(metrics):
+    with Stage('predict', rows_in=1000) as stage:
+        with Stage('writeback', rows_in=1000, hub=1) as step:
+            step.rows_out = 900
+        stage.rows_out = 900
+
+    records = collected_metrics()
+    assert [record['stage'] for record in records] == [
+        'predict.writeback',
+        'predict',
+    ]
+    assert records[0]['hub'] == 1
+    assert records[0]['rows_per_second'] > 0
+    assert records[1]['wall_seconds'] >= records[0]['wall_seconds']
+
+    # One JSON line per finished stage
+    lines = metrics.read_text().splitlines()
+    assert [json.loads(line)['stage'] for line in lines] == [
+        'predict.writeback',
+        'predict',
+    ]
+
+
+def test_peak_rss_of_sub_step(metrics):
+    with Stage('train'):
+        with Stage('small'):
+            np.ones(1000).sum()
+        with Stage('large'):
+            # 200 MB touched and released again
+            np.ones(25_000_000).sum()
+
+    records = {record['stage']: record for record in collected_metrics()}
+    large = records['train.large']['peak_rss_mb']
+    assert large > records['train.small']['peak_rss_mb'] + 100
+    # The stage keeps the peak of its sub-steps
+    assert records['train']['peak_rss_mb'] >= large
+
+
+def test_error_recorded():
+    with pytest.raises(ValueError):
+        with Stage('validate'):
+            raise ValueError("empty reference")
+
+    assert collected_metrics()[0]['error'] == 'ValueError'
+    assert not instrumentation.open_stages()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,85 @@
+import pytest
+import numpy as np
+from hyperopt import STATUS_OK, Trials, fmin, hp, tpe
+from parallel_hpo import RungPruner, rungs, run_studies
+
+space = {'x': hp.uniform('x', -5, 5), 'kind': hp.choice('kind', ['a', 'b'])}
+
+
+def objective(params, study_data, n_jobs, report=None):
+    loss = (params['x'] - study_data['optimum']) ** 2
+    if params['kind'] == 'b':
+        loss += 1
+    return {'loss': loss, 'status': STATUS_OK}
+
+
+def test_run_studies_serial_matches_fmin():
+    studies = {
+        hub_id: (space, 15, {'optimum': optimum})
+        for hub_id, optimum in [(1, 2.0), (4, -1.0)]
+    }
+    best = run_studies(objective, studies, workers=1, seed=42)
+
+    for hub_id, (_, max_evals, study_data) in studies.items():
+        expected = fmin(
+            fn=lambda params: objective(params, study_data, 1),
+            space=space,
+            algo=tpe.suggest,
+            max_evals=max_evals,
+            trials=Trials(),
+            rstate=np.random.default_rng(42),
+            show_progressbar=False,
+        )
+        assert best[hub_id] == expected
+
+
+def test_run_studies_in_pool():
+    studies = {'study': (space, 20, {'optimum': 2.0})}
+    best = run_studies(objective, studies, workers=2, max_concurrent=2, seed=42)
+
+    assert best['study']['kind'] == 0
+    assert abs(best['study']['x'] - 2.0) < 1.5
+
+
+def staged_objective(params, study_data, n_jobs, report=None):
+    loss = (params['x'] - study_data['optimum']) ** 2
+    for resource in [1, 3]:
+        # Lower fidelities see the same ranking, only noisier
+        if report is not None and report(resource, loss + 1 / resource):
+            return {'loss': loss + 1 / resource, 'status': STATUS_OK, 'pruned': True}
+    return {'loss': loss, 'status': STATUS_OK, 'pruned': False}
+
+
+def test_rungs():
+    assert rungs(100, 1000, eta=3) == [100, 300, 900]
+    assert rungs(100, 700, eta=3) == [100, 300]
+    assert rungs(100, 100, eta=3) == []
+
+
+def test_rung_pruner_keeps_top_fraction():
+    pruner = RungPruner(eta=3)
+
+    # The first eta - 1 trials of a rung always go on
+    assert not pruner.report('study', 100, 5.0)
+    assert not pruner.report('study', 100, 4.0)
+    # Then only the best third does
+    assert not pruner.report('study', 100, 1.0)
+    assert pruner.report('study', 100, 3.0)
+    # Rungs and studies are compared separately
+    assert not pruner.report('study', 300, 9.0)
+    assert not pruner.report('other', 100, 9.0)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_studies_with_pruning(workers, capsys):
+    studies = {'study': (space, 20, {'optimum': 2.0})}
+    best = run_studies(
+        staged_objective, studies, workers=workers, seed=42, pruning=True
+    )
+
+    assert abs(best['study']['x'] - 2.0) < 1.5
+    assert '20 trials, 0 pruned' not in capsys.readouterr().out
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,125 @@
+import os
+from contextlib import contextmanager
+
+import pytest
+import joblib
+import numpy as np
+import pandas as pd
+import download
+import predict
+from sklearn.linear_model import LinearRegression
+from predict import load_data, load_model, evict_models, model_file, make_predictions
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    # Point predict to a temporary EFS mount point with an empty cache
+    os.makedirs(tmp_path / 'models')
+    monkeypatch.setattr(predict, 'EFS_MOUNT_POINT', str(tmp_path))
+    monkeypatch.setattr(predict, '_model_cache', predict.OrderedDict())
+    return tmp_path / 'models'
+
+
+def test_load_model_cached(models_dir):
+    joblib.dump({'version': 1}, models_dir / 'bags_1.joblib')
+
+    model = load_model('bags', 1)
+    assert load_model('bags', 1) is model
+
+
+def test_load_model_reloads_new_file(models_dir):
+    path = models_dir / 'bags_1.joblib'
+    joblib.dump({'version': 1}, path)
+    assert load_model('bags', 1)['version'] == 1
+
+    joblib.dump({'version': 2}, path)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert load_model('bags', 1)['version'] == 2
+
+
+def test_evict_models(models_dir):
+    for hub_id in [1, 4]:
+        joblib.dump({'hub_id': hub_id}, models_dir / f'bags_{hub_id}.joblib')
+        load_model('bags', hub_id)
+
+    evict_models(max_bytes=1)
+    assert list(predict._model_cache) == [str(models_dir / 'bags_4.joblib')]
+
+
+def test_model_file_backend(models_dir):
+    path = models_dir / 'bags_1.joblib'
+    compiled_path = models_dir / 'bags_1.npz'
+    joblib.dump({'version': 1}, path)
+    assert model_file('bags', 1, 'compiled') == str(path)
+
+    compiled_path.touch()
+    os.utime(compiled_path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert model_file('bags', 1, 'compiled') == str(compiled_path)
+    assert model_file('bags', 1, 'native') == str(path)
+
+    # A model retrained after it was compiled is used as is
+    os.utime(path, ns=(0, os.stat(compiled_path).st_mtime_ns + 1))
+    assert model_file('bags', 1, 'compiled') == str(path)
+
+
+@pytest.mark.parametrize('multi_output', [False, True])
+def test_make_predictions(models_dir, monkeypatch, multi_output):
+    monkeypatch.setattr(predict, 'MULTI_OUTPUT_MODELS', multi_output)
+    X = np.arange(8, dtype=np.float32).reshape(4, 2)
+    Y = np.column_stack([X[:, 0], 2 * X[:, 0], X[:, 1] + 1])
+    if multi_output:
+        joblib.dump(LinearRegression().fit(X, Y), models_dir / 'all_bags_1.joblib')
+    else:
+        for i, target in enumerate(predict.TARGET_COLUMNS):
+            model = LinearRegression().fit(X, Y[:, i])
+            joblib.dump(model, models_dir / f'{target}_1.joblib')
+
+    data = pd.DataFrame({'hub_id': [1, 4, 1], 'a': [0.0, 9.0, 4.0], 'b': [1.0, 9, 5]})
+    data = make_predictions(data, 1, ['a', 'b'])
+
+    forecasts = data[[f'{target}_used_forecast' for target in predict.TARGET_COLUMNS]]
+    np.testing.assert_allclose(
+        forecasts.iloc[[0, 2]], [[0, 0, 2], [4, 8, 6]], atol=1e-6
+    )
+    assert forecasts.iloc[1].isna().all()
+
+
+class EmptyCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return []
+
+    def fetchmany(self, size):
+        return []
+
+
+class EmptyConnection:
+    def cursor(self, name=None):
+        return EmptyCursor()
+
+
+@contextmanager
+def empty_connection():
+    yield EmptyConnection()
+
+
+# After a run no row is missing a forecast, nothing is selected
+@pytest.mark.parametrize('stream', [False, True])
+def test_load_data_nothing_to_predict(monkeypatch, stream):
+    monkeypatch.setattr(download, 'db_connection', empty_connection)
+    data = load_data(stream=stream)
+
+    assert data.empty
+    assert {'delivery_time', 'day_of_week', 'hub_id'} <= set(data.columns)
+
+
+if __name__ == '__main__':
+    pytest.main()
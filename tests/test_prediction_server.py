@@ -0,0 +1,184 @@
+import os
+import json
+import threading
+import http.client
+
+import pytest
+import joblib
+import numpy as np
+import pandas as pd
+import predict
+from instrumentation import clear_metrics, collected_metrics
+from sklearn.linear_model import LinearRegression
+from prediction_server import (
+    FEATURES,
+    LatencyStats,
+    MicroBatcher,
+    PredictionServer,
+    orders_frame,
+)
+from synthetic_data import generate_orders
+
+
+def order_records(rows):
+    data = generate_orders(rows, seed=5)
+    data = data.drop(columns=data.filter(regex='_used').columns)
+    data['delivery_time'] = data['delivery_time'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return data.to_dict('records')
+
+
+def test_micro_batcher_combines_requests():
+    batch_sizes = []
+
+    def predict_batch(data):
+        batch_sizes.append(len(data))
+        return data.assign(forecast=data['x'] * 2)
+
+    batcher = MicroBatcher(predict_batch, max_rows=100, max_wait_ms=200)
+    frames = [pd.DataFrame({'x': [i, i + 0.5]}) for i in range(10)]
+    futures = [None] * len(frames)
+
+    def submit(i):
+        futures[i] = batcher.submit(frames[i])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every request gets the rows of its own orders
+    for frame, future in zip(frames, futures):
+        result = future.result(timeout=10)
+        assert result['forecast'].tolist() == (frame['x'] * 2).tolist()
+    assert sum(batch_sizes) == 20
+    assert len(batch_sizes) < 10
+    batcher.close()
+
+
+def test_micro_batcher_max_rows_and_errors():
+    batch_sizes = []
+
+    def predict_batch(data):
+        batch_sizes.append(len(data))
+        if data['x'].isna().any():
+            raise ValueError('missing x')
+        return data
+
+    batcher = MicroBatcher(predict_batch, max_rows=4, max_wait_ms=200)
+    futures = [batcher.submit(pd.DataFrame({'x': [1.0, 2.0]})) for _ in range(4)]
+    for future in futures:
+        future.result(timeout=10)
+    assert batch_sizes == [4, 4]
+
+    # A failed batch fails its requests, not the batcher
+    with pytest.raises(ValueError):
+        batcher.submit(pd.DataFrame({'x': [np.nan]})).result(timeout=10)
+    assert len(batcher.submit(pd.DataFrame({'x': [3.0]})).result(timeout=10)) == 1
+    batcher.close()
+
+
+def test_latency_stats():
+    stats = LatencyStats(window=100)
+    for ms in range(1, 101):
+        stats.record(ms / 1000, 2)
+    stats.record(0.5, 0, error=True)
+
+    snapshot = stats.snapshot()
+    assert snapshot['requests'] == 101
+    assert snapshot['orders'] == 200
+    assert snapshot['errors'] == 1
+    # The window holds the latest 100 requests, 2..100 ms and the failed one
+    assert snapshot['p50_ms'] == pytest.approx(51.5)
+    assert snapshot['p99_ms'] == pytest.approx(100 + 0.01 * 400)
+    assert snapshot['orders_per_second'] > 0
+
+
+def test_orders_frame():
+    orders = order_records(3)
+    # Categories without goods may be left out
+    del orders[0]['cat_10_frozen_vu']
+    data = orders_frame(orders, [1, 4])
+
+    assert data.shape[0] == 3
+    assert data.loc[0, 'cat_10_frozen_vu'] == 0
+    assert data['delivery_time'].dtype == 'datetime64[ns, UTC]'
+    assert set(FEATURES) <= set(data.columns)
+
+    order = dict(orders[1])
+    del order['total_weight']
+    with pytest.raises(ValueError, match='total_weight'):
+        orders_frame([order], [1, 4])
+    with pytest.raises(ValueError, match='No models'):
+        orders_frame([{**orders[1], 'hub_id': 7}], [1, 4])
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # Linear models of the first feature, per target and hub
+    os.makedirs(tmp_path / 'models')
+    monkeypatch.setattr(predict, 'EFS_MOUNT_POINT', str(tmp_path))
+    monkeypatch.setattr(predict, '_model_cache', predict.OrderedDict())
+    X = np.zeros((4, len(FEATURES)), dtype=np.float32)
+    X[:, 0] = np.arange(4)
+    for hub_id in predict.HUB_IDS:
+        for i, target in enumerate(predict.TARGET_COLUMNS):
+            model = LinearRegression().fit(X, X[:, 0] * (i + 1) + hub_id)
+            joblib.dump(model, tmp_path / 'models' / f'{target}_{hub_id}.joblib')
+
+    server = PredictionServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None):
+    conn = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    conn.request(method, path, body=None if body is None else json.dumps(body))
+    response = conn.getresponse()
+    result = response.status, json.loads(response.read())
+    conn.close()
+    return result
+
+
+def test_server_predict(server):
+    orders = order_records(20)
+    clear_metrics()
+    assert request(server, 'GET', '/health') == (
+        200,
+        {'status': 'ok', 'hub_ids': [1, 4]},
+    )
+
+    status, forecast = request(server, 'POST', '/predict', orders[0])
+    assert status == 200
+    assert forecast['order_id'] == orders[0]['order_id']
+    first_feature = orders[0][FEATURES[0]]
+    assert forecast['cold_bags_used_forecast'] == pytest.approx(
+        first_feature + orders[0]['hub_id'], abs=1e-3
+    )
+    assert forecast['deep_frozen_bags_used_forecast'] == pytest.approx(
+        3 * first_feature + orders[0]['hub_id'], abs=1e-3
+    )
+
+    status, forecasts = request(server, 'POST', '/predict', orders)
+    assert status == 200
+    assert [f['order_id'] for f in forecasts] == [o['order_id'] for o in orders]
+    assert forecasts[0] == forecast
+
+    status, error = request(server, 'POST', '/predict', [{'order_id': 1}])
+    assert status == 400 and 'hub_id' in error['error']
+
+    status, metrics = request(server, 'GET', '/metrics')
+    assert metrics['requests'] == 3
+    assert metrics['orders'] == 21
+    assert metrics['errors'] == 1
+    assert metrics['batches'] == 2
+    assert metrics['p50_ms'] > 0
+    # Batches are not recorded as stages
+    assert collected_metrics() == []
+
+
+if __name__ == '__main__':
+    pytest.main()
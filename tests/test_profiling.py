@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import profiling
+from profiling import profiled, hot_functions, folded_stacks
+
+
+def busy(n):
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+
+def test_not_profiled_stage_is_unchanged(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_STAGES', ['train'])
+
+    assert profiled('predict')(busy) is busy
+
+
+def test_sampling_profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILE_STAGES', ['predict'])
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    wrapped = profiled('predict')(busy)
+
+    assert wrapped is not busy
+    assert wrapped(2000000) == busy(2000000)
+
+    speedscope = json.loads(
+        next(tmp_path.glob('predict_*.speedscope.json')).read_text()
+    )
+    profile = speedscope['profiles'][0]
+    assert profile['type'] == 'sampled'
+    assert len(profile['samples']) == len(profile['weights']) > 0
+    frames = speedscope['shared']['frames']
+    assert 'busy' in [frame['name'] for frame in frames]
+
+    folded = next(tmp_path.glob('predict_*.folded')).read_text()
+    assert 'busy (test_profiling.py' in folded
+    top = next(tmp_path.glob('predict_*.top.txt')).read_text()
+    assert 'busy (test_profiling.py' in top.splitlines()[1]
+
+
+def test_deterministic_profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILE_STAGES', ['train'])
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', 'deterministic')
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    assert profiled('train')(busy)(1000) == busy(1000)
+    assert list(tmp_path.glob('train_*.pstats'))
+    assert 'busy' in next(tmp_path.glob('train_*.top.txt')).read_text()
+
+
+def test_profile_written_on_error(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILE_STAGES', ['ingest'])
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    def failing():
+        busy(100000)
+        raise ValueError('bad input')
+
+    with pytest.raises(ValueError):
+        profiled('ingest')(failing)()
+    assert list(tmp_path.glob('ingest_*.top.txt'))
+
+
+def test_hot_functions_self_and_total():
+    main = ('main', 'pipeline.py', 1)
+    fit = ('fit', 'train.py', 10)
+    stacks = {(main,): 1.0, (main, fit): 3.0}
+
+    lines = hot_functions(stacks).splitlines()
+    assert 'fit (train.py:10)' in lines[1]
+    assert '75.0%' in lines[1]
+    # main is on every stack
+    assert '100.0%' in lines[2]
+    assert folded_stacks(stacks) == (
+        "main (pipeline.py:1) 1000\nmain (pipeline.py:1);fit (train.py:10) 3000\n"
+    )
+
+
+if __name__ == '__main__':
+    pytest.main()
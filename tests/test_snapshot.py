@@ -0,0 +1,102 @@
+import glob
+
+import pytest
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from snapshot import (
+    write_snapshot,
+    read_snapshot,
+    snapshot_columns,
+    as_snapshot,
+    latest_delivery_time,
+)
+
+
+@pytest.fixture
+def sample_data():
+    # Sample DataFrame to be used in tests
+    return pd.DataFrame(
+        {
+            'order_id': [3, 1, 2, 4],
+            'hub_id': [1, 4, 1, 1],
+            'delivery_time': pd.to_datetime(
+                [
+                    '2022-01-05 12:00:00',
+                    '2022-02-01 13:00:00',
+                    '2022-03-01 10:00:00',
+                    '2022-03-02 10:00:00',
+                ],
+                utc=True,
+            ),
+            'bags_used': [5.0, 2.0, None, 1.0],
+        }
+    )
+
+
+def test_snapshot_roundtrip(sample_data, tmp_path):
+    path = str(tmp_path / 'current_state.parquet')
+    write_snapshot(sample_data, path)
+
+    data = read_snapshot(path)
+    assert sorted(data.columns) == sorted(sample_data.columns)
+    assert data['order_id'].tolist() == [1, 2, 3, 4]
+    assert data['delivery_time'].dtype == 'datetime64[ns, UTC]'
+    assert data['hub_id'].dtype == 'int64'
+    assert sorted(snapshot_columns(path)) == sorted(sample_data.columns)
+
+
+def test_snapshot_files_ordered(tmp_path):
+    rows = 200000
+    data = pd.DataFrame(
+        {
+            'order_id': np.random.default_rng(0).permutation(rows),
+            'hub_id': 1,
+            'delivery_time': pd.Timestamp('2022-01-05', tz='UTC'),
+        }
+    )
+    path = str(tmp_path / 'current_state.parquet')
+    write_snapshot(data, path)
+
+    # The same data always gives the same files
+    (file,) = glob.glob(f'{path}/**/*.parquet', recursive=True)
+    assert pq.read_table(file)['order_id'].to_pylist() == list(range(rows))
+
+
+def test_snapshot_overwrite(sample_data, tmp_path):
+    path = str(tmp_path / 'current_state.parquet')
+    write_snapshot(sample_data, path)
+    write_snapshot(sample_data[sample_data.hub_id == 4], path)
+
+    assert read_snapshot(path)['order_id'].tolist() == [1]
+
+
+def test_read_snapshot_pushdown(sample_data, tmp_path):
+    path = str(tmp_path / 'current_state.parquet')
+    write_snapshot(sample_data, path)
+
+    data = read_snapshot(
+        path, columns=['bags_used'], hub_ids=[1], start='2022-01-06', end='2022-03-02'
+    )
+    assert data.columns.tolist() == ['bags_used']
+    assert data.shape[0] == 1
+    assert pd.isna(data['bags_used'].iloc[0])
+
+
+def test_as_snapshot(sample_data, tmp_path):
+    # The in-memory frame matches what is read back from the files
+    path = str(tmp_path / 'current_state.parquet')
+    write_snapshot(sample_data, path)
+
+    pd.testing.assert_frame_equal(as_snapshot(sample_data), read_snapshot(path))
+
+
+def test_latest_delivery_time(sample_data, tmp_path):
+    path = str(tmp_path / 'current_state.parquet')
+    write_snapshot(sample_data, path)
+
+    assert latest_delivery_time(path) == pd.Timestamp('2022-03-02 10:00', tz='UTC')
+
+
+if __name__ == '__main__':
+    pytest.main()
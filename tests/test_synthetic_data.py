@@ -0,0 +1,72 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from column_generator import get_column_names
+from ingest import ingest_chunks
+from transform import transform_data
+from synthetic_data import generate_orders, iter_orders, write_orders_csv
+
+
+@pytest.fixture(scope='module')
+def orders():
+    return generate_orders(20000, seed=1, chunk_rows=5000)
+
+
+def test_columns_match_table(orders):
+    assert list(orders.columns) == get_column_names()
+    assert orders['order_id'].is_unique
+    assert orders['order_id'].is_monotonic_increasing
+    # Later orders are delivered on the same or a later day
+    assert orders['delivery_time'].dt.normalize().is_monotonic_increasing
+
+
+def test_reproducible_for_seed(orders):
+    again = generate_orders(20000, seed=1, chunk_rows=5000)
+    other = generate_orders(20000, seed=2, chunk_rows=5000)
+
+    pd.testing.assert_frame_equal(orders, again)
+    assert not orders['bags_used'].equals(other['bags_used'])
+
+
+def test_chunks(orders):
+    chunks = list(iter_orders(20000, seed=1, chunk_rows=5000))
+
+    assert [len(chunk) for chunk in chunks] == [5000] * 4
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), orders)
+
+
+def test_distributions(orders):
+    # Hubs differ in share and basket size
+    assert set(orders['hub_id']) == {1, 4}
+    positions = orders.groupby('hub_id')['positions'].mean()
+    assert positions[1] > positions[4]
+
+    # cat_ columns are sparse
+    cat_columns = [col for col in orders.columns if col.startswith('cat_')]
+    assert (orders[cat_columns] == 0).to_numpy().mean() > 0.5
+
+    # Fewer orders on Sundays than on Fridays
+    day_of_week = orders['delivery_time'].dt.dayofweek.value_counts()
+    assert day_of_week[6] < day_of_week[4]
+
+    # The latest orders have no actuals and no forecasts yet
+    used_columns = [col for col in orders.columns if '_used' in col]
+    open_orders = orders[used_columns].isna().all(axis=1)
+    assert open_orders.iloc[-1] and not open_orders.iloc[0]
+    assert 0 < open_orders.mean() < 0.05
+
+
+def test_runs_through_ingest_and_transform(orders, tmp_path):
+    csv_file_path = write_orders_csv(tmp_path / 'orders.csv', 3000, chunk_rows=1000)
+    chunks = pd.read_csv(csv_file_path, chunksize=1000)
+
+    data = transform_data(ingest_chunks(chunks))
+
+    assert data.shape[0] > 2000
+    assert not data['bags_used'].isna().any()
+    assert np.issubdtype(data['day_of_week'].dtype, np.integer)
+
+
+if __name__ == '__main__':
+    pytest.main()
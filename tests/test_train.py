@@ -0,0 +1,132 @@
+import os
+
+import pytest
+import numpy as np
+import pandas as pd
+import train
+from sklearn.ensemble import RandomForestRegressor
+from column_generator import build_training_features
+from train import (
+    allocate_threads,
+    continue_model,
+    job_cost,
+    plan_modes,
+    print_scores,
+    score_model,
+    train_model,
+    train_models,
+)
+
+
+def test_allocate_threads_proportional_to_cost():
+    costs = [job_cost('bags', 1000), job_cost('cold_bags', 1000)]
+    threads = allocate_threads(costs, 6)
+
+    # All cores are used, the more expensive job gets more of them
+    assert sum(threads) == 6
+    assert threads[0] > threads[1]
+
+
+def test_allocate_threads_more_jobs_than_cores():
+    assert allocate_threads([10, 5, 1], 2) == [1, 1, 1]
+
+
+def test_allocate_threads_never_zero():
+    threads = allocate_threads([1000, 1], 4)
+    assert threads[1] >= 1
+    assert sum(threads) == 4
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'models')
+    monkeypatch.setattr(train, 'EFS_MOUNT_POINT', str(tmp_path))
+    return tmp_path / 'models'
+
+
+def test_plan_modes(models_dir):
+    now = pd.Timestamp('2024-03-01', tz='UTC')
+    recent = {'full_refit_at': str(now - pd.Timedelta(days=1))}
+    stale = {'full_refit_at': str(now - pd.Timedelta(days=365))}
+    manifest = {'bags_1': recent, 'cold_bags_1': stale, 'bags_4': recent}
+    for name in ['bags_1', 'cold_bags_1']:
+        (models_dir / f'{name}.joblib').touch()
+
+    modes = plan_modes(manifest, 'incremental', now)
+
+    assert modes[(1, 'bags')] == 'incremental'
+    # Full refit when it is due, or the model file or manifest entry is missing
+    assert modes[(1, 'cold_bags')] == 'full'
+    assert modes[(4, 'bags')] == 'full'
+    assert modes[(1, 'deep_frozen_bags')] == 'full'
+    assert set(plan_modes(manifest, 'full', now).values()) == {'full'}
+
+
+def test_continue_model_random_forest():
+    rng = np.random.default_rng(42)
+    X, y = rng.uniform(size=(50, 3)), rng.uniform(size=50)
+    model = RandomForestRegressor(n_estimators=5, random_state=42).fit(X, y)
+    trees = list(model.estimators_)
+
+    model, fit_params = continue_model(model, 'deep_frozen_bags', n_jobs=1)
+    model.fit(X[:10], y[:10], **fit_params)
+
+    # The fitted trees are kept, new ones are grown on the new data
+    assert len(model.estimators_) == 5 + train.TRAIN_INCREMENTAL_TREES
+    assert model.estimators_[:5] == trees
+
+
+@pytest.fixture
+def training_data():
+    rng = np.random.default_rng(42)
+    features = build_training_features(['cat_fruits'])
+    data = pd.DataFrame(rng.uniform(0, 10, (200, len(features))), columns=features)
+    data['hub_id'] = 1
+    for target in train.TARGET_COLUMNS:
+        data[f'{target}_used'] = rng.integers(1, 10, 200).astype('float64')
+        data[f'{target}_used_forecast'] = data[f'{target}_used'] + 1
+    return data, features
+
+
+@pytest.mark.parametrize('regressor', ['random_forest', 'xgboost'])
+def test_train_model_multi_output(training_data, monkeypatch, regressor):
+    data, features = training_data
+    monkeypatch.setattr(train, 'MULTI_OUTPUT_REGRESSOR', regressor)
+    for target in ['deep_frozen_bags', 'bags']:
+        params = {**train.MODEL_PARAMS[target], 'n_estimators': 5}
+        monkeypatch.setitem(train.MODEL_PARAMS, target, params)
+
+    model = train_model(data, train.MULTI_OUTPUT_TARGET, 1, features)
+
+    assert model.predict(data[features].to_numpy()).shape == (200, 3)
+    scores = score_model(model, data, train.MULTI_OUTPUT_TARGET, 1, features)
+    assert list(scores) == train.TARGET_COLUMNS
+
+
+def test_train_models_holds_back_few_new_rows(training_data, models_dir, monkeypatch):
+    data, _ = training_data
+    data['delivery_time'] = pd.date_range('2024-01-01', periods=200, freq='h', tz='UTC')
+    monkeypatch.setattr(train, 'HUB_IDS', [1])
+    trained_until = str(data['delivery_time'].iloc[-3])
+    manifest = {
+        f'{target}_1': {'trained_until': trained_until, 'full_train_seconds': 10.0}
+        for target in train.TARGET_COLUMNS
+    }
+    modes = {(1, target): 'incremental' for target in train.TARGET_COLUMNS}
+
+    # Two new orders are below TRAIN_INCREMENTAL_MIN_ROWS, nothing is trained
+    messages = train_models(data, modes, manifest, max_workers=1, cores=1)
+
+    assert all('2 new orders held back' in message for message in messages[:3])
+    assert manifest['bags_1']['trained_until'] == trained_until
+
+
+def test_print_scores_perfect_test_slice(training_data, capsys):
+    data, _ = training_data
+    y = data['bags_used'].to_numpy()
+    print_scores('bags', data, data, data, y, y)
+    assert 'no errors' in capsys.readouterr().out
+
+
+if __name__ == '__main__':
+    pytest.main()
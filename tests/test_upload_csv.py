@@ -10,7 +10,7 @@ steps_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ste
 sys.path.append(scripts_path)
 sys.path.append(steps_path)
 
-from config import db_connect, TABLE_NAME
+from config import db_connection, TABLE_NAME
 
 
 from column_generator import generate_columns, get_column_names
@@ -30,20 +30,15 @@ def test_upload():
         'bags_forecast_with_id.csv',
     )
 
-    conn = db_connect()
-    cur = conn.cursor()
-
     do_upload(csv_file_path, 0.01)
 
-    # Query to select all data from the table
-    select_query = f"SELECT count(*) FROM {TABLE_NAME} LIMIT 1"
-    cur.execute(select_query)
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            # Query to select all data from the table
+            select_query = f"SELECT count(*) FROM {TABLE_NAME} LIMIT 1"
+            cur.execute(select_query)
 
-    # Fetch all rows from the table
-    rows = cur.fetchall()
+            # Fetch all rows from the table
+            rows = cur.fetchall()
 
     assert rows[0][0] >= 1000
-
-    # Close the cursor and connection
-    cur.close()
-    conn.close()